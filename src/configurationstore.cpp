@@ -0,0 +1,223 @@
+#include <iostream>
+
+#include "Python.h"
+#include "marshal.h"
+
+#include <QFile>
+#include <QMutex>
+#include <QMutexLocker>
+#include <QtConcurrentRun>
+
+#include <kconfig.h>
+#include <ksavefile.h>
+#include <kstandarddirs.h>
+#include <kdebug.h>
+
+#include "configurationstore.h"
+#include "utilities.h"
+
+// the first bytes of paterc.bin; bump the digit whenever the layout changes
+#define PATE_CONFIGURATION_MAGIC "PCF1"
+#define PATE_CONFIGURATION_MAGIC_SIZE 4
+
+
+// Writes run on the global thread pool and are serialised by this mutex.
+// A write that was queued behind a newer one has nothing left to do
+static QMutex writeMutex;
+static int lastWrittenGeneration = 0;
+
+static bool writeConfigurationFile(const QString &path, const QByteArray &data, int generation) {
+    QMutexLocker locker(&writeMutex);
+    if(generation < lastWrittenGeneration)
+        return true;
+    KSaveFile file(path);
+    if(!file.open()) {
+        kDebug() << "Could not open" << path << file.errorString();
+        return false;
+    }
+    file.write(data);
+    if(!file.finalize()) {
+        kDebug() << "Could not write" << path << file.errorString();
+        return false;
+    }
+    lastWrittenGeneration = generation;
+    return true;
+}
+
+
+Pate::ConfigurationStore::ConfigurationStore() {
+    m_dictionary = PyDict_New();
+    m_blobs = PyDict_New();
+    m_allChanged = false;
+    m_generation = 0;
+}
+
+Pate::ConfigurationStore::~ConfigurationStore() {
+    waitForSave();
+    // like the engine, leave the objects to the interpreter
+}
+
+PyObject *Pate::ConfigurationStore::dictionary() {
+    return m_dictionary;
+}
+
+PyObject *Pate::ConfigurationStore::group(const QString &name) {
+    QByteArray key = name.toUtf8();
+    PyObject *group = PyDict_GetItemString(m_dictionary, key.constData());
+    if(group)
+        return group;
+    PyObject *blob = PyDict_GetItemString(m_blobs, key.constData());
+    if(!blob)
+        return 0;
+    group = PyMarshal_ReadObjectFromString(PyString_AS_STRING(blob), PyString_GET_SIZE(blob));
+    if(!group || !PyDict_Check(group)) {
+        if(group)
+            Py_DECREF(group);
+        else
+            Py::traceback(QString("Could not decode configuration group %1").arg(name));
+        PyErr_Clear();
+        // start the group afresh rather than failing every time
+        group = PyDict_New();
+        m_changed.insert(key);
+    }
+    m_decoded.insert(key);
+    PyDict_SetItemString(m_dictionary, key.constData(), group);
+    Py_DECREF(group);
+    return group;
+}
+
+void Pate::ConfigurationStore::markChanged(const QString &name) {
+    m_changed.insert(name.toUtf8());
+}
+
+void Pate::ConfigurationStore::markAllChanged() {
+    m_allChanged = true;
+}
+
+bool Pate::ConfigurationStore::isChanged() const {
+    return m_allChanged || !m_changed.isEmpty();
+}
+
+void Pate::ConfigurationStore::load() {
+    waitForSave();
+    PyDict_Clear(m_dictionary);
+    PyDict_Clear(m_blobs);
+    m_decoded.clear();
+    m_changed.clear();
+    m_allChanged = false;
+    m_path = KStandardDirs::locateLocal("config", "paterc.bin");
+    QString textPath = KStandardDirs::locateLocal("config", "paterc");
+    readBinary(m_path);
+    if(QFile::exists(textPath)) {
+        kDebug() << "Migrating" << textPath;
+        readText(textPath);
+        // write the result straight away and move paterc aside, so that it
+        // is only read once
+        if(save()) {
+            QFile::remove(textPath + ".migrated");
+            QFile::rename(textPath, textPath + ".migrated");
+        }
+    }
+}
+
+bool Pate::ConfigurationStore::readBinary(const QString &path) {
+    QFile file(path);
+    if(!file.open(QIODevice::ReadOnly))
+        return false;
+    QByteArray data = file.readAll();
+    if(!data.startsWith(PATE_CONFIGURATION_MAGIC)) {
+        kDebug() << "Ignoring" << path << "which is not a Pate configuration file";
+        return false;
+    }
+    PyObject *blobs = PyMarshal_ReadObjectFromString(data.data() + PATE_CONFIGURATION_MAGIC_SIZE, data.size() - PATE_CONFIGURATION_MAGIC_SIZE);
+    if(!blobs || !PyDict_Check(blobs)) {
+        if(blobs)
+            Py_DECREF(blobs);
+        else
+            Py::traceback(QString("Could not read %1").arg(path));
+        PyErr_Clear();
+        return false;
+    }
+    PyObject *name, *blob;
+    Py_ssize_t position = 0;
+    while(PyDict_Next(blobs, &position, &name, &blob)) {
+        if(PyString_Check(name) && PyString_Check(blob))
+            PyDict_SetItem(m_blobs, name, blob);
+    }
+    Py_DECREF(blobs);
+    return true;
+}
+
+void Pate::ConfigurationStore::readText(const QString &path) {
+    KConfig config(path, KConfig::SimpleConfig);
+    Py::updateDictionaryFromConfiguration(m_dictionary, &config);
+    // every group read is new to the binary file
+    markAllChanged();
+}
+
+QByteArray Pate::ConfigurationStore::encode() {
+    PyObject *name, *group;
+    Py_ssize_t position = 0;
+    QSet<QByteArray> present;
+    while(PyDict_Next(m_dictionary, &position, &name, &group)) {
+        if(!PyString_Check(name)) {
+            std::cerr << TERMINAL_RED << "Configuration group name not a string; ignoring" << TERMINAL_CLEAR << '\n';
+            continue;
+        }
+        QByteArray key(PyString_AS_STRING(name), PyString_GET_SIZE(name));
+        present.insert(key);
+        // groups put straight into pate.configuration were never marked
+        bool changed = m_allChanged || m_changed.contains(key) || !PyDict_Contains(m_blobs, name);
+        if(!changed)
+            continue;
+        if(!PyDict_Check(group)) {
+            std::cerr << TERMINAL_RED << "configuration value for key '" << key.constData() << "' in top level is not a dictionary; ignoring" << TERMINAL_CLEAR << '\n';
+            continue;
+        }
+        PyObject *blob = PyMarshal_WriteObjectToString(group, Py_MARSHAL_VERSION);
+        if(!blob) {
+            Py::traceback(QString("Could not save configuration group %1; keeping its last saved state").arg(key.constData()));
+            continue;
+        }
+        PyDict_SetItem(m_blobs, name, blob);
+        Py_DECREF(blob);
+    }
+    // decoded groups that are gone from the dictionary have been deleted
+    foreach(QByteArray key, m_decoded) {
+        if(!present.contains(key) && PyDict_GetItemString(m_blobs, key.constData()))
+            PyDict_DelItemString(m_blobs, key.constData());
+    }
+    m_decoded = present;
+    m_changed.clear();
+    m_allChanged = false;
+    PyObject *data = PyMarshal_WriteObjectToString(m_blobs, Py_MARSHAL_VERSION);
+    if(!data) {
+        Py::traceback("Could not encode the configuration");
+        return QByteArray();
+    }
+    QByteArray contents(PATE_CONFIGURATION_MAGIC, PATE_CONFIGURATION_MAGIC_SIZE);
+    contents.append(QByteArray(PyString_AS_STRING(data), PyString_GET_SIZE(data)));
+    Py_DECREF(data);
+    return contents;
+}
+
+bool Pate::ConfigurationStore::save() {
+    QByteArray data = encode();
+    if(data.isEmpty())
+        return false;
+    waitForSave();
+    return writeConfigurationFile(m_path, data, ++m_generation);
+}
+
+void Pate::ConfigurationStore::saveInBackground() {
+    QByteArray data = encode();
+    if(data.isEmpty())
+        return;
+    m_lastSave = QtConcurrent::run(writeConfigurationFile, m_path, data, ++m_generation);
+}
+
+void Pate::ConfigurationStore::waitForSave() {
+    m_lastSave.waitForFinished();
+}
+
+// kate: space-indent on;
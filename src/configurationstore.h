@@ -0,0 +1,88 @@
+#ifndef PATE_CONFIGURATIONSTORE_H
+#define PATE_CONFIGURATIONSTORE_H
+
+#include <QByteArray>
+#include <QFuture>
+#include <QSet>
+#include <QString>
+
+#include "Python.h"
+
+
+namespace Pate {
+
+/**
+ * The ConfigurationStore keeps the configuration of all plugins in a
+ * binary file (paterc.bin). Each group (one per plugin) is stored as its own
+ * marshalled blob, and a group is only unmarshalled when it is first asked
+ * for, so that loading costs little for plugins that are not used.
+ *
+ * Groups are marshalled again only once they have been marked as changed;
+ * every other group is written back from the blob kept from the last load
+ * or save. Building the file contents is cheap, and writing them can be
+ * left to a background thread.
+ *
+ * The old text format, paterc, is read (by evaluating every value) if it
+ * exists, merged into the binary file and renamed to paterc.migrated. Groups
+ * found in it win over the binary ones, so a paterc written by hand, e.g. to
+ * set an option in the [pate] group, is picked up the next time Kate starts.
+ *
+ * All methods must be called with the GIL held.
+ */
+class ConfigurationStore {
+public:
+    ConfigurationStore();
+    ~ConfigurationStore();
+
+    /// The decoded groups, group name => dictionary. This is
+    /// pate.configuration; groups appear in it as they are decoded
+    PyObject *dictionary();
+
+    /// A group, decoded on first use. A borrowed reference, or 0 if there
+    /// is no such group
+    PyObject *group(const QString &name);
+
+    /// Have a group marshalled at the next save
+    void markChanged(const QString &name);
+    /// Have every decoded group marshalled at the next save
+    void markAllChanged();
+    /// Whether anything has been marked as changed since the last save
+    bool isChanged() const;
+
+    /// Forget the groups in memory and read the configuration from disk
+    void load();
+    /// Write the configuration to disk and wait for it to be written.
+    /// Returns false if that failed
+    bool save();
+    /// Write the configuration to disk on a background thread
+    void saveInBackground();
+    /// Wait for the last background save to finish
+    void waitForSave();
+
+private:
+    // read paterc.bin into m_blobs; false if there is no usable file
+    bool readBinary(const QString &path);
+    // read the groups of the text format straight into m_dictionary
+    void readText(const QString &path);
+    // marshal the changed groups and return the contents of paterc.bin
+    QByteArray encode();
+
+    QString m_path;
+    // group name => decoded dictionary
+    PyObject *m_dictionary;
+    // group name => marshalled group, as last read or saved
+    PyObject *m_blobs;
+    // the groups that have been decoded, to notice deleted ones
+    QSet<QByteArray> m_decoded;
+    // the groups to marshal at the next save
+    QSet<QByteArray> m_changed;
+    bool m_allChanged;
+    // background saves are numbered so that an older one never overwrites
+    // a newer one
+    int m_generation;
+    QFuture<bool> m_lastSave;
+};
+
+} // namespace Pate
+
+#endif
@@ -0,0 +1,344 @@
+
+#include "Python.h"
+
+#include <kate/mainwindow.h>
+#include <kate/documentmanager.h>
+#include <ktexteditor/document.h>
+#include <ktexteditor/view.h>
+#include <ktexteditor/range.h>
+#include <ktexteditor/cursor.h>
+
+#include <kdebug.h>
+
+#include "dispatcher.h"
+#include "utilities.h"
+
+
+Pate::Dispatcher::Dispatcher(QObject *parent) : QObject(parent) {
+    static const char *names[EventCount] = {
+        "viewChanged", "viewCreated", "documentCreated", "documentWillBeDeleted",
+        "textInserted", "textRemoved", "documentReloaded", "documentUrlChanged",
+        "cursorPositionChanged", "selectionChanged"
+    };
+    for(int i = 0; i < EventCount; ++i) {
+        m_events[i].name = names[i];
+        m_events[i].listeners = 0;
+        m_events[i].count = 0;
+        m_events[i].dispatched = 0;
+        m_events[i].calls = 0;
+    }
+    for(int i = 0; i < 3; ++i)
+        m_arguments[i] = 0;
+    m_wrapInstance = 0;
+    for(int i = 0; i < ClassCount; ++i)
+        m_classes[i] = 0;
+    m_documentManagerAttached = false;
+}
+
+Pate::Dispatcher::~Dispatcher() {
+    // the interpreter is gone by the time the engine and its dispatcher are
+    // deleted, so the Python references are deliberately not released
+}
+
+void Pate::Dispatcher::attach(Kate::MainWindow *window) {
+    // the dispatcher outlives the plugin, so disabling and enabling Pate
+    // attaches the same windows again
+    connect(window, SIGNAL(viewChanged()), this, SLOT(viewChanged()), Qt::UniqueConnection);
+    connect(window, SIGNAL(viewCreated(KTextEditor::View*)), this, SLOT(viewCreated(KTextEditor::View*)), Qt::UniqueConnection);
+}
+
+void Pate::Dispatcher::attach(Kate::DocumentManager *documentManager) {
+    if(m_documentManagerAttached)
+        return;
+    m_documentManagerAttached = true;
+    connect(documentManager, SIGNAL(documentCreated(KTextEditor::Document*)), this, SLOT(documentCreated(KTextEditor::Document*)));
+    connect(documentManager, SIGNAL(documentWillBeDeleted(KTextEditor::Document*)), this, SLOT(documentWillBeDeleted(KTextEditor::Document*)));
+    foreach(KTextEditor::Document *document, documentManager->documents())
+        connectDocument(document);
+}
+
+void Pate::Dispatcher::connectDocument(KTextEditor::Document *document) {
+    connect(document, SIGNAL(textInserted(KTextEditor::Document*, const KTextEditor::Range&)),
+        this, SLOT(textInserted(KTextEditor::Document*, const KTextEditor::Range&)));
+    connect(document, SIGNAL(textRemoved(KTextEditor::Document*, const KTextEditor::Range&)),
+        this, SLOT(textRemoved(KTextEditor::Document*, const KTextEditor::Range&)));
+    // the text can be replaced wholesale without textInserted or textRemoved
+    connect(document, SIGNAL(reloaded(KTextEditor::Document*)), this, SLOT(documentReloaded(KTextEditor::Document*)));
+    connect(document, SIGNAL(documentUrlChanged(KTextEditor::Document*)), this, SLOT(documentUrlChanged(KTextEditor::Document*)));
+    // views of every main window, not just the ones attached
+    connect(document, SIGNAL(viewCreated(KTextEditor::Document*, KTextEditor::View*)),
+        this, SLOT(documentViewCreated(KTextEditor::Document*, KTextEditor::View*)));
+    foreach(KTextEditor::View *view, document->views())
+        connectView(view);
+}
+
+void Pate::Dispatcher::connectView(KTextEditor::View *view) {
+    connect(view, SIGNAL(cursorPositionChanged(KTextEditor::View*, const KTextEditor::Cursor&)),
+        this, SLOT(cursorPositionChanged(KTextEditor::View*, const KTextEditor::Cursor&)));
+    connect(view, SIGNAL(selectionChanged(KTextEditor::View*)), this, SLOT(selectionChanged(KTextEditor::View*)));
+}
+
+bool Pate::Dispatcher::setListeners(const QString &event, PyObject *listeners, PyObject *byMimeType) {
+    for(int i = 0; i < EventCount; ++i) {
+        if(event != m_events[i].name)
+            continue;
+        // check everything before changing anything
+        PyObject *mimeType, *mimeListeners;
+        Py_ssize_t position = 0;
+        while(byMimeType && PyDict_Next(byMimeType, &position, &mimeType, &mimeListeners)) {
+            if(!PyString_Check(mimeType) && !PyUnicode_Check(mimeType)) {
+                PyErr_SetString(PyExc_TypeError, "mime types must be strings");
+                return false;
+            }
+            if(!PyTuple_Check(mimeListeners)) {
+                PyErr_SetString(PyExc_TypeError, "listeners must be tuples");
+                return false;
+            }
+        }
+        Event &e = m_events[i];
+        clearEvent(e);
+        Py_INCREF(listeners);
+        e.listeners = listeners;
+        e.count = PyTuple_GET_SIZE(listeners);
+        position = 0;
+        while(byMimeType && PyDict_Next(byMimeType, &position, &mimeType, &mimeListeners)) {
+            if(!PyTuple_GET_SIZE(mimeListeners))
+                continue;
+            // str mime types are taken to be UTF-8 (they are ASCII anyway)
+            PyObject *utf8 = PyUnicode_Check(mimeType) ? PyUnicode_AsUTF8String(mimeType) : (Py_INCREF(mimeType), mimeType);
+            if(!utf8) {
+                PyErr_Clear();
+                continue;
+            }
+            QString name = QString::fromUtf8(PyString_AS_STRING(utf8), PyString_GET_SIZE(utf8));
+            Py_DECREF(utf8);
+            Py_INCREF(mimeListeners);
+            e.byMimeType.insert(name, mimeListeners);
+            e.count += PyTuple_GET_SIZE(mimeListeners);
+        }
+        return true;
+    }
+    PyErr_Format(PyExc_KeyError, "no such event: %s", PQ(event));
+    return false;
+}
+
+void Pate::Dispatcher::clearEvent(Event &event) {
+    Py_CLEAR(event.listeners);
+    foreach(PyObject *listeners, event.byMimeType)
+        Py_DECREF(listeners);
+    event.byMimeType.clear();
+    event.count = 0;
+}
+
+void Pate::Dispatcher::clear() {
+    for(int i = 0; i < EventCount; ++i)
+        clearEvent(m_events[i]);
+}
+
+PyObject *Pate::Dispatcher::counters() {
+    PyObject *counters = PyDict_New();
+    for(int i = 0; i < EventCount; ++i) {
+        PyObject *counter = Py_BuildValue("{s:K,s:K,s:i}",
+            "dispatched", (unsigned PY_LONG_LONG) m_events[i].dispatched,
+            "calls", (unsigned PY_LONG_LONG) m_events[i].calls,
+            "listeners", m_events[i].count);
+        PyDict_SetItemString(counters, m_events[i].name, counter);
+        Py_DECREF(counter);
+    }
+    return counters;
+}
+
+void Pate::Dispatcher::dispatch(EventId id, KTextEditor::Document *document, int count, PyObject *first, PyObject *second) {
+    Event &event = m_events[id];
+    ++event.dispatched;
+    // hold on to the listeners: a listener may replace them while we go
+    PyObject *listeners = event.listeners;
+    PyObject *mimeListeners = 0;
+    if(document && !event.byMimeType.isEmpty())
+        mimeListeners = event.byMimeType.value(document->mimeType());
+    if(!listeners && !mimeListeners) {
+        Py_XDECREF(first);
+        Py_XDECREF(second);
+        return;
+    }
+    Py_XINCREF(listeners);
+    Py_XINCREF(mimeListeners);
+    // reuse the argument tuple unless a listener kept a reference to it
+    PyObject *&arguments = m_arguments[count];
+    if(arguments && arguments->ob_refcnt > 1) {
+        Py_DECREF(arguments);
+        arguments = 0;
+    }
+    if(!arguments) {
+        arguments = PyTuple_New(count);
+        for(int i = 0; i < count; ++i) {
+            Py_INCREF(Py_None);
+            PyTuple_SET_ITEM(arguments, i, Py_None);
+        }
+    }
+    PyObject *values[2] = {first, second};
+    for(int i = 0; i < count; ++i) {
+        PyObject *old = PyTuple_GET_ITEM(arguments, i);
+        PyTuple_SET_ITEM(arguments, i, values[i]);
+        Py_DECREF(old);
+    }
+    // a listener that is re-entered (e.g. it inserts text on textInserted)
+    // must not see its arguments changed under it
+    PyObject *callArguments = arguments;
+    Py_INCREF(callArguments);
+    if(listeners)
+        callListeners(event, listeners, callArguments);
+    if(mimeListeners)
+        callListeners(event, mimeListeners, callArguments);
+    // do not keep documents and views alive until the next event
+    if(callArguments == arguments) {
+        for(int i = 0; i < count; ++i) {
+            PyObject *old = PyTuple_GET_ITEM(arguments, i);
+            Py_INCREF(Py_None);
+            PyTuple_SET_ITEM(arguments, i, Py_None);
+            Py_DECREF(old);
+        }
+    }
+    Py_DECREF(callArguments);
+    Py_XDECREF(listeners);
+    Py_XDECREF(mimeListeners);
+}
+
+void Pate::Dispatcher::callListeners(Event &event, PyObject *listeners, PyObject *arguments) {
+    for(Py_ssize_t i = 0, j = PyTuple_GET_SIZE(listeners); i < j; ++i) {
+        ++event.calls;
+        PyObject *result = PyObject_Call(PyTuple_GET_ITEM(listeners, i), arguments, NULL);
+        if(result)
+            Py_DECREF(result);
+        else
+            Py::traceback(QString("A listener for %1 failed").arg(event.name));
+    }
+}
+
+PyObject *Pate::Dispatcher::wrap(QObject *object, WrappedClass wrappedClass) {
+    if(!m_wrapInstance) {
+        PyObject *sip = PyImport_ImportModule("sip");
+        PyObject *ktexteditor = PyImport_ImportModule("PyKDE4.ktexteditor");
+        PyObject *ns = ktexteditor ? PyObject_GetAttrString(ktexteditor, "KTextEditor") : 0;
+        if(!sip || !ns) {
+            Py::traceback("Could not import sip and KTextEditor for the dispatcher.");
+            Py_XDECREF(sip);
+            Py_XDECREF(ktexteditor);
+            return 0;
+        }
+        m_wrapInstance = PyObject_GetAttrString(sip, "wrapinstance");
+        m_classes[ViewClass] = PyObject_GetAttrString(ns, "View");
+        m_classes[DocumentClass] = PyObject_GetAttrString(ns, "Document");
+        Py_DECREF(ns);
+        Py_DECREF(ktexteditor);
+        Py_DECREF(sip);
+    }
+    PyObject *result = PyObject_CallFunction(m_wrapInstance, (char *) "NO", PyLong_FromVoidPtr(object), m_classes[wrappedClass]);
+    if(!result)
+        Py::traceback("failed to wrap instance");
+    return result;
+}
+
+// Each slot returns straight away if nobody listens, without taking the GIL.
+// Views and documents are only wrapped once we know they will be used
+
+#if THREADED
+#define PATE_DISPATCH_BEGIN(id) \
+    if(!m_events[id].count) { ++m_events[id].dispatched; return; } \
+    PyGILState_STATE state = PyGILState_Ensure();
+#define PATE_DISPATCH_END PyGILState_Release(state);
+#else
+#define PATE_DISPATCH_BEGIN(id) \
+    if(!m_events[id].count) { ++m_events[id].dispatched; return; }
+#define PATE_DISPATCH_END
+#endif
+
+void Pate::Dispatcher::viewChanged() {
+    PATE_DISPATCH_BEGIN(ViewChanged)
+    // the event is about the document of the window's new active view
+    Kate::MainWindow *window = qobject_cast<Kate::MainWindow*>(sender());
+    KTextEditor::View *view = window ? window->activeView() : 0;
+    dispatch(ViewChanged, view ? view->document() : 0, 0);
+    PATE_DISPATCH_END
+}
+
+void Pate::Dispatcher::viewCreated(KTextEditor::View *view) {
+    PATE_DISPATCH_BEGIN(ViewCreated)
+    PyObject *v = wrap(view, ViewClass);
+    if(v)
+        dispatch(ViewCreated, view->document(), 1, v);
+    PATE_DISPATCH_END
+}
+
+void Pate::Dispatcher::documentCreated(KTextEditor::Document *document) {
+    connectDocument(document);
+    PATE_DISPATCH_BEGIN(DocumentCreated)
+    PyObject *d = wrap(document, DocumentClass);
+    if(d)
+        dispatch(DocumentCreated, document, 1, d);
+    PATE_DISPATCH_END
+}
+
+void Pate::Dispatcher::documentWillBeDeleted(KTextEditor::Document *document) {
+    PATE_DISPATCH_BEGIN(DocumentWillBeDeleted)
+    PyObject *d = wrap(document, DocumentClass);
+    if(d)
+        dispatch(DocumentWillBeDeleted, document, 1, d);
+    PATE_DISPATCH_END
+}
+
+void Pate::Dispatcher::documentViewCreated(KTextEditor::Document *, KTextEditor::View *view) {
+    connectView(view);
+}
+
+void Pate::Dispatcher::textInserted(KTextEditor::Document *document, const KTextEditor::Range &range) {
+    PATE_DISPATCH_BEGIN(TextInserted)
+    PyObject *d = wrap(document, DocumentClass);
+    if(d)
+        dispatch(TextInserted, document, 2, d, Py_BuildValue("(iiii)", range.start().line(), range.start().column(), range.end().line(), range.end().column()));
+    PATE_DISPATCH_END
+}
+
+void Pate::Dispatcher::textRemoved(KTextEditor::Document *document, const KTextEditor::Range &range) {
+    PATE_DISPATCH_BEGIN(TextRemoved)
+    PyObject *d = wrap(document, DocumentClass);
+    if(d)
+        dispatch(TextRemoved, document, 2, d, Py_BuildValue("(iiii)", range.start().line(), range.start().column(), range.end().line(), range.end().column()));
+    PATE_DISPATCH_END
+}
+
+void Pate::Dispatcher::documentReloaded(KTextEditor::Document *document) {
+    PATE_DISPATCH_BEGIN(DocumentReloaded)
+    PyObject *d = wrap(document, DocumentClass);
+    if(d)
+        dispatch(DocumentReloaded, document, 1, d);
+    PATE_DISPATCH_END
+}
+
+void Pate::Dispatcher::documentUrlChanged(KTextEditor::Document *document) {
+    PATE_DISPATCH_BEGIN(DocumentUrlChanged)
+    PyObject *d = wrap(document, DocumentClass);
+    if(d)
+        dispatch(DocumentUrlChanged, document, 1, d);
+    PATE_DISPATCH_END
+}
+
+void Pate::Dispatcher::cursorPositionChanged(KTextEditor::View *view, const KTextEditor::Cursor &position) {
+    PATE_DISPATCH_BEGIN(CursorPositionChanged)
+    PyObject *v = wrap(view, ViewClass);
+    if(v)
+        dispatch(CursorPositionChanged, view->document(), 2, v, Py_BuildValue("(ii)", position.line(), position.column()));
+    PATE_DISPATCH_END
+}
+
+void Pate::Dispatcher::selectionChanged(KTextEditor::View *view) {
+    PATE_DISPATCH_BEGIN(SelectionChanged)
+    PyObject *v = wrap(view, ViewClass);
+    if(v)
+        dispatch(SelectionChanged, view->document(), 1, v);
+    PATE_DISPATCH_END
+}
+
+#include "dispatcher.moc"
+
+// kate: space-indent on;
@@ -0,0 +1,130 @@
+#ifndef PATE_DISPATCHER_H
+#define PATE_DISPATCHER_H
+
+#include <QHash>
+#include <QObject>
+#include <QString>
+
+#include "Python.h"
+
+namespace Kate {
+    class MainWindow;
+    class DocumentManager;
+}
+namespace KTextEditor {
+    class Document;
+    class View;
+    class Range;
+    class Cursor;
+}
+
+
+namespace Pate {
+
+/**
+ * The Dispatcher delivers Kate signals straight to the Python listeners
+ * registered for them. The kate package hands it a tuple of listeners per
+ * event whenever the listeners change, so dispatching an event needs no
+ * module lookups and, when nobody listens, no Python at all.
+ *
+ * Events and the arguments their listeners are called with:
+ *   viewChanged()
+ *   viewCreated(view)
+ *   documentCreated(document)
+ *   documentWillBeDeleted(document)
+ *   textInserted(document, (startLine, startColumn, endLine, endColumn))
+ *   textRemoved(document, (startLine, startColumn, endLine, endColumn))
+ *   documentReloaded(document)
+ *   documentUrlChanged(document)
+ *   cursorPositionChanged(view, (line, column))
+ *   selectionChanged(view)
+ *
+ * Listeners can also be registered for documents of a given mime type only.
+ * The mime type of the document an event is about is then looked up once
+ * per event, and only the listeners for it are called on top of the
+ * unfiltered ones.
+ */
+class Dispatcher : public QObject {
+    Q_OBJECT
+public:
+    Dispatcher(QObject *parent);
+    ~Dispatcher();
+
+    /// Dispatch the signals of a main window and its views. Attaching a
+    /// window again does nothing
+    void attach(Kate::MainWindow *window);
+    /// Dispatch the signals of the document manager and its documents
+    void attach(Kate::DocumentManager *documentManager);
+
+    /// Replace the listeners of an event with a tuple of callables and,
+    /// optionally, a dictionary of mime type => tuple of callables. Sets a
+    /// Python exception and returns false if there is no such event or the
+    /// dictionary is malformed
+    bool setListeners(const QString &event, PyObject *listeners, PyObject *byMimeType = 0);
+    /// Drop every listener
+    void clear();
+    /// A new dictionary of event => {"dispatched": n, "calls": n}
+    PyObject *counters();
+
+private slots:
+    void viewChanged();
+    void viewCreated(KTextEditor::View *view);
+    void documentCreated(KTextEditor::Document *document);
+    void documentWillBeDeleted(KTextEditor::Document *document);
+    void documentViewCreated(KTextEditor::Document *document, KTextEditor::View *view);
+    void textInserted(KTextEditor::Document *document, const KTextEditor::Range &range);
+    void textRemoved(KTextEditor::Document *document, const KTextEditor::Range &range);
+    void documentReloaded(KTextEditor::Document *document);
+    void documentUrlChanged(KTextEditor::Document *document);
+    void cursorPositionChanged(KTextEditor::View *view, const KTextEditor::Cursor &position);
+    void selectionChanged(KTextEditor::View *view);
+
+private:
+    enum EventId {
+        ViewChanged, ViewCreated, DocumentCreated, DocumentWillBeDeleted,
+        TextInserted, TextRemoved, DocumentReloaded, DocumentUrlChanged,
+        CursorPositionChanged, SelectionChanged,
+        EventCount
+    };
+    enum WrappedClass { ViewClass, DocumentClass, ClassCount };
+
+    struct Event {
+        const char *name;
+        // a tuple of callables for every document
+        PyObject *listeners;
+        // mime type => tuple of callables for documents of that type only
+        QHash<QString, PyObject*> byMimeType;
+        // the number of listeners, filtered or not, so that the slots can
+        // tell whether anybody listens without taking the GIL
+        int count;
+        quint64 dispatched;
+        quint64 calls;
+    };
+
+    // connect the signals of a document (and its views) or of a view
+    void connectDocument(KTextEditor::Document *document);
+    void connectView(KTextEditor::View *view);
+
+    // Call the listeners of an event about document with up to two
+    // arguments, whose references are stolen. The GIL must be held
+    void dispatch(EventId id, KTextEditor::Document *document, int count, PyObject *first = 0, PyObject *second = 0);
+    // call each of a tuple of listeners
+    void callListeners(Event &event, PyObject *listeners, PyObject *arguments);
+    // forget the listeners of an event
+    void clearEvent(Event &event);
+    // a Python wrapper for a KTextEditor object; a new reference or 0
+    PyObject *wrap(QObject *object, WrappedClass wrappedClass);
+
+    Event m_events[EventCount];
+    // argument tuples of each size, reused between events while nobody
+    // else holds on to them
+    PyObject *m_arguments[3];
+    // sip.wrapinstance and the KTextEditor classes, looked up once
+    PyObject *m_wrapInstance;
+    PyObject *m_classes[ClassCount];
+    bool m_documentManagerAttached;
+};
+
+} // namespace Pate
+
+#endif
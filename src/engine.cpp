@@ -3,13 +3,15 @@
 
 #include <QApplication>
 #include <QLibrary>
+#include <QTimer>
 #include <QStack>
 #include <QDir>
 #include <QFileInfo>
-#include <QFile>
+#include <QDateTime>
 
 #include <kglobal.h>
 #include <kconfig.h>
+#include <kconfiggroup.h>
 #include <kstandarddirs.h>
 #include <kdebug.h>
 #include <kate/application.h>
@@ -21,21 +23,93 @@
 #include "config.h"
 
 #include "engine.h"
+#include "configurationstore.h"
+#include "dispatcher.h"
+#include "pluginindex.h"
 #include "utilities.h"
 
 #define PATE_MODULE_NAME "pate" 
-#define THREADED 0
+// how long saveConfiguration() waits for more changes before writing, in ms
+#define PATE_SAVE_DELAY 2000
 
 
-static PyObject *pate_saveConfiguration(PyObject *self) {
-    if(Pate::Engine::self()->isInitialised())
+static PyObject *pate_saveConfiguration(PyObject *self, PyObject *args) {
+    char *group = 0;
+    if(!PyArg_ParseTuple(args, "|z:saveConfiguration", &group))
+        return 0;
+    if(Pate::Engine::self()->isInitialised()) {
+        Pate::Engine::self()->configurationChanged(group ? QString::fromUtf8(group) : QString());
         Pate::Engine::self()->saveConfiguration();
+    }
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
+static PyObject *pate_configurationChanged(PyObject *self, PyObject *args) {
+    char *group;
+    if(!PyArg_ParseTuple(args, "s:_configurationChanged", &group))
+        return 0;
+    Pate::Engine::self()->configurationChanged(QString::fromUtf8(group));
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
+static PyObject *pate_configurationGroup(PyObject *self, PyObject *args) {
+    char *name;
+    if(!PyArg_ParseTuple(args, "s:configurationGroup", &name))
+        return 0;
+    PyObject *group = Pate::Engine::self()->configurationGroup(QString::fromUtf8(name));
+    if(!group)
+        group = Py_None;
+    Py_INCREF(group);
+    return group;
+}
+
+static PyObject *pate_startupProfile(PyObject *self) {
+    return Pate::Engine::self()->startupProfile();
+}
+
+static PyObject *pate_recordStartupTiming(PyObject *self, PyObject *args) {
+    char *phase, *name;
+    double wall, cpu;
+    if(!PyArg_ParseTuple(args, "eteted:_recordStartupTiming", "utf-8", &phase, "utf-8", &name, &wall, &cpu))
+        return 0;
+    Pate::Engine::self()->recordStartupTiming(QString::fromUtf8(phase), QString::fromUtf8(name), wall, cpu);
+    PyMem_Free(phase);
+    PyMem_Free(name);
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
+static PyObject *pate_setListeners(PyObject *self, PyObject *args) {
+    char *event;
+    PyObject *listeners;
+    PyObject *byMimeType = 0;
+    if(!PyArg_ParseTuple(args, "sO!|O!:_setListeners", &event, &PyTuple_Type, &listeners, &PyDict_Type, &byMimeType))
+        return 0;
+    if(!Pate::Engine::self()->dispatcher()->setListeners(event, listeners, byMimeType))
+        return 0;
     Py_INCREF(Py_None);
     return Py_None;
 }
 
+static PyObject *pate_dispatchCounters(PyObject *self) {
+    return Pate::Engine::self()->dispatcher()->counters();
+}
+
 static PyMethodDef pateMethods[] = {
-    {"saveConfiguration", (PyCFunction) pate_saveConfiguration, METH_NOARGS, NULL},
+    {"saveConfiguration", (PyCFunction) pate_saveConfiguration, METH_VARARGS,
+        "Write the configuration to disk shortly, on a background thread. Pass the name of the group that changed; without one every group in use is written"},
+    {"_configurationChanged", (PyCFunction) pate_configurationChanged, METH_VARARGS, NULL},
+    {"configurationGroup", (PyCFunction) pate_configurationGroup, METH_VARARGS,
+        "A group of the configuration, read from disk on first use, or None if there is no such group"},
+    {"startupProfile", (PyCFunction) pate_startupProfile, METH_NOARGS,
+        "The time spent importing each plugin, in each init callback and wiring up actions as a list of dictionaries, most expensive first"},
+    {"_recordStartupTiming", (PyCFunction) pate_recordStartupTiming, METH_VARARGS, NULL},
+    {"dispatchCounters", (PyCFunction) pate_dispatchCounters, METH_NOARGS,
+        "For each event dispatched by Pate, a dictionary with the number of times it was dispatched, the number of listener calls and the number of listeners"},
+    {"_setListeners", (PyCFunction) pate_setListeners, METH_VARARGS,
+        "Replace the listeners of a dispatched event with a tuple of callables and, optionally, a dictionary of mime type => tuple of callables for documents of that type"},
     {NULL, NULL, 0, NULL}
 };
 
@@ -45,7 +119,14 @@ Pate::Engine::Engine(QObject *parent) : QObject(parent) {
     m_initialised = false;
     m_pythonLibrary = 0;
     m_pluginsLoaded = false;
-    m_configuration = PyDict_New();
+    m_configurationStore = new ConfigurationStore();
+    m_configuration = m_configurationStore->dictionary();
+    m_saveTimer = new QTimer(this);
+    m_saveTimer->setSingleShot(true);
+    m_saveTimer->setInterval(PATE_SAVE_DELAY);
+    connect(m_saveTimer, SIGNAL(timeout()), this, SLOT(writeConfiguration()));
+    m_moduleDictionary = 0;
+    m_dispatcher = new Dispatcher(this);
     reloadConfiguration();
 }
 
@@ -57,6 +138,7 @@ Pate::Engine::~Engine() {
 //         Py_DECREF(m_configuration);
 //         m_configuration = 0;
 //     }
+    delete m_configurationStore;
     if(m_initialised) {
         kDebug() << "Unloading m_pythonLibrary...";
         kDebug() << m_pythonLibrary->unload();
@@ -76,6 +158,8 @@ void Pate::Engine::del() {
     if(!m_self)
         return;
     if(m_self->isInitialised()) {
+        // whatever is still waiting to be saved
+        m_self->flushConfiguration();
         kDebug() << "initialised, acquiring state...";
 #if THREADED
         PyEval_AcquireThread(m_self->m_pythonThreadState);
@@ -119,14 +203,43 @@ bool Pate::Engine::init() {
     PyObject *pate = PyImport_ImportModule(PATE_MODULE_NAME);
 //     kDebug() << "success!";
     PyObject *pateModuleDictionary = PyModule_GetDict(pate);
+    // the module stays in sys.modules for the life of the interpreter, so a
+    // borrowed reference to its dictionary will do for moduleDictionary()
+    m_moduleDictionary = pateModuleDictionary;
+    Py_DECREF(pate);
     // host the configuration dictionary
     PyDict_SetItemString(pateModuleDictionary, "configuration", m_configuration);
     // load the kate module, but find it first, and verify it loads
     QString katePackageDirectory = KStandardDirs::locate("appdata", "plugins/pate/");
     PyObject *sysPath = PyDict_GetItemString(PyModule_GetDict(PyImport_ImportModule("sys")), "path");
     Py::appendStringToList(sysPath, katePackageDirectory);
+    // prefer the precompiled bundle to the source directory, unless the
+    // installed sources have been changed since the bundle was built
+    m_bundle = KStandardDirs::locate("appdata", "plugins/pate/pate-bundle.zip");
+    if(!m_bundle.isEmpty() && bundleIsStale(katePackageDirectory + "kate")) {
+        kDebug() << "Ignoring stale bundle" << m_bundle;
+        m_bundle.clear();
+    }
+    if(!m_bundle.isEmpty()) {
+        PyObject *b = Py::unicode(m_bundle);
+        PyList_Insert(sysPath, 0, b);
+        Py_DECREF(b);
+    }
 //     kDebug() << "Importing Kate...";
     PyObject *katePackage = PyImport_ImportModule("kate");
+    if(!katePackage && !m_bundle.isEmpty()) {
+        Py::traceback(QString("Could not import the kate module from %1. Trying the source instead.").arg(m_bundle));
+        forgetBundle(sysPath);
+        katePackage = PyImport_ImportModule("kate");
+    }
+    if(!m_bundle.isEmpty()) {
+        PyObject *b = Py::unicode(m_bundle);
+        PyDict_SetItemString(pateModuleDictionary, "bundle", b);
+        Py_DECREF(b);
+    }
+    else {
+        PyDict_SetItemString(pateModuleDictionary, "bundle", Py_None);
+    }
     if(!katePackage) {
         Py::traceback("Could not import the kate module. Dieing.");
         del();
@@ -136,25 +249,70 @@ bool Pate::Engine::init() {
     m_initialised = true;
     reloadConfiguration();
 #if THREADED
-    m_pythonThreadState = PyGILState_GetThisThreadState();
-    PyEval_ReleaseThread(m_pythonThreadState);
+    // from now on the GIL is only held while Pate calls into Python (PyQt
+    // takes it for slots and virtual overrides by itself), so that threads
+    // started by plugins get to run while Kate sits in its event loop
+    m_pythonThreadState = PyEval_SaveThread();
 #endif
     return true;
 }
 
+void Pate::Engine::configurationChanged(const QString &group) {
+    if(group.isEmpty())
+        m_configurationStore->markAllChanged();
+    else
+        m_configurationStore->markChanged(group);
+}
+
 void Pate::Engine::saveConfiguration() {
     if(!m_configuration || !m_initialised)
         return;
-    KConfig config("paterc", KConfig::SimpleConfig);
-    Py::updateConfigurationFromDictionary(&config, m_configuration);
-    config.sync();
+    // the window starts with the first request and is not extended by
+    // later ones, so a plugin that saves constantly still gets written
+    if(!m_saveTimer->isActive())
+        m_saveTimer->start();
+}
+
+void Pate::Engine::writeConfiguration() {
+    if(!m_initialised)
+        return;
+#if THREADED
+    PyGILState_STATE state = PyGILState_Ensure();
+#endif
+    // only the changed groups are marshalled here; the file is written by
+    // a worker thread
+    if(m_configurationStore->isChanged())
+        m_configurationStore->saveInBackground();
+#if THREADED
+    PyGILState_Release(state);
+#endif
+}
+
+void Pate::Engine::flushConfiguration() {
+    if(!m_configuration || !m_initialised)
+        return;
+    m_saveTimer->stop();
+#if THREADED
+    PyGILState_STATE state = PyGILState_Ensure();
+#endif
+    if(m_configurationStore->isChanged())
+        m_configurationStore->save();
+    else
+        m_configurationStore->waitForSave();
+#if THREADED
+    PyGILState_Release(state);
+#endif
 }
 void Pate::Engine::reloadConfiguration() {
     if(!m_initialised)
         return;
-    PyDict_Clear(m_configuration);
-    KConfig config("paterc", KConfig::SimpleConfig);
-    Py::updateDictionaryFromConfiguration(m_configuration, &config);
+#if THREADED
+    PyGILState_STATE state = PyGILState_Ensure();
+#endif
+    m_configurationStore->load();
+#if THREADED
+    PyGILState_Release(state);
+#endif
 }
 
 // void Pate::Engine::die() {
@@ -177,12 +335,11 @@ void Pate::Engine::loadPlugins() {
     PyGILState_STATE state = PyGILState_Ensure();
 #endif
 
-    PyObject *pate = PyImport_ImportModule(PATE_MODULE_NAME);
-    PyObject *pateModuleDictionary = PyModule_GetDict(pate);
     // find plugins and load them.
-    findAndLoadPlugins(pateModuleDictionary);
+    findAndLoadPlugins(moduleDictionary());
     m_pluginsLoaded = true;
-    PyObject *func = PyDict_GetItemString(moduleDictionary(), "_pluginsLoaded");
+    m_dispatcher->attach(Kate::application()->documentManager());
+    PyObject *func = moduleFunction("_pluginsLoaded");
     if(!func) {
         kDebug() << "No " << PATE_MODULE_NAME << "._pluginsLoaded set";
     }
@@ -207,7 +364,7 @@ void Pate::Engine::unloadPlugins() {
     PyGILState_STATE state = PyGILState_Ensure();
 #endif
     PyObject *dict = moduleDictionary();
-    PyObject *func = PyDict_GetItemString(dict, "_pluginsUnloaded");
+    PyObject *func = moduleFunction("_pluginsUnloaded");
     if(!func) {
         kDebug() << "No " << PATE_MODULE_NAME << "._pluginsUnloaded set";
     }
@@ -228,6 +385,11 @@ void Pate::Engine::unloadPlugins() {
         if(!Py::call(func))
             std::cerr << "Could not call " << PATE_MODULE_NAME << "._pluginsUnloaded().\n";
     }
+    // whatever the kate package left registered belongs to unloaded plugins
+    m_dispatcher->clear();
+    // plugins save in their unload listeners; do not leave that to a timer
+    // that may never fire
+    flushConfiguration();
 #if THREADED
     PyGILState_Release(state);
 #endif
@@ -242,62 +404,218 @@ void Pate::Engine::findAndLoadPlugins(PyObject *pateModuleDictionary) {
     PyObject *plugins = PyList_New(0);
     Py_INCREF(plugins);
     PyDict_SetItemString(pateModuleDictionary, "plugins", plugins);
-    // get a reference to sys.path, then add the pate directory to it
-    PyObject *sys = PyImport_ImportModule("sys");
-    PyObject *pythonPath = PyDict_GetItemString(PyModule_GetDict(sys), "path");
+    // and a dictionary of module name => directory for everything that can
+    // be imported from the plugin directories. The finder that kate installs
+    // in sys.meta_path uses it instead of every directory going on sys.path
+    PyObject *pluginModules = PyDict_New();
+    PyDict_SetItemString(pateModuleDictionary, "pluginModules", pluginModules);
+    Py_DECREF(pluginModules);
+    // with lazy loading, plugins that have a manifest are only imported
+    // when one of their actions or events is first used
+    bool lazy = booleanOption("lazyLoading", false);
     QStack<QDir> directories;
     // now, find all directories that KDE knows about like ".../share/apps/kate/pate"
     foreach(QString directory, KGlobal::dirs()->findDirs("appdata", "pate")) {
         kDebug() << "Push path" << directory;
         directories.push(QDir(directory));
     }
+    // the index spares us listing and probing every directory on every start
+    PluginIndex index;
     while(!directories.isEmpty()) {
         QDir directory = directories.pop();
-        // add to pate.pluginDirectories and to sys.path
+        // add to pate.pluginDirectories and make its modules importable
         Py::appendStringToList(pluginDirectories, directory.path());
-        PyObject *d = Py::unicode(directory.path());
-        PyList_Insert(pythonPath, 0, d);
-        Py_DECREF(d);
-        // traverse the directory to pate.pluginDirectories and then traverse it
-        QFileInfoList infoList = directory.entryInfoList(QDir::NoDotAndDotDot | QDir::Dirs | QDir::Files);
-        // directories first to add the path
-        foreach(QFileInfo info, infoList) {
-            QString path = info.absoluteFilePath();
-            if(info.isDir()) {
-                QString pluginPath = path+"/"+path.section('/', -1)+".py";
-                QFile f(pluginPath);
-                if(f.exists()) {
-                    PyObject *d = Py::unicode(path);
-                    PyList_Insert(pythonPath, 0, d);
-                    Py_DECREF(d);
-                    path = pluginPath;
-                }
-            }
-
-            if(path.endsWith(".py")) {
-                kDebug() << "Loading" << path;
-                // import and add to pate.plugins
-                QString pluginName = path.section('/', -1).section('.', 0, 0);
-                PyObject *plugin = PyImport_ImportModule(PQ(pluginName));
-                if(plugin) {
-                    PyList_Append(plugins, plugin);
-                    Py_DECREF(plugin);
-                }
-                else {
-                    Py::traceback(QString("Could not load plugin %1").arg(pluginName));
-                }
+        QList<PluginLocation> locations = index.plugins(directory);
+        addPluginModules(pluginModules, directory.absolutePath(), index.modules(directory.absolutePath()));
+        foreach(PluginLocation location, locations) {
+            if(location.kind == "package") {
+                // the package directory is importable so that the plugin
+                // can be split into several modules
+                QString packageDirectory = QFileInfo(location.path).path();
+                addPluginModules(pluginModules, packageDirectory, index.modules(packageDirectory));
             }
+            loadPlugin(pateModuleDictionary, location, lazy);
+        }
+    }
+    // plugins in the bundle come last, and only if a plugin directory did
+    // not provide a plugin of the same name
+    if(!m_bundle.isEmpty()) {
+        KConfig info(m_bundle + ".info", KConfig::SimpleConfig);
+        QStringList bundledPlugins = info.group("Bundle").readEntry("Plugins", QStringList());
+        PyObject *b = Py::unicode(m_bundle);
+        foreach(QString name, bundledPlugins) {
+            if(PyDict_GetItemString(pluginModules, PQ(name)))
+                continue;
+            PyDict_SetItemString(pluginModules, PQ(name), b);
+            PluginLocation location;
+            location.name = name;
+            location.path = m_bundle + "/" + name + ".py";
+            location.kind = "bundle";
+            location.modified = 0;
+            loadPlugin(pateModuleDictionary, location, lazy);
         }
-//         std::cout << "found " << PQ(directory) << "\n";
+        Py_DECREF(b);
+    }
+    index.sync();
+}
+
+void Pate::Engine::loadPlugin(PyObject *pateModuleDictionary, const PluginLocation &location, bool lazy) {
+    Stopwatch stopwatch;
+    if(lazy && deferPlugin(pateModuleDictionary, location.name, location.path)) {
+        kDebug() << "Deferring" << location.path;
+        recordStartupTiming("defer", location.name, stopwatch.wall(), stopwatch.cpu());
+        return;
     }
+    kDebug() << "Loading" << location.path;
+    // import and add to pate.plugins
+    PyObject *plugin = PyImport_ImportModule(PQ(location.name));
+    recordStartupTiming("import", location.name, stopwatch.wall(), stopwatch.cpu());
+    if(plugin) {
+        PyList_Append(PyDict_GetItemString(pateModuleDictionary, "plugins"), plugin);
+        if(lazy)
+            pluginImported(pateModuleDictionary, location.name, location.path, plugin);
+        Py_DECREF(plugin);
+    }
+    else {
+        Py::traceback(QString("Could not load plugin %1").arg(location.name));
+    }
+}
+
+bool Pate::Engine::bundleIsStale(const QString &packageDirectory) {
+    QDateTime built = QFileInfo(m_bundle).lastModified();
+    foreach(QFileInfo info, QDir(packageDirectory).entryInfoList(QStringList() << "*.py", QDir::Files)) {
+        if(info.lastModified() > built)
+            return true;
+    }
+    return false;
+}
+
+void Pate::Engine::forgetBundle(PyObject *sysPath) {
+    PyObject *b = Py::unicode(m_bundle);
+    Py_ssize_t i = PySequence_Index(sysPath, b);
+    if(i >= 0)
+        PySequence_DelItem(sysPath, i);
+    PyErr_Clear();
+    Py_DECREF(b);
+    // drop whatever part of the package did get imported from the bundle
+    PyObject *modules = PyImport_GetModuleDict();
+    PyObject *names = PyDict_Keys(modules);
+    for(Py_ssize_t i = 0, j = PyList_Size(names); i < j; ++i) {
+        PyObject *name = PyList_GetItem(names, i);
+        if(!PyString_Check(name))
+            continue;
+        QString moduleName = PyString_AsString(name);
+        if(moduleName == "kate" || moduleName.startsWith("kate."))
+            PyDict_DelItem(modules, name);
+    }
+    Py_DECREF(names);
+    m_bundle.clear();
+}
+
+void Pate::Engine::addPluginModules(PyObject *pluginModules, const QString &directory, const QStringList &names) {
+    // later directories win, just like they did when each directory was
+    // inserted at the front of sys.path
+    PyObject *d = Py::unicode(directory);
+    foreach(QString name, names)
+        PyDict_SetItemString(pluginModules, PQ(name), d);
+    Py_DECREF(d);
+}
+
+bool Pate::Engine::deferPlugin(PyObject *pateModuleDictionary, const QString &name, const QString &path) {
+    PyObject *func = PyDict_GetItemString(pateModuleDictionary, "_deferPlugin");
+    if(!func) {
+        kDebug() << "No " << PATE_MODULE_NAME << "._deferPlugin set";
+        return false;
+    }
+    PyObject *result = PyObject_CallFunction(func, (char *) "NN", Py::unicode(name), Py::unicode(path));
+    if(!result) {
+        Py::traceback(QString("Could not read the manifest of plugin %1").arg(name));
+        return false;
+    }
+    bool deferred = PyObject_IsTrue(result) == 1;
+    Py_DECREF(result);
+    return deferred;
+}
+
+void Pate::Engine::pluginImported(PyObject *pateModuleDictionary, const QString &name, const QString &path, PyObject *plugin) {
+    PyObject *func = PyDict_GetItemString(pateModuleDictionary, "_pluginImported");
+    if(!func)
+        return;
+    PyObject *result = PyObject_CallFunction(func, (char *) "NNO", Py::unicode(name), Py::unicode(path), plugin);
+    if(!result) {
+        Py::traceback(QString("Could not write the manifest of plugin %1").arg(name));
+        return;
+    }
+    Py_DECREF(result);
+}
+
+bool Pate::Engine::booleanOption(const QString &name, bool defaultValue) {
+    // engine options live in the "pate" group of the configuration. No
+    // plugin can own that group as it shares its name with this module
+    PyObject *group = configurationGroup(PATE_MODULE_NAME);
+    if(!group || !PyDict_Check(group))
+        return defaultValue;
+    PyObject *value = PyDict_GetItemString(group, PQ(name));
+    if(!value)
+        return defaultValue;
+    return PyObject_IsTrue(value) == 1;
+}
+
+void Pate::Engine::recordStartupTiming(const QString &phase, const QString &name, double wall, double cpu) {
+    StartupTiming timing;
+    timing.phase = phase;
+    timing.name = name;
+    timing.wall = wall;
+    timing.cpu = cpu;
+    m_startupProfile.append(timing);
+}
+
+static bool startupTimingMoreExpensive(const Pate::StartupTiming &a, const Pate::StartupTiming &b) {
+    return a.wall > b.wall;
+}
+
+PyObject *Pate::Engine::startupProfile() {
+    QList<StartupTiming> timings = m_startupProfile;
+    qStableSort(timings.begin(), timings.end(), startupTimingMoreExpensive);
+    PyObject *profile = PyList_New(0);
+    foreach(StartupTiming timing, timings) {
+        PyObject *entry = Py_BuildValue("{s:N,s:N,s:d,s:d}",
+            "phase", Py::unicode(timing.phase),
+            "name", Py::unicode(timing.name),
+            "wall", timing.wall,
+            "cpu", timing.cpu);
+        PyList_Append(profile, entry);
+        Py_DECREF(entry);
+    }
+    return profile;
 }
 
 PyObject *Pate::Engine::configuration() {
     return m_configuration;
 }
+PyObject *Pate::Engine::configurationGroup(const QString &name) {
+    return m_configurationStore->group(name);
+}
 PyObject *Pate::Engine::moduleDictionary() {
-    PyObject *pate = PyImport_ImportModule(PATE_MODULE_NAME);
-    return PyModule_GetDict(pate);
+    return m_moduleDictionary;
+}
+Pate::Dispatcher *Pate::Engine::dispatcher() {
+    return m_dispatcher;
+}
+PyObject *Pate::Engine::moduleFunction(const char *name) {
+    QHash<QByteArray, PyObject*>::const_iterator i = m_moduleFunctions.constFind(name);
+    if(i != m_moduleFunctions.constEnd())
+        return i.value();
+    if(!m_moduleDictionary)
+        return 0;
+    // the kate package installs these once, when it is imported; misses are
+    // not remembered in case it has not been imported yet
+    PyObject *func = PyDict_GetItemString(m_moduleDictionary, name);
+    if(func) {
+        Py_INCREF(func);
+        m_moduleFunctions.insert(name, func);
+    }
+    return func;
 }
 PyObject *Pate::Engine::wrap(void *o, QString fullClassName) {
     PyObject *sip = PyImport_ImportModule("sip");
@@ -331,9 +649,10 @@ void Pate::Engine::callModuleFunction(const QString &name) {
 #if THREADED
     PyGILState_STATE state = PyGILState_Ensure();
 #endif
-    PyObject *dict = moduleDictionary();
-    PyObject *func = PyDict_GetItemString(dict, PQ(name));
-    if(!Py::call(func))
+    PyObject *func = moduleFunction(PQ(name));
+    if(!func)
+        kDebug() << "No " << PATE_MODULE_NAME << "." << name << " set";
+    else if(!Py::call(func))
         kDebug() << "Could not call " << PATE_MODULE_NAME << "." << name << "().";    
 #if THREADED
     PyGILState_Release(state);
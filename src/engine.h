@@ -3,14 +3,32 @@
 #define PATE_ENGINE_H
 
 #include <QObject>
+#include <QByteArray>
+#include <QHash>
+#include <QList>
+#include <QString>
+#include <QStringList>
 
 #include "Python.h"
 
 class QLibrary;
+class QTimer;
 
 
 namespace Pate {
 
+struct PluginLocation;
+class Dispatcher;
+class ConfigurationStore;
+
+/// How long one step of start-up took, see Engine::recordStartupTiming
+struct StartupTiming {
+    QString phase;
+    QString name;
+    double wall;
+    double cpu;
+};
+
 /**
  * The Engine class hosts the Python interpreter, loading
  * it into memory within Kate, and then with finding and
@@ -31,12 +49,20 @@ public:
     bool isInitialised();
     
     /// The root configuration used by Python objects. It is a Python
-    /// dictionary
+    /// dictionary of the groups that have been used so far
     PyObject *configuration();
     
+    /// A group of the configuration, decoded on first use. A borrowed
+    /// reference, or 0 if there is no such group
+    PyObject *configurationGroup(const QString &name);
+    
     /// This engine's embedded Python module's dictionary
     PyObject *moduleDictionary();
     
+    /// Delivers Kate's signals to the listeners registered by the kate
+    /// package
+    Dispatcher *dispatcher();
+    
     /// A PyObject* for an arbitrary Qt/KDE object that has been wrapped
     /// by SIP. Nifty.
     PyObject *wrap(void *o, QString className);
@@ -45,8 +71,15 @@ public:
     /// automatically by the destructor, so you shouldn't need it yourself
     void die();
     
-    /// Write out the configuration dictionary to disk
+    /// Note that a group of the configuration has changed, so that it is
+    /// written at the next save. An empty name stands for every group in use
+    void configurationChanged(const QString &group = QString());
+    /// Write the changed groups of the configuration to disk in a moment.
+    /// Saves requested in quick succession are written together, on a
+    /// background thread
     void saveConfiguration();
+    /// Write the configuration to disk now and wait for it to be written
+    void flushConfiguration();
     /// (re)Load the configuration into memory from disk
     void reloadConfiguration();
     
@@ -54,11 +87,28 @@ public:
     void unloadPlugins();
     
     
+    /// Call one of the functions the kate package installed in the pate
+    /// module, such as "_sessionCreated". Functions are looked up once
     void callModuleFunction(const QString &name);
     
+    /// The value of an engine option from the "pate" group of the
+    /// configuration, or defaultValue if it has not been set
+    bool booleanOption(const QString &name, bool defaultValue);
+    
+    /// Remember how long a phase of start-up (e.g "import") took for one
+    /// plugin or callable. Times are in seconds
+    void recordStartupTiming(const QString &phase, const QString &name, double wall, double cpu);
+    /// The start-up timings as a new list of dictionaries, most expensive
+    /// first. This is pate.startupProfile()
+    PyObject *startupProfile();
+    
 // signals:
 //     void populateConfiguration(PyObject *configurationDictionary);
 
+protected slots:
+    // the save timer ran out: write the changed groups in the background
+    void writeConfiguration();
+
 protected:
     Engine(QObject *parent);
     ~Engine();
@@ -66,6 +116,28 @@ protected:
     // Finds and loads Python plugins, given a PyObject module dictionary
     // to load them into
     void findAndLoadPlugins(PyObject *pateModuleDictionary);
+    
+    // Import a plugin (or defer it in lazy mode) and add it to pate.plugins
+    void loadPlugin(PyObject *pateModuleDictionary, const PluginLocation &location, bool lazy);
+    
+    // Whether any source file in packageDirectory is newer than the bundle
+    bool bundleIsStale(const QString &packageDirectory);
+    // Stop importing from the bundle after it failed to provide kate
+    void forgetBundle(PyObject *sysPath);
+    
+    // Make names importable from directory through pate.pluginModules
+    void addPluginModules(PyObject *pluginModules, const QString &directory, const QStringList &names);
+    
+    // The function installed as pate.<name> by the kate package, or 0.
+    // Borrowed; the GIL must be held
+    PyObject *moduleFunction(const char *name);
+    
+    // Lazy loading: ask the kate package to install placeholders for a
+    // plugin instead of importing it. Returns true if the plugin was deferred
+    bool deferPlugin(PyObject *pateModuleDictionary, const QString &name, const QString &path);
+    // Lazy loading: let the kate package know that a plugin has been
+    // imported so that it can update the plugin's manifest
+    void pluginImported(PyObject *pateModuleDictionary, const QString &name, const QString &path, PyObject *plugin);
 
 private:
     static Engine *m_self;
@@ -73,7 +145,18 @@ private:
     bool m_initialised;
     bool m_pluginsLoaded;
     PyObject *m_configuration;
+    ConfigurationStore *m_configurationStore;
+    /// Coalesces calls to saveConfiguration()
+    QTimer *m_saveTimer;
+    /// The dictionary of the pate module, set up by init()
+    PyObject *m_moduleDictionary;
+    /// pate module functions already looked up by moduleFunction()
+    QHash<QByteArray, PyObject*> m_moduleFunctions;
+    Dispatcher *m_dispatcher;
     PyThreadState *m_pythonThreadState;
+    QList<StartupTiming> m_startupProfile;
+    /// The precompiled bundle in use, or empty if running from source
+    QString m_bundle;
 };
 
 
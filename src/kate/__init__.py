@@ -1,13 +1,24 @@
 
 ''' Kate module. '''
 
+import ast
 import sys
 import os
+import time
 import traceback
 import functools
 
+import sip
+
 import pate
+import kate.documents
 import kate.gui
+import kate.importer
+import kate.search
+import kate.statistics
+import kate.tasks
+import kate.threads
+import kate.words
 
 from PyQt4 import QtCore, QtGui
 from PyKDE4 import kdecore, kdeui
@@ -18,6 +29,9 @@ from PyKDE4.ktexteditor import KTextEditor
 plugins = None
 pluginDirectories = None
 
+# plugins are found through pate.pluginModules rather than sys.path
+importer.install()
+
 initialized = False
 
 
@@ -25,6 +39,91 @@ initialized = False
 
 # Configuration
 
+class PluginConfiguration(object):
+    ''' The configuration of one plugin: a persistent dictionary bound to the
+    plugin's name when it is created, so that using it involves no guessing
+    of who is calling. Get the one for your plugin at import time,
+    
+        configuration = kate.pluginConfiguration(__name__)
+    
+    and use it like a dictionary. It is saved and loaded from disk
+    automatically; call save() after changing a value in place (e.g
+    appending to a list) so that the change is written.
+    
+    Any Python type that the marshal module can store can be used as keys or
+    values -- dictionaries, lists, numbers, strings, sets, and so on. '''
+    def __init__(self, name):
+        self.name = name
+    
+    def __getitem__(self, key):
+        return _configurationGroup(self.name)[key]
+    
+    def __setitem__(self, key, value):
+        _configurationGroup(self.name, create=True)[key] = value
+        pate._configurationChanged(self.name)
+    
+    def __delitem__(self, key):
+        del _configurationGroup(self.name)[key]
+        pate._configurationChanged(self.name)
+    
+    def __contains__(self, key):
+        return key in _configurationGroup(self.name)
+    
+    def __len__(self):
+        return len(_configurationGroup(self.name))
+    
+    def __iter__(self):
+        return iter(_configurationGroup(self.name))
+    
+    def __str__(self):
+        return str(_configurationGroup(self.name))
+    
+    def __repr__(self):
+        return repr(_configurationGroup(self.name))
+    
+    def keys(self):
+        return _configurationGroup(self.name).keys()
+    
+    def values(self):
+        return _configurationGroup(self.name).values()
+    
+    def items(self):
+        return _configurationGroup(self.name).items()
+    
+    def get(self, key, default=None):
+        return _configurationGroup(self.name).get(key, default)
+    
+    def setdefault(self, key, default=None):
+        group = _configurationGroup(self.name, create=True)
+        if key not in group:
+            group[key] = default
+            pate._configurationChanged(self.name)
+        return group[key]
+    
+    def pop(self, key, *default):
+        value = _configurationGroup(self.name).pop(key, *default)
+        pate._configurationChanged(self.name)
+        return value
+    
+    def save(self):
+        ''' Write the configuration to disk. Changes are written a moment
+        later, together with those of other plugins, on a background
+        thread. '''
+        pate.saveConfiguration(self.name)
+
+# plugin name => PluginConfiguration
+_pluginConfigurations = {}
+
+def pluginConfiguration(name):
+    ''' The configuration of the plugin called name, normally __name__ of the
+    plugin module '''
+    try:
+        return _pluginConfigurations[name]
+    except KeyError:
+        view = _pluginConfigurations[name] = PluginConfiguration(name)
+        return view
+
+
 class Configuration:
     ''' Configuration objects provide a configuration dictionary that is
     plugin-specific -- that is, each plugin uses kate.configuration and the
@@ -34,87 +133,96 @@ class Configuration:
     Just go ahead and use kate.configuration as a persistent dictionary.
     Do not instantiate your own Configuration object; use kate.configuration instead.
     
-    Any atomic Python type that is self evaulating can be used as keys or values --
-    dictionaries, lists, numbers, strings, sets, and so on. '''
+    kate.configuration works out the calling plugin on every access by
+    looking at the caller's module, which is slow and gives the wrong answer
+    when used from helper modules or lambdas defined elsewhere. Prefer
+    kate.pluginConfiguration(__name__), which it is built on. '''
     sep = ':'
     def __init__(self, root):
         self.root = root
     
+    def _plugin(self):
+        # the view of whoever called the method that called us
+        return pluginConfiguration(sys._getframe(2).f_globals['__name__'])
+    
     def __getitem__(self, key):
-        plugin = sys._getframe(1).f_globals['__name__']
-        return self.root.get(plugin, {})[key]
+        return self._plugin()[key]
     
     def __setitem__(self, key, value):
-        plugin = sys._getframe(1).f_globals['__name__']
-        if plugin not in self.root:
-            self.root[plugin] = {}
-        self.root[plugin][key] = value
+        self._plugin()[key] = value
     
     def __delitem__(self, key):
-        plugin = sys._getframe(1).f_globals['__name__']
-        del self.root.get(plugin, {})[key]
+        del self._plugin()[key]
     
     def __contains__(self, key):
-        plugin = sys._getframe(1).f_globals['__name__']
-        return key in self.root.get(plugin, {})
+        return key in self._plugin()
     
     def __len__(self):
-        plugin = sys._getframe(1).f_globals['__name__']
-        return len(self.root.get(plugin, {}))
+        return len(self._plugin())
     
     def __iter__(self):
-        plugin = sys._getframe(1).f_globals['__name__']
-        return iter(self.root.get(plugin, {}))
+        return iter(self._plugin())
     
     def __str__(self):
-        plugin = sys._getframe(1).f_globals['__name__']
-        return str(self.root.get(plugin, {}))
+        return str(self._plugin())
         
     def __repr__(self):
-        plugin = sys._getframe(1).f_globals['__name__']
-        return repr(self.root.get(plugin, {}))
+        return repr(self._plugin())
     
     def keys(self):
-        plugin = sys._getframe(1).f_globals['__name__']
-        return self.root.get(plugin, {}).keys()
+        return self._plugin().keys()
     
     def values(self):
-        plugin = sys._getframe(1).f_globals['__name__']
-        return self.root.get(plugin, {}).values()
+        return self._plugin().values()
     
     def items(self):
-        plugin = sys._getframe(1).f_globals['__name__']
-        return self.root.get(plugin, {}).items()
+        return self._plugin().items()
     
     def get(self, key, default=None):
-        plugin = sys._getframe(1).f_globals['__name__']
-        try:
-            return self[plugin][key]
-        except KeyError:
-            return default
+        return self._plugin().get(key, default)
     
-    def pop(self, key):
-        value = self[key]
-        del self[key]
-        return value
+    def setdefault(self, key, default=None):
+        return self._plugin().setdefault(key, default)
+    
+    def pop(self, key, *default):
+        return self._plugin().pop(key, *default)
     
     def save(self):
-        pate.saveConfiguration()
+        ''' Write the plugin's configuration to disk, see
+        PluginConfiguration.save() '''
+        self._plugin().save()
     
     def _name(self):
         return sys._getframe(1).f_globals['__name__']
 
+def _configurationGroup(name, create=False):
+    # groups are only read from disk when first used, so go through Pate
+    # rather than looking in pate.configuration
+    group = pate.configurationGroup(name)
+    if group is None:
+        group = {}
+        if create:
+            pate.configuration[name] = group
+    return group
+
 # a configuration shared by all plugins. This can also be used to
-# access plugin-specific configurations
+# access plugin-specific configurations. It only holds the groups that have
+# been used so far; use pate.configurationGroup(name) to get at any group
 globalConfiguration = pate.configuration
 # a plugin-specific configuration
 configuration = Configuration(pate.configuration)
 
 
 def _callAll(l, *args, **kwargs):
-    for f in l:
+    # the listeners of an event know its name, for the statistics
+    _fire(getattr(l, 'event', None), l, *args, **kwargs)
+
+def _fire(event, l, *args, **kwargs):
+    # iterate over a copy: listeners can be added or removed while firing
+    # (lazily loaded plugins register theirs on first use)
+    for f in list(l):
         try:
-            f(*args, **kwargs)
+            statistics.call('listener', event, f, *args, **kwargs)
         except:
             traceback.print_exc()
             sys.stderr.write('\n')
@@ -129,14 +237,133 @@ def _attribute(**attributes):
         return func
     return decorator
 
+class _Listeners(set):
+    # the listeners of an event. Each listener is also remembered under its
+    # module so that reloadPlugin() can unregister a single plugin
+    def __init__(self, event):
+        set.__init__(self)
+        self.event = event
+    
+    def add(self, f):
+        set.add(self, f)
+        _registeredListeners.setdefault(getattr(f, '__module__', None), []).append((self, f))
+    
+    def register(self, func, mimeTypes=None, predicate=None):
+        # the common body of the decorators of events about documents. Used
+        # as @event, or as @event(mimeTypes=..., predicate=...)
+        if func is None:
+            return lambda func: self.register(func, mimeTypes, predicate)
+        self.addFiltered(func, mimeTypes, predicate)
+        return func
+    
+    def addFiltered(self, func, mimeTypes=None, predicate=None):
+        # add func, wrapped in a _FilteredListener if it has a filter.
+        # Returns whatever was added
+        if mimeTypes is not None or predicate is not None:
+            func = _FilteredListener(self.event, func, mimeTypes, predicate)
+        self.add(func)
+        return func
+
+# the document each event is about, from the event's arguments
+_eventDocuments = {
+    'viewChanged': lambda: activeView() and activeView().document(),
+    'viewCreated': lambda view: view.document(),
+    'documentCreated': lambda document: document,
+    'documentWillBeDeleted': lambda document: document,
+    'textInserted': lambda document, range: document,
+    'textRemoved': lambda document, range: document,
+    'documentReloaded': lambda document: document,
+    'documentUrlChanged': lambda document: document,
+    'cursorPositionChanged': lambda view, position: view.document(),
+    'selectionChanged': lambda view: view.document(),
+}
+
+class _FilteredListener(object):
+    # a listener that only wants to hear about documents of some mime types
+    # and/or documents for which predicate(document) is true. The engine
+    # indexes listeners by mime type, so those without a predicate are only
+    # called through this when the event is fired from Python
+    def __init__(self, event, func, mimeTypes, predicate):
+        self.func = func
+        self.__module__ = getattr(func, '__module__', None)
+        self.__name__ = getattr(func, '__name__', repr(func))
+        if isinstance(mimeTypes, basestring):
+            mimeTypes = [mimeTypes]
+        self.mimeTypes = None if mimeTypes is None else frozenset(unicode(m) for m in mimeTypes)
+        self.predicate = predicate
+        self.documentOf = _eventDocuments[event]
+    
+    def __call__(self, *args, **kwargs):
+        document = self.documentOf(*args)
+        if document is None:
+            return
+        if self.mimeTypes is not None and unicode(document.mimeType()) not in self.mimeTypes:
+            return
+        if self.predicate is not None and not self.predicate(document):
+            return
+        return self.func(*args, **kwargs)
+
 def _simpleEventListener(func):
     # automates the most common decorator pattern: calling a bunch
     # of functions when an event has occured
-    func.functions = set()
+    func.functions = _Listeners(func.__name__)
     func.fire = functools.partial(_callAll, func.functions)
     func.clear = func.functions.clear
     return func
 
+class _DispatchedListeners(_Listeners):
+    # the listeners of an event that Pate dispatches natively. Every change
+    # hands the engine a new tuple of them, so the engine never has to look
+    # anything up in Python to fire the event
+    def add(self, f):
+        _Listeners.add(self, f)
+        self.push()
+    
+    def discard(self, f):
+        set.discard(self, f)
+        self.push()
+    
+    def remove(self, f):
+        set.remove(self, f)
+        self.push()
+    
+    def clear(self):
+        set.clear(self)
+        self.push()
+    
+    def push(self):
+        # like the PyQt connections they replace, listeners only hear of
+        # events once Kate has been initialised
+        if not initialized:
+            return
+        listeners = []
+        byMimeType = {}
+        for f in self:
+            if isinstance(f, _FilteredListener) and f.mimeTypes is not None:
+                # the engine checks the mime type, so only a predicate is
+                # left to check here
+                target = f.func if f.predicate is None else f
+                for mimeType in f.mimeTypes:
+                    byMimeType.setdefault(mimeType, []).append(statistics.timed('listener', self.event, target))
+            else:
+                listeners.append(statistics.timed('listener', self.event, f))
+        pate._setListeners(self.event, tuple(listeners), dict((m, tuple(l)) for m, l in byMimeType.iteritems()))
+
+def _dispatchedEventListener(func):
+    # like _simpleEventListener, for events that the engine dispatches
+    # itself. fire() still calls the listeners from Python
+    func.functions = _DispatchedListeners(func.__name__)
+    func.fire = functools.partial(_callAll, func.functions)
+    func.clear = func.functions.clear
+    _dispatchedEvents.append(func)
+    return func
+
+_dispatchedEvents = []
+
+# module name => [(listeners, listener), ...] and module name => [action, ...]
+_registeredListeners = {}
+_registeredActions = {}
+
 # Decorator event listeners
 
 @_simpleEventListener
@@ -155,22 +382,271 @@ def unload(func):
     unload.functions.add(func)
     return func
 
-@_simpleEventListener
-def viewChanged(func):
+@_dispatchedEventListener
+def viewChanged(func=None, mimeTypes=None, predicate=None):
     ''' Calls the function when the view changes. To access the new active view,
-    use kate.activeView() '''
-    viewChanged.functions.add(func)
-    return func
+    use kate.activeView().
+    
+    Like the other events about documents, this can be used as
+    @kate.viewChanged or, to only hear about some documents, with
+        * mimeTypes - a mime type or a list of them, e.g 'text/x-python'.
+                      Listeners filtered by mime type cost nothing for
+                      documents of other types
+        * predicate - a function that is passed the document and returns
+                      whether the listener should be called '''
+    return viewChanged.functions.register(func, mimeTypes, predicate)
 
-@_simpleEventListener
-def viewCreated(func):
+@_dispatchedEventListener
+def viewCreated(func=None, mimeTypes=None, predicate=None):
     ''' Calls the function when a new view is created, passing the view as a
     parameter '''
-    viewCreated.functions.add(func)
-    return func
+    return viewCreated.functions.register(func, mimeTypes, predicate)
+
+@_dispatchedEventListener
+def documentCreated(func=None, mimeTypes=None, predicate=None):
+    ''' Calls the function when a document is created or opened, passing the
+    document as a parameter '''
+    return documentCreated.functions.register(func, mimeTypes, predicate)
+
+@_dispatchedEventListener
+def documentWillBeDeleted(func=None, mimeTypes=None, predicate=None):
+    ''' Calls the function when a document is about to be closed, passing
+    the document as a parameter '''
+    return documentWillBeDeleted.functions.register(func, mimeTypes, predicate)
+
+# Editing events. Pate dispatches these for every keystroke; plugins listen
+# through the coalescing decorators below rather than directly
+
+def _nativeEvent(name):
+    def event(func):
+        event.functions.add(func)
+        return func
+    event.__name__ = name
+    return _dispatchedEventListener(event)
+
+_textInserted = _nativeEvent('textInserted')
+_textRemoved = _nativeEvent('textRemoved')
+# the text replaced without textInserted or textRemoved: reloaded, or another
+# file opened into the document
+_documentReloaded = _nativeEvent('documentReloaded')
+_documentUrlChanged = _nativeEvent('documentUrlChanged')
+_cursorPositionChanged = _nativeEvent('cursorPositionChanged')
+_selectionChanged = _nativeEvent('selectionChanged')
+
+def _insertedAt(position, start, end):
+    # where position ends up after the text between start and end was inserted
+    if position < start:
+        return position
+    if position[0] == start[0]:
+        return (end[0], end[1] + position[1] - start[1])
+    return (position[0] + end[0] - start[0], position[1])
+
+def _removedAt(position, start, end):
+    # where position ends up after the text between start and end was removed
+    if position < start:
+        return position
+    if position < end:
+        return start
+    if position[0] == end[0]:
+        return (start[0], start[1] + position[1] - end[1])
+    return (position[0] - end[0] + start[0], position[1])
+
+class _Coalescer(object):
+    # Stands in for a listener of an editing event. It collects the events of
+    # a burst per document or view and calls the listener once per burst:
+    # after the events have stopped for `debounce` ms, at most once every
+    # `throttle` ms, or, by default, once control returns to the event loop
+    def __init__(self, event, func, debounce=None, throttle=None, mimeTypes=None, predicate=None):
+        self.event = event
+        self.mimeTypes = mimeTypes
+        self.predicate = predicate
+        self.func = func
+        # shows up as the listener's module, e.g. for reloadPlugin()
+        self.__module__ = func.__module__
+        self.__name__ = func.__name__
+        self.debounce = debounce
+        self.throttle = throttle
+        # address of the document or view => [object, merged value]
+        self.pending = {}
+        self.timer = QtCore.QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.connect(self.timer, QtCore.SIGNAL('timeout()'), self.deliver)
+        # [(event, listener), ...]
+        self.listeners = []
+    
+    def listen(self, event, listener):
+        # the listener is registered as the plugin's, see reloadPlugin()
+        listener.__module__ = self.__module__
+        listener = event.functions.addFiltered(listener, self.mimeTypes, self.predicate)
+        self.listeners.append((event, listener))
+    
+    def post(self, obj, merge):
+        key = sip.unwrapinstance(obj)
+        entry = self.pending.get(key)
+        if entry is None:
+            self.pending[key] = [obj, merge(None)]
+        else:
+            entry[0] = obj
+            entry[1] = merge(entry[1])
+        if self.debounce is not None:
+            self.timer.start(self.debounce)
+        elif not self.timer.isActive():
+            self.timer.start(self.throttle or 0)
+    
+    def deliver(self):
+        pending, self.pending = self.pending, {}
+        # unregistered (e.g. by reloadPlugin()) while events were pending
+        if not any(listener in event.functions for event, listener in self.listeners):
+            return
+        for obj, value in pending.itervalues():
+            if not objectIsAlive(obj):
+                continue
+            try:
+                if value is None:
+                    statistics.call('listener', self.event, self.func, obj)
+                else:
+                    statistics.call('listener', self.event, self.func, obj, value)
+            except:
+                traceback.print_exc()
+                sys.stderr.write('\n')
+
+def _coalescingDecorator(register):
+    # turns register(func, debounce, throttle) into a decorator usable as
+    # @decorator or as @decorator(debounce=..., throttle=..., maxRate=...)
+    def decorator(func=None, debounce=None, throttle=None, maxRate=None, mimeTypes=None, predicate=None):
+        if maxRate is not None:
+            throttle = int(1000.0 / maxRate)
+        def decorate(func):
+            register(_Coalescer(register.__name__, func, debounce, throttle, mimeTypes, predicate))
+            return func
+        if func is not None:
+            return decorate(func)
+        return decorate
+    functools.update_wrapper(decorator, register)
+    return decorator
+
+@_coalescingDecorator
+def textChanged(coalescer):
+    ''' Calls the function when the text of a document changes, passing the
+    document and the changed range as (startLine, startColumn, endLine,
+    endColumn). Changes are coalesced: the function is called once per burst
+    of typing with the range covering all of it, in the document's current
+    coordinates. Removed text leaves an empty range where it was.
+    
+    Use as @kate.textChanged or with one of
+        * debounce - call once typing has stopped for this many ms
+        * throttle - call at most once every this many ms
+        * maxRate - call at most this many times a second
+    Without any, all the changes made before control returns to Kate's event
+    loop (e.g. by a single paste or replace) make one call. mimeTypes and
+    predicate filter documents as for kate.viewChanged. '''
+    def inserted(document, range):
+        start, end = range[:2], range[2:]
+        def merge(merged):
+            if merged is None:
+                return start + end
+            mergedStart = _insertedAt(merged[:2], start, end)
+            mergedEnd = _insertedAt(merged[2:], start, end)
+            return min(mergedStart, start) + max(mergedEnd, end)
+        coalescer.post(document, merge)
+    def removed(document, range):
+        start, end = range[:2], range[2:]
+        def merge(merged):
+            if merged is None:
+                return start + start
+            mergedStart = _removedAt(merged[:2], start, end)
+            mergedEnd = _removedAt(merged[2:], start, end)
+            return min(mergedStart, start) + max(mergedEnd, start)
+        coalescer.post(document, merge)
+    coalescer.listen(_textInserted, inserted)
+    coalescer.listen(_textRemoved, removed)
+
+@_coalescingDecorator
+def cursorMoved(coalescer):
+    ''' Calls the function when the cursor of a view moves, passing the view
+    and the new position as (line, column). Coalesced like textChanged (and
+    taking the same arguments); the position passed is the latest one. '''
+    def moved(view, position):
+        coalescer.post(view, lambda merged: position)
+    coalescer.listen(_cursorPositionChanged, moved)
+
+@_coalescingDecorator
+def selectionChanged(coalescer):
+    ''' Calls the function when the selection of a view changes, passing the
+    view. Coalesced like textChanged, and taking the same arguments. '''
+    def changed(view):
+        coalescer.post(view, lambda merged: None)
+    coalescer.listen(_selectionChanged, changed)
+
+class _LazyAction(object):
+    ''' An action registered with @action or from a plugin manifest. The
+    KAction, with its icon and shortcut, is only built once it is needed:
+    when it has a shortcut to bind, when its menu is about to be shown, when
+    Configure Shortcuts is about to be opened or when a plugin uses it. Attributes not found here are looked up on the
+    KAction, so func.action can be used like one. '''
+    def __init__(self, text, icon=None, shortcut=None, menu=None):
+        self.label = unicode(text)
+        self.arguments = (text, icon, shortcut, menu)
+        self.shortcut = shortcut
+        self.menu = menu
+        # called when the action is triggered
+        self.handler = None
+        self.func = None
+        self.manifest = None
+        self.mimeTypes = self.predicate = None
+        self.enabled = True
+        # the window whose action collection the action belongs in, once
+        # wired
+        self.window = None
+        self.qaction = None
+
+    def materialize(self):
+        ''' The KAction, built if need be '''
+        if self.qaction is None:
+            a = self.qaction = _createAction(*self.arguments)
+            a.setEnabled(self.enabled)
+            a.connect(a, QtCore.SIGNAL('triggered()'), self.trigger)
+            if self.window is not None:
+                self.window.actionCollection().addAction(self.label, a)
+        return self.qaction
+
+    def plug(self, window):
+        self.window = window
+        if self.qaction is not None:
+            window.actionCollection().addAction(self.label, self.qaction)
+        elif self.shortcut is not None:
+            # a shortcut only works once there is an action to bind it to
+            self.materialize()
+
+    def unplug(self):
+        ''' Take the KAction out of its menus and action collection and
+        delete it '''
+        window, self.window = self.window, None
+        a, self.qaction = self.qaction, None
+        if a is None:
+            return
+        for w in a.associatedWidgets():
+            w.removeAction(a)
+        if window is not None:
+            window.actionCollection().takeAction(a)
+        a.deleteLater()
+
+    def trigger(self):
+        if self.handler is not None:
+            self.handler()
+
+    def setEnabled(self, enabled):
+        self.enabled = enabled
+        if self.qaction is not None:
+            self.qaction.setEnabled(enabled)
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.materialize(), name)
 
 @_attribute(actions=set())
-def action(text, icon=None, shortcut=None, menu=None):
+def action(text, icon=None, shortcut=None, menu=None, mimeTypes=None, predicate=None):
     ''' Decorator that adds an action to the menu bar. When the item is fired,
     your function is called. Optional shortcuts, menu to place the action in,
     and icon can be specified.
@@ -187,30 +663,115 @@ def action(text, icon=None, shortcut=None, menu=None):
                  QIcon to use any custom icon. None (the default) sets no icon.
         * menu - The menu under which to place this item. Must be a string 
                  such as 'tools' or 'settings', or None to not place it in any
-                 menu. '''
+                 menu.
+        * mimeTypes - A mime type or a list of them. The action is only
+                      enabled while the active document has one of them.
+        * predicate - A function that is passed the active document and
+                      returns whether the action should be enabled. '''
+    if isinstance(mimeTypes, basestring):
+        mimeTypes = [mimeTypes]
     def decorator(func):
-        a = kdeui.KAction(text, None)
-        if shortcut is not None:
-            if isinstance(shortcut, basestring):
-                a.setShortcut(QtGui.QKeySequence(shortcut))
-            else:
-                a.setShortcut(shortcut)
-        if icon is not None:
-            if isinstance(icon, basestring):
-                _icon = kdeui.KIcon(icon) # takes a string parameter
-            elif isinstance(icon, QtGui.QPixmap):
-                _icon = QtGui.QIcon(icon)
-            else:
-                _icon = icon
-            a.setIcon(_icon)
-        a.menu = menu
-        a.connect(a, QtCore.SIGNAL('triggered()'), func)
-        # delay till everything has been initialised
-        action.actions.add(a)
+        # a lazily loaded plugin already has a placeholder action installed
+        # from its manifest; bind to that instead of creating another one
+        a = _placeholderActions.pop((func.__module__, func.__name__), None)
+        if a is None:
+            # nothing is built till the action is wired or used
+            a = _LazyAction(text, icon, shortcut, menu)
+            action.actions.add(a)
+            _registeredActions.setdefault(func.__module__, []).append(a)
+        _filterAction(a, mimeTypes, predicate)
+        a.handler = statistics.timed('action', unicode(text), func)
+        a.func = func
+        a.manifest = {
+            'function': func.__name__,
+            'text': unicode(text),
+            'icon': icon,
+            'shortcut': shortcut,
+            'menu': menu,
+            'mimeTypes': mimeTypes and list(mimeTypes),
+        }
+        if predicate is not None:
+            # cannot go into a manifest
+            a.manifest['predicate'] = predicate
         func.action = a
         return func
     return decorator
 
+def _createAction(text, icon=None, shortcut=None, menu=None):
+    a = kdeui.KAction(text, None)
+    if shortcut is not None:
+        if isinstance(shortcut, basestring):
+            a.setShortcut(QtGui.QKeySequence(shortcut))
+        else:
+            a.setShortcut(shortcut)
+    if icon is not None:
+        if isinstance(icon, basestring):
+            _icon = kdeui.KIcon(icon) # takes a string parameter
+        elif isinstance(icon, QtGui.QPixmap):
+            _icon = QtGui.QIcon(icon)
+        else:
+            _icon = icon
+        a.setIcon(_icon)
+    return a
+
+# mime type => actions enabled only for documents of that type
+_actionsByMimeType = {}
+# actions that are enabled by a predicate alone
+_predicateActions = set()
+# actions with a filter that are enabled right now
+_enabledFilteredActions = set()
+
+def _filterAction(a, mimeTypes=None, predicate=None):
+    # (re)index an action by its filter. An action without one is always
+    # enabled
+    _unfilterAction(a)
+    a.mimeTypes = mimeTypes and frozenset(unicode(m) for m in mimeTypes)
+    a.predicate = predicate
+    if a.mimeTypes:
+        for mimeType in a.mimeTypes:
+            _actionsByMimeType.setdefault(mimeType, set()).add(a)
+    elif predicate is not None:
+        _predicateActions.add(a)
+    else:
+        return
+    # disabled until the active document says otherwise
+    a.setEnabled(False)
+    if initialized:
+        _updateFilteredActions()
+
+def _unfilterAction(a):
+    if getattr(a, 'mimeTypes', None) or getattr(a, 'predicate', None) is not None:
+        a.setEnabled(True)
+    for mimeType in getattr(a, 'mimeTypes', None) or ():
+        actions = _actionsByMimeType.get(mimeType)
+        if actions is not None:
+            actions.discard(a)
+            if not actions:
+                del _actionsByMimeType[mimeType]
+    _predicateActions.discard(a)
+    _enabledFilteredActions.discard(a)
+    a.mimeTypes = a.predicate = None
+
+def _updateFilteredActions():
+    # enable the filtered actions that apply to the active document and
+    # disable the rest, looking only at the actions for its mime type
+    view = activeView()
+    document = view and view.document()
+    enabled = set()
+    if document is not None:
+        for a in _actionsByMimeType.get(unicode(document.mimeType()), ()):
+            if a.predicate is None or a.predicate(document):
+                enabled.add(a)
+        for a in _predicateActions:
+            if a.predicate(document):
+                enabled.add(a)
+    for a in _enabledFilteredActions - enabled:
+        a.setEnabled(False)
+    for a in enabled - _enabledFilteredActions:
+        a.setEnabled(True)
+    _enabledFilteredActions.clear()
+    _enabledFilteredActions.update(enabled)
+
 # End decorators
 
 
@@ -260,6 +821,61 @@ def focusEditor():
     for x in mainWindow().findChildren(QtGui.QWidget):
         print x.__class__.__name__, x.objectName()
 
+def bundle():
+    ''' The path of the precompiled archive that the kate package and the
+    bundled plugins were imported from, or None if they come from source.
+    Bundled expansions live in its "expansions" directory. '''
+    return getattr(pate, 'bundle', None)
+
+def snapshot(document):
+    ''' The whole text of a document as a kate.documents.Snapshot: one
+    unicode string with an index of where its lines start. Fetching it is
+    one bulk transfer; it is cached until the document changes. '''
+    return documents.snapshot(document)
+
+def edit(document):
+    ''' A kate.documents.Edit of a document, which collects changes and
+    applies only what differs from the current text, in one undo step:
+    
+        with kate.edit(document) as edit:
+            edit.setText(reformat(kate.snapshot(document).text))
+    '''
+    return documents.Edit(document)
+
+def cachedPerDocument(func):
+    ''' Decorator that remembers what func(document, *args) returns until
+    the document changes or is closed, e.g.
+    
+        @kate.cachedPerDocument
+        def outline(document):
+            ...
+    
+    All plugins share one cache of bounded size, which drops the least
+    recently used results first. See kate.documents. '''
+    return documents.cachedPerDocument(func)
+
+def wordIndex():
+    ''' The kate.words.WordIndex of the words in all open documents, e.g.
+    wordIndex().complete(u'get', 20) for up to 20 words starting with
+    "get". It is built in the background the first time it is asked for
+    and then kept up to date as documents change. '''
+    return words.index()
+
+def stats():
+    ''' How often each event listener and action was called and how long the
+    calls took, as a list of dictionaries with "kind" ("listener" or
+    "action"), "event" (the event name or action text), "name" (of the
+    callable), "calls", "total", "mean" and "max" (in seconds) and
+    "histogram", a list of (upper bound in seconds, calls). The most time
+    consuming come first. See kate.statistics. '''
+    return statistics.snapshot()
+
+def dispatchCounters():
+    ''' For each event Pate dispatches, a dictionary with the number of times
+    it was dispatched ("dispatched"), the number of listener calls ("calls")
+    and the number of listeners ("listeners") '''
+    return pate.dispatchCounters()
+
 def applicationDirectories(*path):
     path = os.path.join('pate', *path)
     return map(unicode, kdecore.KGlobal.dirs().findDirs("appdata", path))
@@ -279,6 +895,424 @@ def objectIsAlive(obj):
     return True
 
 
+def _option(name, default=None):
+    ''' An engine option from the "pate" group of paterc '''
+    return _configurationGroup('pate').get(name, default)
+
+
+# Start-up profiling
+
+def _startupTimed(phase, name, func, *args, **kwargs):
+    ''' Call func, recording the wall clock and CPU time it took for
+    pate.startupProfile() '''
+    wall, cpu = time.time(), time.clock()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        pate._recordStartupTiming(phase, name, time.time() - wall, time.clock() - cpu)
+
+_callableName = statistics.callableName
+
+def printStartupProfile(stream=None):
+    ''' Write pate.startupProfile() as a table, most expensive first, to
+    stream or standard error. Set startupProfileSummary=True in the [pate]
+    group of paterc to have this done every time Kate starts. '''
+    stream = stream or sys.stderr
+    profile = pate.startupProfile()
+    stream.write('Pate start-up profile (%.1f ms in total):\n' % (sum(t['wall'] for t in profile) * 1000))
+    stream.write('%10s %10s  %-12s %s\n' % ('wall ms', 'CPU ms', 'phase', 'name'))
+    for t in profile:
+        stream.write('%10.1f %10.1f  %-12s %s\n' % (t['wall'] * 1000, t['cpu'] * 1000, t['phase'], t['name']))
+
+
+# Lazy plugin loading
+
+# (module name, function name) => placeholder action awaiting its plugin
+_placeholderActions = {}
+# plugin name => path for plugins that have not been imported yet
+_deferredPlugins = {}
+# plugin name => [(event, placeholder listener), ...]
+_placeholderListeners = {}
+# events that deferred plugins can be woken up by. Unload is missing on
+# purpose: a plugin that was never imported has nothing to clean up
+_lazyEvents = ('init', 'viewChanged', 'viewCreated')
+
+def _manifestPaths(name, path):
+    ''' The manifest shipped alongside the plugin and the automatically
+    generated one in the cache directory, in order of preference '''
+    shipped = os.path.splitext(path)[0] + '.manifest'
+    generated = unicode(kdecore.KStandardDirs.locateLocal('cache', 'pate/manifests/%s.manifest' % name))
+    return shipped, generated
+
+def _modificationTime(path):
+    ''' The modification time of path or, for a plugin inside the bundle,
+    of the bundle '''
+    archive = bundle()
+    if archive and path.startswith(archive + os.sep):
+        path = archive
+    return os.path.getmtime(path)
+
+def _readManifest(name, path):
+    ''' Read the manifest for a plugin. A shipped manifest is trusted as is;
+    a generated one is only used if the plugin has not changed since it was
+    written. Returns None if there is no usable manifest. '''
+    shipped, generated = _manifestPaths(name, path)
+    for manifestPath in (shipped, generated):
+        try:
+            f = open(manifestPath)
+        except IOError:
+            continue
+        try:
+            try:
+                # plain values only: a manifest must not be able to run code
+                manifest = ast.literal_eval(f.read())
+                if not isinstance(manifest, dict):
+                    raise ValueError('not a dictionary')
+            except Exception:
+                traceback.print_exc()
+                sys.stderr.write('Bad plugin manifest %s\n' % manifestPath)
+                continue
+        finally:
+            f.close()
+        if manifestPath == generated:
+            try:
+                if manifest.get('mtime') != _modificationTime(path):
+                    return None
+            except OSError:
+                return None
+        return manifest
+    return None
+
+def _writeManifest(name, path):
+    ''' Record what a freshly imported plugin registered so that it can be
+    loaded lazily next time around '''
+    manifest = {'lazy': True, 'actions': [], 'events': []}
+    for a in action.actions:
+        if getattr(a, 'func', None) is None or a.func.__module__ != name:
+            continue
+        # only actions that can be rebuilt from plain values can be
+        # replaced by placeholders
+        for key in ('icon', 'shortcut'):
+            if not isinstance(a.manifest[key], (basestring, type(None))):
+                manifest['lazy'] = False
+        if 'predicate' in a.manifest:
+            manifest['lazy'] = False
+        manifest['actions'].append(a.manifest)
+    for event in _lazyEvents:
+        for f in globals()[event].functions:
+            if getattr(f, '__module__', None) == name:
+                manifest['events'].append(event)
+                break
+    # a placeholder cannot wake the plugin up for any other event
+    lazyFunctions = [globals()[event].functions for event in _lazyEvents] + [unload.functions]
+    for functions, f in _registeredListeners.get(name, ()):
+        if not any(functions is l for l in lazyFunctions):
+            manifest['lazy'] = False
+    if not manifest['actions'] and not manifest['events']:
+        # nothing would ever import it, and whatever it sets up when
+        # imported (event filters, hooks) would never happen
+        manifest['lazy'] = False
+    if not manifest['lazy']:
+        manifest = {'lazy': False}
+    try:
+        manifest['mtime'] = _modificationTime(path)
+        f = open(_manifestPaths(name, path)[1], 'w')
+        try:
+            f.write(repr(manifest))
+        finally:
+            f.close()
+    except (IOError, OSError):
+        traceback.print_exc()
+
+def _deferPlugin(name, path):
+    ''' Called by Pate for each plugin it finds when lazy loading is enabled.
+    Installs placeholder actions and event listeners from the plugin's
+    manifest and returns True, or returns False if the plugin has to be
+    imported right away. '''
+    manifest = _readManifest(name, path)
+    if manifest is None or not manifest.get('lazy', True):
+        return False
+    _deferredPlugins[name] = path
+    for description in manifest.get('actions', ()):
+        a = _LazyAction(description['text'], description.get('icon'), description.get('shortcut'), description.get('menu'))
+        _filterAction(a, description.get('mimeTypes'))
+        _connectPlaceholder(a, name, description['function'])
+        _placeholderActions[(name, description['function'])] = a
+        action.actions.add(a)
+        _registeredActions.setdefault(name, []).append(a)
+    for event in manifest.get('events', ()):
+        if event in _lazyEvents:
+            _installPlaceholderListener(globals()[event], event, name)
+    return True
+
+def _pluginImported(name, path, module):
+    ''' Called by Pate after a plugin was imported while lazy loading is
+    enabled, so that its manifest is regenerated '''
+    _writeManifest(name, path)
+
+def _materializePlugin(name, event=None):
+    ''' Import a deferred plugin. If Kate has already been initialised the
+    plugin's init listeners are called, unless it is being woken up by the
+    init event itself. '''
+    if name not in _deferredPlugins:
+        return sys.modules.get(name)
+    path = _deferredPlugins.pop(name)
+    for eventObject, listener in _placeholderListeners.pop(name, ()):
+        eventObject.functions.discard(listener)
+    try:
+        module = _startupTimed('lazy import', name, __import__, name)
+    except Exception:
+        traceback.print_exc()
+        sys.stderr.write('Could not load plugin %s\n' % name)
+        return None
+    pate.plugins.append(module)
+    _writeManifest(name, path)
+    if initialized and event != 'init':
+        _fire('init', [f for f in init.functions if getattr(f, '__module__', None) == name])
+    _watchPlugin(name)
+    return module
+
+def _connectPlaceholder(a, name, functionName):
+    def trigger():
+        a.handler = None
+        if _materializePlugin(name) is None:
+            return
+        # binding the real function replaced the handler
+        if a.func is None:
+            _placeholderActions.pop((name, functionName), None)
+            gui.popup('Plugin \'%s\' no longer provides the action \'%s\'' % (name, a.label), 3, icon='dialog-warning', minTextWidth=200)
+            return
+        a.trigger()
+    a.handler = trigger
+
+def _installPlaceholderListener(event, eventName, name):
+    def listener(*args, **kwargs):
+        _materializePlugin(name, eventName)
+        _fire(eventName, [f for f in event.functions if getattr(f, '__module__', None) == name], *args, **kwargs)
+    # shows up as e.g "expand.<lazy init>" in the start-up profile
+    listener.__module__ = name
+    listener.__name__ = '<lazy %s>' % eventName
+    _placeholderListeners.setdefault(name, []).append((event, listener))
+    event.functions.add(listener)
+
+
+class _MenuIndex(object):
+    ''' Menu name => menu for a window, e.g "help": KMenu. The menu bar is
+    indexed first; the rest of the window is only searched for a name that
+    is not on it. '''
+    def __init__(self, window):
+        self.window = window
+        self.menus = {}
+        self.complete = False
+        self._index([a.menu() for a in window.menuBar().actions()])
+
+    def _index(self, menus):
+        while menus:
+            menu = menus.pop()
+            if menu is None:
+                continue
+            name = str(menu.objectName())
+            if name:
+                self.menus.setdefault(name, menu)
+            menus.extend(a.menu() for a in menu.actions())
+
+    def find(self, name):
+        menu = self.menus.get(name)
+        if menu is None and not self.complete:
+            # e.g a context menu
+            self.complete = True
+            self._index(self.window.findChildren(QtGui.QMenu))
+            menu = self.menus.get(name)
+        return menu
+
+# window => _MenuIndex, kept for as long as the window lives
+_menuIndexes = {}
+# menu => actions to build and add when it is next shown
+_pendingMenuActions = {}
+
+def _findMenu(window, name):
+    index = _menuIndexes.get(window)
+    if index is None:
+        index = _menuIndexes[window] = _MenuIndex(window)
+        window.connect(window, QtCore.SIGNAL('destroyed()'), functools.partial(_menuIndexes.pop, window, None))
+    menu = index.find(name)
+    if menu is not None and sip.isdeleted(menu):
+        # the GUI was rebuilt
+        del _menuIndexes[window]
+        return _findMenu(window, name)
+    return menu
+
+def _addToMenu(menu, a):
+    if a.qaction is not None:
+        menu.addAction(a.qaction)
+        return
+    pending = _pendingMenuActions.get(menu)
+    if pending is None:
+        pending = _pendingMenuActions[menu] = []
+        menu.connect(menu, QtCore.SIGNAL('aboutToShow()'), functools.partial(_showPendingActions, menu))
+    pending.append(a)
+
+def _showPendingActions(menu):
+    pending = _pendingMenuActions.get(menu, [])
+    actions = pending[:]
+    del pending[:]
+    for a in actions:
+        # skip actions unregistered since
+        if a.window is not None:
+            menu.addAction(a.materialize())
+
+# windows whose Configure Shortcuts action builds their actions first
+_shortcutsHooked = set()
+
+def _materializeActions(window):
+    # the shortcuts dialog only lists what is in the action collection when
+    # it opens
+    for a in list(action.actions):
+        if a.window is window and a.qaction is None:
+            a.materialize()
+
+def _hookShortcutsDialog(window):
+    if window in _shortcutsHooked:
+        return
+    configure = window.actionCollection().action(kdeui.KStandardAction.name(kdeui.KStandardAction.KeyBindings))
+    if configure is None:
+        return
+    _shortcutsHooked.add(window)
+    window.connect(window, QtCore.SIGNAL('destroyed()'), functools.partial(_shortcutsHooked.discard, window))
+    materialize = functools.partial(_materializeActions, window)
+    # highlighted in its menu, by mouse or keyboard, before it is triggered
+    configure.connect(configure, QtCore.SIGNAL('hovered()'), materialize)
+    # triggered some other way, the dialog is already up: in time for the
+    # next one
+    configure.connect(configure, QtCore.SIGNAL('triggered()'), materialize)
+
+def _wireActions(window, actions):
+    # plug actions into the window's action collection and their menus.
+    # Actions without a shortcut are built when their menu is shown, or
+    # before the shortcuts dialog is
+    _hookShortcutsDialog(window)
+    for a in actions:
+        # allow a configurable name so that built-in actions can be
+        # overriden?
+        a.plug(window)
+        if a.menu is not None:
+            # '&Blah' => 'blah'
+            menuName = a.menu.lower().replace('&', '')
+            menu = _findMenu(window, menuName)
+            # create the menu if it doesn't exist
+            if menu is None:
+                gui.popup('Plugin wants to create an item in menu \'%s\' which does not exist' % a.menu, 2, minTextWidth=200)
+                # XX make creating new menus work
+                # before = _findMenu(window, 'help').menuAction()
+                # menu = QtGui.QMenu(a.menu)
+                # window.menuBar().insertMenu(before, menu)
+            else:
+                _addToMenu(menu, a)
+
+
+# Reloading plugins
+
+def _pluginModuleNames(name):
+    # the plugin module and, for a package plugin, the modules beside it
+    names = [name]
+    directory = getattr(pate, 'pluginModules', {}).get(name)
+    if directory is not None and os.path.basename(directory) == name:
+        names.extend(n for n, d in pate.pluginModules.iteritems() if d == directory and n != name)
+    return names
+
+def _unregisterPlugin(name):
+    ''' Take down the actions and event listeners a plugin registered, calling
+    its unload listeners first '''
+    listeners = _registeredListeners.pop(name, [])
+    _fire('unload', [f for functions, f in listeners if functions is unload.functions])
+    for functions, f in listeners:
+        functions.discard(f)
+    for a in _registeredActions.pop(name, []):
+        action.actions.discard(a)
+        _unfilterAction(a)
+        a.unplug()
+    for key in [key for key in _placeholderActions if key[0] == name]:
+        del _placeholderActions[key]
+
+def reloadPlugin(name):
+    ''' Unregister the actions and event listeners of one plugin, import it
+    again and, once Kate has been initialised, wire up its actions and call
+    its init listeners. No other plugin is touched, and the plugin keeps its
+    configuration. Returns the new module or None if it could not be
+    imported. '''
+    if name in _deferredPlugins:
+        # lazily loaded and never used: there is nothing to take down
+        return _materializePlugin(name)
+    _unregisterPlugin(name)
+    for moduleName in _pluginModuleNames(name):
+        sys.modules.pop(moduleName, None)
+    pate.plugins[:] = [p for p in pate.plugins if p.__name__ != name]
+    try:
+        module = __import__(name)
+    except Exception:
+        traceback.print_exc()
+        gui.popup('Could not reload plugin \'%s\'' % name, 3, icon='dialog-error', minTextWidth=200)
+        return None
+    pate.plugins.append(module)
+    if initialized:
+        _wireActions(application.activeMainWindow().window(), _registeredActions.get(name, ()))
+        _fire('init', [f for functions, f in _registeredListeners.get(name, ()) if functions is init.functions])
+    _watchPlugin(name)
+    return module
+
+# watches the sources of loaded plugins if reloadOnChange is set in the
+# [pate] group of paterc
+_watcher = None
+# source path => plugin name
+_watchedFiles = {}
+_pendingReloads = set()
+
+def _sourcePath(module):
+    path = getattr(module, '__file__', None)
+    if path is None:
+        return None
+    if path.endswith(('.pyc', '.pyo')):
+        path = path[:-1]
+    # modules from the bundle are not files
+    return path if os.path.isfile(path) else None
+
+def _watchPlugin(name):
+    if _watcher is None:
+        return
+    watched = set(unicode(f) for f in _watcher.files())
+    for moduleName in _pluginModuleNames(name):
+        path = _sourcePath(sys.modules.get(moduleName))
+        if path is None:
+            continue
+        _watchedFiles[path] = name
+        # saving usually replaces the file, which ends the watch on it
+        if path not in watched:
+            _watcher.addPath(path)
+
+def _pluginFileChanged(path):
+    name = _watchedFiles.get(unicode(path))
+    if name is None:
+        return
+    # editors write files in several steps; reload once they are done
+    if not _pendingReloads:
+        QtCore.QTimer.singleShot(500, _reloadChangedPlugins)
+    _pendingReloads.add(name)
+
+def _reloadChangedPlugins():
+    names = list(_pendingReloads)
+    _pendingReloads.clear()
+    for name in names:
+        if reloadPlugin(name) is not None:
+            gui.popup('Reloaded plugin \'%s\'' % name, 2, icon='view-refresh', minTextWidth=200)
+
+def _watchPlugins():
+    global _watcher
+    _watcher = QtCore.QFileSystemWatcher()
+    _watcher.connect(_watcher, QtCore.SIGNAL('fileChanged(const QString&)'), _pluginFileChanged)
+    for module in pate.plugins:
+        _watchPlugin(module.__name__)
+
+
 # Initialisation
 
 def pateInit():
@@ -292,33 +1326,23 @@ def pateInit():
         # set up actions -- plug them into the window's action collection
         windowInterface = application.activeMainWindow()
         window = windowInterface.window()
-        nameToMenu = {} # e.g "help": KMenu
-        for menu in window.findChildren(QtGui.QMenu):
-            name = str(menu.objectName())
-            if name:
-                nameToMenu[name] = menu
-        collection = window.actionCollection()
-        for a in action.actions:
-            # allow a configurable name so that built-in actions can be
-            # overriden?
-            collection.addAction(a.text(), a)
-            if a.menu is not None:
-                # '&Blah' => 'blah'
-                menuName = a.menu.lower().replace('&', '')
-                # create the menu if it doesn't exist
-                if menuName not in nameToMenu:
-                    gui.popup('Plugin wants to create an item in menu \'%s\' which does not exist' % a.menu, 2, minTextWidth=200)
-                    # XX make creating new menus work
-                    # before = nameToMenu['help'].menuAction()
-                    # menu = QtGui.QMenu(a.menu)
-                    # window.menuBar().insertMenu(before, menu)
-                    # nameToMenu[menuName] = menu
-                else:
-                    nameToMenu[menuName].addAction(a)
+        _startupTimed('wiring', 'actions and menus', _wireActions, window, action.actions)
         # print 'init:', Kate.application(), application.activeMainWindow()
-        windowInterface.connect(windowInterface, QtCore.SIGNAL('viewChanged()'), viewChanged.fire)
-        windowInterface.connect(windowInterface, QtCore.SIGNAL('viewCreated(KTextEditor::View*)'), viewCreated.fire)
-        _callAll(init.functions)
+        # actions filtered by document follow the active view
+        viewChanged.functions.add(_updateFilteredActions)
+        _updateFilteredActions()
+        # the engine delivers view and document events from now on
+        for event in _dispatchedEvents:
+            event.functions.push()
+        for f in list(init.functions):
+            _startupTimed('init', _callableName(f), _fire, 'init', [f])
+        if _option('statisticsExport'):
+            path = _option('statisticsFile') or unicode(kdecore.KStandardDirs.locateLocal('appdata', 'pate/statistics.txt'))
+            statistics.startExport(path, _option('statisticsExport'))
+        if _option('reloadOnChange', False):
+            _watchPlugins()
+        if _option('startupProfileSummary', False):
+            printStartupProfile()
     QtCore.QTimer.singleShot(0, _initPhase2)
 
 # called by pate on initialisation
@@ -328,18 +1352,39 @@ del pateInit
 
 def pateDie():
     # Unload actions or things will crash
-    global plugins, pluginDirectories
+    global plugins, pluginDirectories, _watcher
     for a in action.actions:
-        for w in a.associatedWidgets():
-            w.removeAction(a)
+        if a.qaction is not None:
+            for w in a.qaction.associatedWidgets():
+                w.removeAction(a.qaction)
     # clear up
     unload.fire()
+    # results of outstanding jobs and tasks would be delivered to unloaded
+    # plugins
+    threads.pool.cancelPending()
+    tasks.scheduler.cancelAll()
+    search.stopPool()
+    statistics.stopExport()
     
     action.actions.clear()
+    _placeholderActions.clear()
+    _deferredPlugins.clear()
+    _placeholderListeners.clear()
+    _actionsByMimeType.clear()
+    _predicateActions.clear()
+    _enabledFilteredActions.clear()
+    _menuIndexes.clear()
+    _pendingMenuActions.clear()
+    _shortcutsHooked.clear()
+    _registeredListeners.clear()
+    _registeredActions.clear()
+    _watcher = None
+    _watchedFiles.clear()
+    _pendingReloads.clear()
     init.clear()
     unload.clear()
-    viewChanged.clear()
-    viewCreated.clear()
+    for event in _dispatchedEvents:
+        event.clear()
     plugins = pluginDirectories = None
 
     
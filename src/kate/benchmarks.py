@@ -0,0 +1,41 @@
+''' Micro-benchmarks for the kate package. They need a running Kate, so run
+them from the Pate console, e.g.
+
+    import kate.benchmarks
+    kate.benchmarks.configuration()
+'''
+
+import sys
+import timeit
+
+import kate
+
+
+def _compare(stream, title, cases, iterations):
+    # cases: [(operation, old callable, new callable), ...]
+    stream.write('%s (%d iterations, microseconds per call):\n' % (title, iterations))
+    stream.write('%-12s %12s %12s %9s\n' % ('operation', 'old', 'new', 'speed-up'))
+    for operation, old, new in cases:
+        # best of three, as timeit recommends
+        oldTime = min(timeit.Timer(old).repeat(3, iterations)) / iterations * 1e6
+        newTime = min(timeit.Timer(new).repeat(3, iterations)) / iterations * 1e6
+        stream.write('%-12s %12.3f %12.3f %8.1fx\n' % (operation, oldTime, newTime, oldTime / max(newTime, 1e-9)))
+
+def configuration(iterations=100000, stream=None):
+    ''' Compare kate.configuration, which inspects the caller's frame on
+    every access, with a PluginConfiguration bound to this module. Both work
+    on the same group, which is removed again afterwards. '''
+    stream = stream or sys.stderr
+    old = kate.configuration
+    new = kate.pluginConfiguration(__name__)
+    new['value'] = 1
+    try:
+        cases = [
+            ('read', lambda: old['value'], lambda: new['value']),
+            ('get', lambda: old.get('value'), lambda: new.get('value')),
+            ('contains', lambda: 'value' in old, lambda: 'value' in new),
+            ('write', lambda: old.__setitem__('value', 2), lambda: new.__setitem__('value', 2)),
+        ]
+        _compare(stream, 'kate.configuration vs kate.pluginConfiguration', cases, iterations)
+    finally:
+        kate.globalConfiguration.pop(__name__, None)
@@ -0,0 +1,451 @@
+''' Reading and rewriting whole documents from Python. Every call of
+document.line() or document.character() converts a QString; analysing a
+document that way costs thousands of round trips. A Snapshot holds the text
+of a document as a single unicode string, fetched in one go, along with the
+offsets at which its lines start, and is shared until the document changes.
+
+An Edit goes the other way: it collects changes against a snapshot and
+applies only the parts that actually differ, in one undo step.
+
+A LineCache keeps something worked out for each line of a document up to
+date as the document is edited, looking again only at the lines an edit
+touched.
+
+Functions decorated with cachedPerDocument remember what they worked out
+about a document until it changes, in a cache shared by all plugins whose
+size is bounded by the documentCacheSize option (in megabytes, 32 by
+default) in the [pate] group of paterc.
+
+Changes are counted by listening to Pate's editing events, so revisions are
+only known once Kate has been initialised; before that, snapshots are taken
+afresh every time. '''
+
+import array
+import bisect
+import collections
+import difflib
+import functools
+import sys
+
+import sip
+
+import kate
+from PyKDE4.ktexteditor import KTextEditor
+
+
+# document address => number of changes seen since tracking started
+_revisions = {}
+# document address => Snapshot of the current revision
+_snapshots = {}
+
+def _key(document):
+    return sip.unwrapinstance(document)
+
+def _changed(document, range=None):
+    key = _key(document)
+    _revisions[key] = _revisions.get(key, 0) + 1
+    _snapshots.pop(key, None)
+    _forgetCached(key)
+
+def _deleted(document):
+    key = _key(document)
+    # the address can be reused by another document
+    _revisions.pop(key, None)
+    _snapshots.pop(key, None)
+    _forgetCached(key)
+
+def _track():
+    # start counting changes on first use. Pate drops all listeners when it
+    # is unloaded, so check every time
+    if _changed not in kate._textInserted.functions:
+        _revisions.clear()
+        _snapshots.clear()
+        _cache.clear()
+        _cachedByDocument.clear()
+        _cacheSize[0] = 0
+        kate._textInserted(_changed)
+        kate._textRemoved(_changed)
+        # a reload, or a file opened into the document, replaces the text
+        # without either of those
+        kate._documentReloaded(_changed)
+        kate._documentUrlChanged(_changed)
+        kate.documentWillBeDeleted(_deleted)
+
+def revision(document):
+    ''' A number that changes whenever the document does, or None if changes
+    are not being tracked yet '''
+    if not kate.initialized:
+        return None
+    _track()
+    return _revisions.get(_key(document), 0)
+
+
+def _position(position):
+    # a (line, column) tuple from a tuple or a KTextEditor.Cursor
+    if isinstance(position, tuple):
+        return position
+    return position.line(), position.column()
+
+
+class Snapshot(object):
+    ''' The text of a document at one revision. Lines, positions and ranges
+    are those of the document: lines are separated by '\\n' and positions
+    are (line, column) tuples or KTextEditor.Cursors. '''
+    __slots__ = ('_text', '_lineStarts', '_revision')
+
+    def __init__(self, text, revision=None):
+        self._text = text
+        self._revision = revision
+        # the offset at which each line starts, and the one a line after the
+        # last would start at
+        lineStarts = array.array('l', [0])
+        offset = 0
+        for line in text.split(u'\n'):
+            offset += len(line) + 1
+            lineStarts.append(offset)
+        self._lineStarts = lineStarts
+
+    @property
+    def text(self):
+        ''' All of the text, as unicode '''
+        return self._text
+
+    @property
+    def revision(self):
+        ''' The revision of the document the snapshot was taken at, or None
+        if unknown '''
+        return self._revision
+
+    def __len__(self):
+        return len(self._text)
+
+    def lines(self):
+        ''' The number of lines, like document.lines() '''
+        return len(self._lineStarts) - 1
+
+    def line(self, line):
+        ''' The text of a line, without the line break. Negative numbers
+        count from the end '''
+        if line < 0:
+            line += self.lines()
+        return self._text[self._lineStarts[line]:self._lineStarts[line + 1] - 1]
+
+    def lineLength(self, line):
+        return self._lineStarts[line + 1] - self._lineStarts[line] - 1
+
+    def offset(self, line, column=None):
+        ''' The offset into text of a position, given as line and column or
+        as a single position '''
+        if column is None:
+            line, column = _position(line)
+        return self._lineStarts[line] + column
+
+    def position(self, offset):
+        ''' The (line, column) at an offset into text '''
+        line = bisect.bisect_right(self._lineStarts, offset) - 1
+        return line, offset - self._lineStarts[line]
+
+    def character(self, line, column=None):
+        ''' The character at a position, or u'' at the end of a line '''
+        offset = self.offset(line, column)
+        return self._text[offset:offset + 1].rstrip(u'\n')
+
+    def range(self, start, end=None):
+        ''' The text between two positions, or of a KTextEditor.Range '''
+        if end is None:
+            start, end = start.start(), start.end()
+        return self._text[self.offset(start):self.offset(end)]
+
+    def linesBetween(self, first, last):
+        ''' The text of lines first up to but not including last, with their
+        line breaks '''
+        return self._text[self._lineStarts[first]:self._lineStarts[last]]
+
+
+def snapshot(document):
+    ''' The Snapshot of the document's current text. It is taken once per
+    revision; until the document changes, the same snapshot is returned. '''
+    current = revision(document)
+    if current is None:
+        return Snapshot(unicode(document.text()))
+    key = _key(document)
+    result = _snapshots.get(key)
+    if result is not None and result.lines() != document.lines():
+        # a change that was not seen
+        _changed(document)
+        current = revision(document)
+        result = None
+    if result is None:
+        result = _snapshots[key] = Snapshot(unicode(document.text()), current)
+    return result
+
+
+def _commonPrefix(a, b):
+    # the length of the longest common prefix of a and b. os.path.commonprefix
+    # compares a character at a time in Python; halving the range compares
+    # slices instead, which is done in C
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[low:middle] == b[low:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+def _commonSuffix(a, b):
+    # the same from the end. Callers pass what follows the common prefix, so
+    # the two cannot overlap
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[len(a) - middle:len(a) - low] == b[len(b) - middle:len(b) - low]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+def _trimmed(start, old, new):
+    # (start, end, text) for replacing old at start with new, without the
+    # text both have in common. None if they are the same
+    prefix = _commonPrefix(old, new)
+    suffix = _commonSuffix(old[prefix:], new[prefix:])
+    if prefix == len(old) == len(new):
+        return None
+    return start + prefix, start + len(old) - suffix, new[prefix:len(new) - suffix]
+
+def _differences(start, old, new):
+    # the (start, end, text) replacements, in order, that turn old at start
+    # into new. Lines are compared first, so that a change to a few lines of
+    # a long text does not replace the lines in between
+    change = _trimmed(start, old, new)
+    if change is None:
+        return []
+    changeStart, changeEnd, text = change
+    old = old[changeStart - start:changeEnd - start]
+    if u'\n' not in old and u'\n' not in text:
+        return [change]
+    oldLines = old.splitlines(True)
+    newLines = text.splitlines(True)
+    oldStarts = [changeStart]
+    for line in oldLines:
+        oldStarts.append(oldStarts[-1] + len(line))
+    changes = []
+    matcher = difflib.SequenceMatcher(None, oldLines, newLines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag != 'equal':
+            change = _trimmed(oldStarts[i1], u''.join(oldLines[i1:i2]), u''.join(newLines[j1:j2]))
+            if change is not None:
+                changes.append(change)
+    return changes
+
+
+class Edit(object):
+    ''' Changes to a document, collected against a snapshot of it and
+    applied together. Ranges are KTextEditor.Ranges or (start, end) pairs of
+    positions, and positions are (line, column) tuples or KTextEditor.Cursors,
+    all as they were when the edit was started. Only the parts of the text
+    that really change are touched, from the end of the document backwards,
+    in a single startEditing()/endEditing() block: cursors, bookmarks and
+    highlighting elsewhere stay as they are, and it is undone in one step.
+    Use it as a context manager, which applies the changes unless an
+    exception is raised, or call apply() yourself. '''
+    def __init__(self, document):
+        self.document = document
+        self.snapshot = snapshot(document)
+        # (start offset, end offset, text), in the order they were made
+        self.changes = []
+
+    def _offsets(self, range):
+        if isinstance(range, tuple):
+            start, end = range
+        else:
+            start, end = range.start(), range.end()
+        return self.snapshot.offset(start), self.snapshot.offset(end)
+
+    def replace(self, range, text):
+        start, end = self._offsets(range)
+        self.changes.append((start, end, unicode(text)))
+
+    def insert(self, position, text):
+        offset = self.snapshot.offset(position)
+        self.changes.append((offset, offset, unicode(text)))
+
+    def remove(self, range):
+        self.replace(range, u'')
+
+    def replaceBetween(self, start, end, text):
+        ''' Replace the text between two offsets into the snapshot '''
+        self.changes.append((start, end, unicode(text)))
+
+    def setText(self, text):
+        ''' Replace all of the text. Only what differs is changed '''
+        self.changes.append((0, len(self.snapshot), unicode(text)))
+
+    def differences(self):
+        ''' The minimal (start, end, text) replacements the changes come
+        down to, as offsets into the snapshot, in order '''
+        # a stable sort keeps insertions at the same place in order
+        changes = sorted(self.changes, key=lambda change: change[:2])
+        differences = []
+        end = 0
+        for start, changeEnd, text in changes:
+            if start < end:
+                raise ValueError('Overlapping changes at line %d, column %d' % self.snapshot.position(start))
+            end = changeEnd
+            differences.extend(_differences(start, self.snapshot.text[start:changeEnd], text))
+        return differences
+
+    def apply(self):
+        ''' Make the changes. Returns the number of replacements made '''
+        if self.snapshot.revision is not None and snapshot(self.document) is not self.snapshot:
+            raise RuntimeError('The document changed while it was being edited')
+        differences = self.differences()
+        self.changes = []
+        if not differences:
+            return 0
+        cursor = lambda offset: KTextEditor.Cursor(*self.snapshot.position(offset))
+        self.document.startEditing()
+        try:
+            for start, end, text in reversed(differences):
+                if start == end:
+                    self.document.insertText(cursor(start), text)
+                elif not text:
+                    self.document.removeText(KTextEditor.Range(cursor(start), cursor(end)))
+                else:
+                    self.document.replaceText(KTextEditor.Range(cursor(start), cursor(end)), text)
+        finally:
+            self.document.endEditing()
+        return len(differences)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if type is None:
+            self.apply()
+        return False
+
+
+class LineCache(object):
+    ''' func(line text) for every line of documents, worked out from a
+    snapshot the first time a document is asked about and then kept up to
+    date: an edit only has the lines it touched worked out again. '''
+    def __init__(self, func):
+        self.func = func
+        # document address => [func(line), ...]
+        self.lines = {}
+        def inserted(document, range):
+            self._update(document, range[0], range[0] + 1, range[2] + 1)
+        def removed(document, range):
+            self._update(document, range[0], range[2] + 1, range[0] + 1)
+        def deleted(document):
+            # also when the text was replaced wholesale
+            self.lines.pop(_key(document), None)
+        # registered as the plugin's, so that reloading it drops them
+        for listener in (inserted, removed, deleted):
+            listener.__module__ = getattr(func, '__module__', None)
+        self.listeners = ((kate._textInserted, inserted), (kate._textRemoved, removed), (kate.documentWillBeDeleted, deleted),
+            (kate._documentReloaded, deleted), (kate._documentUrlChanged, deleted))
+
+    def values(self, document):
+        ''' The list of func(line) for the lines of document. It is kept up
+        to date, so do not modify it '''
+        if not kate.initialized:
+            # edits are not seen yet
+            return self._compute(document)
+        event, listener = self.listeners[0]
+        if listener not in event.functions:
+            # first use, or Pate dropped the listeners
+            self.lines.clear()
+            for event, listener in self.listeners:
+                event(listener)
+        key = _key(document)
+        lines = self.lines.get(key)
+        if lines is None:
+            lines = self.lines[key] = self._compute(document)
+        return lines
+
+    def _compute(self, document):
+        current = snapshot(document)
+        return [self.func(current.line(number)) for number in xrange(current.lines())]
+
+    def _update(self, document, first, last, newLast):
+        # lines first up to last became lines first up to newLast
+        key = _key(document)
+        lines = self.lines.get(key)
+        if lines is None:
+            return
+        lines[first:last] = [self.func(unicode(document.line(number))) for number in xrange(first, newLast)]
+        if len(lines) != document.lines():
+            # missed a change (e.g a reload): start over on next use
+            del self.lines[key]
+
+
+# (function, document address, arguments) => (size, result), least recently
+# used first
+_cache = collections.OrderedDict()
+# document address => keys of _cache
+_cachedByDocument = {}
+# the estimated number of bytes held by _cache
+_cacheSize = [0]
+
+def _sizeOf(value, depth=3):
+    # a rough estimate of the memory taken by value, looking into containers
+    # a few levels deep
+    size = sys.getsizeof(value, 64)
+    if depth:
+        if isinstance(value, dict):
+            size += sum(_sizeOf(k, depth - 1) + _sizeOf(v, depth - 1) for k, v in value.iteritems())
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            size += sum(_sizeOf(item, depth - 1) for item in value)
+    return size
+
+def _forgetCached(documentKey):
+    for key in _cachedByDocument.pop(documentKey, ()):
+        size, result = _cache.pop(key)
+        _cacheSize[0] -= size
+
+def _remember(key, result):
+    size = _sizeOf(result)
+    budget = kate._option('documentCacheSize', 32) * 1024 * 1024
+    if size > budget:
+        return
+    _cache[key] = size, result
+    _cachedByDocument.setdefault(key[1], set()).add(key)
+    _cacheSize[0] += size
+    while _cacheSize[0] > budget:
+        oldest, (size, result) = _cache.popitem(last=False)
+        _cacheSize[0] -= size
+        keys = _cachedByDocument[oldest[1]]
+        keys.discard(oldest)
+        if not keys:
+            del _cachedByDocument[oldest[1]]
+
+def cachedPerDocument(func):
+    ''' Decorator for a function that takes a document and, optionally,
+    further hashable arguments and works something out about the document.
+    Results are cached until the document changes or is closed, so they are
+    shared between callers and must not be modified. '''
+    @functools.wraps(func)
+    def cached(document, *args):
+        current = revision(document)
+        if current is None:
+            return func(document, *args)
+        documentKey = _key(document)
+        key = (cached, documentKey, args)
+        try:
+            size, result = _cache.pop(key)
+        except TypeError:
+            # unhashable arguments
+            return func(document, *args)
+        except KeyError:
+            result = func(document, *args)
+            # the function may have changed the document
+            if revision(document) == current:
+                _remember(key, result)
+            return result
+        # most recently used again
+        _cache[key] = size, result
+        return result
+    return cached
@@ -227,3 +227,48 @@ def popup(message, timeout, icon=None, maxTextWidth=None, minTextWidth=None, par
     popup.show()
     return popup
 
+
+
+class ProgressPassivePopup(TimeoutPassivePopup):
+    ''' A passive popup that shows how far some work has got instead of
+    counting down. Call setProgress() as the work goes on and finish() once
+    it is done '''
+    def __init__(self, parent, message, icon=None, maxTextWidth=200, minTextWidth=None):
+        TimeoutPassivePopup.__init__(self, parent, message, 0, icon, maxTextWidth, minTextWidth)
+        self.timerWidget.percent = 0
+        self.slidIn = False
+        self.finished = False
+
+    def setProgress(self, fraction, message=None):
+        ''' fraction is between 0 and 1 '''
+        percent = max(0, min(100, int(fraction * 100)))
+        if percent != self.timerWidget.percent:
+            self.timerWidget.percent = percent
+            self.timerWidget.update()
+        if message is not None:
+            self.message.setText(message)
+
+    def finish(self):
+        if self.finished:
+            return
+        self.finished = True
+        # do not start sliding out while still sliding in
+        if self.slidIn:
+            self.hide()
+
+    def effectFinished(self, name):
+        if name == "slideInFromBottomLeft":
+            self.slidIn = True
+            if self.finished:
+                self.hide()
+        else:
+            TimeoutPassivePopup.effectFinished(self, name)
+
+
+def progressPopup(message, icon=None, maxTextWidth=None, minTextWidth=None, parent=None):
+    if parent is None:
+        import kate
+        parent = kate.mainWindow()
+    popup = ProgressPassivePopup(parent, message, icon, maxTextWidth, minTextWidth)
+    popup.show()
+    return popup
@@ -0,0 +1,60 @@
+''' Importing plugins and the modules that live alongside them. Pate does
+not put the plugin directories on sys.path; instead it fills
+pate.pluginModules with module name => directory while it discovers
+plugins, and the finder here looks names up in that dictionary. Every other
+import in the process goes straight past it. '''
+
+import imp
+import sys
+import zipimport
+
+import pate
+
+
+class PluginFinder(object):
+    ''' A sys.meta_path finder (see PEP 302) for top-level modules in
+    pate.pluginModules, which live either in a directory or in the
+    precompiled bundle. Submodules of packages are left to the regular
+    machinery, which finds them through the package's __path__. '''
+    def find_module(self, fullname, path=None):
+        if path is not None:
+            return None
+        directory = getattr(pate, 'pluginModules', {}).get(fullname)
+        if directory is None:
+            return None
+        if directory.endswith('.zip'):
+            # a plugin from the precompiled bundle
+            try:
+                return zipimport.zipimporter(directory).find_module(fullname)
+            except zipimport.ZipImportError:
+                return None
+        try:
+            # only the one directory is searched
+            return PluginLoader(*imp.find_module(fullname, [directory]))
+        except ImportError:
+            return None
+
+
+class PluginLoader(object):
+    def __init__(self, file, pathname, description):
+        self.file = file
+        self.pathname = pathname
+        self.description = description
+
+    def load_module(self, fullname):
+        try:
+            # imp.load_module reuses the module in sys.modules, if any, which
+            # is what reload() expects of a loader
+            return imp.load_module(fullname, self.file, self.pathname, self.description)
+        finally:
+            if self.file is not None:
+                self.file.close()
+
+
+def install():
+    ''' Put a PluginFinder in front of sys.meta_path. Plugin modules used to
+    shadow anything else on sys.path, and still do. '''
+    for finder in sys.meta_path:
+        if isinstance(finder, PluginFinder):
+            return
+    sys.meta_path.insert(0, PluginFinder())
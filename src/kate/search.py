@@ -0,0 +1,292 @@
+''' Searching and replacing with regular expressions across many documents.
+The open documents are snapshotted on the main thread and matched a chunk at
+a time in kate.tasks slices, so that the editor stays responsive; matches
+come back a document at a time. Replacements are applied to each document
+as a single kate.edit() transaction as soon as its matches are in.
+
+Setting searchProcesses in the [pate] group of paterc to a number of
+processes fans the matching out to a pool of that many worker processes
+instead, started on the first search. It is off by default: the workers are
+forked from Kate, which has threads of its own (Qt's, KDE's, plugins' and
+the pool's), and a fork only copies the thread that makes it, so a lock held
+by any other thread at that moment stays locked in the workers. The workers
+only run the matching, which takes none of those locks, but the risk is
+yours to take. '''
+
+import bisect
+import collections
+import multiprocessing
+import re
+import sys
+import traceback
+
+from PyQt4 import QtCore, QtGui
+
+import kate
+from kate import gui
+from kate import tasks
+
+
+# characters of text to hand to a worker process at a time
+chunkSize = 256 * 1024
+# chunks handed out at a time; the rest wait for results to come in, so that
+# cancelling a search leaves little work behind
+chunksAhead = 16
+
+def _find(text, pattern, flags, replacement):
+    # the matches of pattern in text: (start, end, line, column, line text)
+    # or, when replacing, (start, end, line, column, replacement text)
+    expression = re.compile(pattern, flags)
+    lineStarts = None
+    matches = []
+    for match in expression.finditer(text):
+        start, end = match.span()
+        if lineStarts is None:
+            lineStarts = [0] + [m.end() for m in re.finditer(u'\n', text)]
+        line = bisect.bisect_right(lineStarts, start) - 1
+        if replacement is not None:
+            matches.append((start, end, line, start - lineStarts[line], match.expand(replacement)))
+            continue
+        lineEnd = text.find(u'\n', start)
+        lineText = text[lineStarts[line]:lineEnd if lineEnd != -1 else len(text)]
+        matches.append((start, end, line, start - lineStarts[line], lineText))
+    return matches
+
+def _findAll(items, pattern, flags, replacement):
+    # runs in a worker process. items are (index, text); the result is
+    # [(index, matches, error), ...]
+    results = []
+    for index, text in items:
+        try:
+            results.append((index, _find(text, pattern, flags, replacement), None))
+        except Exception:
+            results.append((index, None, traceback.format_exc()))
+    return results
+
+
+_pool = None
+
+def _processCount():
+    # the searchProcesses option: 0, the default, for searching in process
+    processes = kate._option('searchProcesses')
+    if processes is None:
+        return 0
+    try:
+        if isinstance(processes, bool):
+            raise TypeError
+        processes = int(processes)
+    except (TypeError, ValueError):
+        processes = -1
+    if processes < 0:
+        sys.stderr.write('searchProcesses should be a number of processes, not %r; searching in process instead\n' % (kate._option('searchProcesses'),))
+        return 0
+    return processes
+
+def _processPool():
+    # the pool of worker processes, started on first use. None if searching
+    # is to be done in process
+    global _pool
+    if _pool is None:
+        processes = _processCount()
+        if processes == 0:
+            return None
+        try:
+            _pool = multiprocessing.Pool(processes)
+        except (OSError, ImportError, NotImplementedError, ValueError):
+            traceback.print_exc()
+            sys.stderr.write('Searching in process instead\n')
+            return None
+    return _pool
+
+def stopPool():
+    ''' Stop the worker processes. They are started again when needed '''
+    global _pool
+    if _pool is not None:
+        _pool.terminate()
+        _pool = None
+
+
+class Search(QtCore.QObject):
+    ''' A search of several documents for a regular expression, running in
+    the background once started. Emits found(document, matches) for every
+    document with matches, as they come in, and finished() once all
+    documents have been searched. matches are (start, end, line, column,
+    text): start and end are offsets into the document's kate.snapshot() as
+    it was when the search started, and text is the line the match is on
+    or, when replacing, what it is replaced with.
+
+    With a replacement (as for re.sub), the matches in each document are
+    replaced as soon as they are known. A document that changes while it is
+    being searched is left alone and listed in skipped.
+
+    cancel() stops a search early; finished() is emitted then too. '''
+    def __init__(self, pattern, flags=re.UNICODE, replacement=None, documents=None):
+        QtCore.QObject.__init__(self)
+        # errors in the pattern are raised here rather than in a worker
+        re.compile(pattern, flags)
+        self.pattern = pattern
+        self.flags = flags
+        self.replacement = replacement
+        if documents is None:
+            documents = kate.documentManager.documents()
+        self.documents = list(documents)
+        self.snapshots = [kate.snapshot(document) for document in self.documents]
+        # document index => matches
+        self.results = {}
+        self.skipped = []
+        self.remaining = len(self.documents)
+        self.cancelled = False
+        # chunks of (index, text) not handed out yet, the number handed out
+        # and not back yet, and the tasks searching in process
+        self.chunks = collections.deque()
+        self.submitted = 0
+        self.tasks = []
+        self.connect(self, QtCore.SIGNAL('_results(PyQt_PyObject)'), self._results, QtCore.Qt.QueuedConnection)
+
+    def start(self):
+        chunks = []
+        size = 0
+        for index, snapshot in enumerate(self.snapshots):
+            if not chunks or size + len(snapshot) > chunkSize:
+                chunks.append([])
+                size = 0
+            chunks[-1].append((index, snapshot.text))
+            size += len(snapshot)
+        if not chunks:
+            self.emit(QtCore.SIGNAL('finished()'))
+            return self
+        self.chunks.extend(chunks)
+        self._submit()
+        return self
+
+    def _submit(self):
+        pool = _processPool()
+        while self.chunks and self.submitted < chunksAhead:
+            arguments = (self.chunks.popleft(), self.pattern, self.flags, self.replacement)
+            self.submitted += 1
+            if pool is not None:
+                # the callback is called on the pool's own thread
+                pool.apply_async(_findAll, arguments, callback=self._emitResults)
+            else:
+                self.tasks.append(tasks.spawn(self._searchInProcess(arguments)))
+
+    def cancel(self):
+        ''' Stop searching and ignore the results still to come: no more
+        replacements are made. Emits finished() unless the search is over
+        already '''
+        if self.cancelled or not self.remaining:
+            return
+        self.cancelled = True
+        self.chunks.clear()
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
+        self.emit(QtCore.SIGNAL('finished()'))
+
+    def _searchInProcess(self, arguments):
+        yield
+        self._results(_findAll(*arguments))
+
+    def _emitResults(self, results):
+        self.emit(QtCore.SIGNAL('_results(PyQt_PyObject)'), results)
+
+    def _results(self, results):
+        if self.cancelled:
+            return
+        self.submitted -= 1
+        self.tasks = [task for task in self.tasks if not task.done]
+        for index, matches, error in results:
+            self.remaining -= 1
+            document = self.documents[index]
+            if not kate.objectIsAlive(document):
+                continue
+            if error is not None:
+                sys.stderr.write(error)
+                self.skipped.append(document)
+            elif matches:
+                if self.replacement is not None and not self._replace(index, matches):
+                    self.skipped.append(document)
+                    continue
+                self.results[index] = matches
+                self.emit(QtCore.SIGNAL('found(PyQt_PyObject, PyQt_PyObject)'), document, matches)
+        if not self.remaining:
+            self.emit(QtCore.SIGNAL('finished()'))
+        else:
+            self._submit()
+
+    def _replace(self, index, matches):
+        edit = kate.edit(self.documents[index])
+        snapshot = self.snapshots[index]
+        if edit.snapshot is not snapshot and edit.snapshot.text != snapshot.text:
+            # changed since it was searched
+            return False
+        for start, end, line, column, text in matches:
+            edit.replaceBetween(start, end, text)
+        edit.apply()
+        return True
+
+
+def search(pattern, flags=re.UNICODE, documents=None):
+    ''' Start searching documents (all open documents by default) for
+    pattern and return the Search '''
+    return Search(pattern, flags, None, documents).start()
+
+def replace(pattern, replacement, flags=re.UNICODE, documents=None):
+    ''' Start replacing pattern with replacement in documents (all open
+    documents by default) and return the Search '''
+    return Search(pattern, flags, replacement, documents).start()
+
+
+class ResultsView(QtGui.QTreeWidget):
+    ''' Lists the matches of a Search as they come in, grouped by document.
+    Activating a match moves the cursor to it. '''
+    def __init__(self, parent=None):
+        QtGui.QTreeWidget.__init__(self, parent)
+        self.setHeaderHidden(True)
+        self.setUniformRowHeights(True)
+        self.search = None
+        self.connect(self, QtCore.SIGNAL('itemActivated(QTreeWidgetItem*, int)'), self.activate)
+
+    def setSearch(self, search):
+        ''' List the matches of search instead of the previous one '''
+        if self.search is not None:
+            self.disconnect(self.search, QtCore.SIGNAL('found(PyQt_PyObject, PyQt_PyObject)'), self.found)
+        self.clear()
+        self.search = search
+        self.connect(search, QtCore.SIGNAL('found(PyQt_PyObject, PyQt_PyObject)'), self.found)
+        for index, matches in sorted(search.results.items()):
+            self.found(search.documents[index], matches)
+
+    def found(self, document, matches):
+        item = QtGui.QTreeWidgetItem(self, [u'%s (%d)' % (document.documentName(), len(matches))])
+        item.document = document
+        for start, end, line, column, text in matches:
+            child = QtGui.QTreeWidgetItem(item, [u'%d: %s' % (line + 1, text.strip())])
+            child.document = document
+            child.position = line, column
+        item.setExpanded(self.topLevelItemCount() == 1)
+
+    def activate(self, item, column):
+        position = getattr(item, 'position', None)
+        if position is None or not kate.objectIsAlive(item.document):
+            return
+        view = kate.application.activeMainWindow().activateView(item.document)
+        if view is not None:
+            view.setCursorPosition(kate.KTextEditor.Cursor(*position))
+            view.setFocus()
+
+
+_toolView = None
+_resultsView = None
+
+def showResults(search):
+    ''' Show the matches of search in the search results tool view at the
+    bottom of the main window, creating it if need be '''
+    global _toolView, _resultsView
+    window = kate.mainInterfaceWindow()
+    if _toolView is None or not kate.objectIsAlive(_toolView):
+        _toolView = window.createToolView('pate_search_results', kate.Kate.MainWindow.Bottom, gui.loadIcon('edit-find'), 'Search Results')
+        _resultsView = ResultsView(_toolView)
+    _resultsView.setSearch(search)
+    window.showToolView(_toolView)
+    return _resultsView
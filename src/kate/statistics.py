@@ -0,0 +1,152 @@
+''' Timing statistics for event listeners and actions. Every listener call
+and action invocation made through the kate package is counted and timed
+per callable, with a latency histogram; kate.stats() returns the figures.
+
+If statisticsExport is set to a number of seconds in the [pate] group of
+paterc, the figures are also written to a text file that often (by default
+statistics.txt in Kate's local pate data directory, or statisticsFile if
+set) in the Prometheus text format so that monitoring can scrape them. '''
+
+import bisect
+import functools
+import os
+import time
+import traceback
+
+from PyQt4 import QtCore
+
+
+''' Upper bounds of the latency histogram buckets, in seconds. Calls that
+take longer go into a last, unbounded bucket '''
+buckets = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0)
+
+
+class CallStatistics(object):
+    ''' How often one callable was called and how long it took '''
+    __slots__ = ('calls', 'total', 'max', 'histogram')
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.histogram = [0] * (len(buckets) + 1)
+    
+    def record(self, elapsed):
+        self.calls += 1
+        self.total += elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+        self.histogram[bisect.bisect_left(buckets, elapsed)] += 1
+
+
+# (kind, event, callable name) => CallStatistics
+_statistics = {}
+
+def callableName(f):
+    return '%s.%s' % (getattr(f, '__module__', '?'), getattr(f, '__name__', repr(f)))
+
+def record(kind, event, name, elapsed):
+    ''' Count one call of the callable called name, which took elapsed
+    seconds. kind is "listener" or "action"; event is the name of the event
+    or the text of the action '''
+    key = (kind, event, name)
+    try:
+        statistics = _statistics[key]
+    except KeyError:
+        statistics = _statistics[key] = CallStatistics()
+    statistics.record(elapsed)
+
+def call(kind, event, f, *args, **kwargs):
+    ''' Call f, recording how long it took. Exceptions are passed on '''
+    start = time.time()
+    try:
+        return f(*args, **kwargs)
+    finally:
+        record(kind, event, callableName(f), time.time() - start)
+
+def timed(kind, event, f):
+    ''' A function that calls f, recording how long each call took '''
+    name = callableName(f)
+    def wrapper(*args, **kwargs):
+        start = time.time()
+        try:
+            return f(*args, **kwargs)
+        finally:
+            record(kind, event, name, time.time() - start)
+    functools.update_wrapper(wrapper, f)
+    return wrapper
+
+def snapshot():
+    ''' The statistics as a list of dictionaries, most time consuming first.
+    Times are in seconds; "histogram" is a list of (upper bound, calls) with
+    None as the bound of the last bucket '''
+    result = []
+    for (kind, event, name), s in _statistics.items():
+        result.append({
+            'kind': kind,
+            'event': event,
+            'name': name,
+            'calls': s.calls,
+            'total': s.total,
+            'max': s.max,
+            'mean': s.total / s.calls,
+            'histogram': zip(buckets + (None,), s.histogram),
+        })
+    result.sort(key=lambda entry: entry['total'], reverse=True)
+    return result
+
+def reset():
+    ''' Forget all statistics '''
+    _statistics.clear()
+
+def _label(value):
+    return unicode(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def export(path):
+    ''' Write the statistics to path in the Prometheus text format. The file
+    is replaced in one go, so readers never see half of it '''
+    lines = [
+        '# Pate listener and action statistics, written %s' % time.strftime('%Y-%m-%d %H:%M:%S'),
+        '# TYPE pate_call_seconds histogram',
+    ]
+    # the lines of a metric family must be together
+    maxima = ['# TYPE pate_call_seconds_max gauge']
+    for (kind, event, name), s in sorted(_statistics.items()):
+        labels = 'kind="%s",event="%s",callable="%s"' % (_label(kind), _label(event), _label(name))
+        cumulative = 0
+        for bound, count in zip(buckets, s.histogram):
+            cumulative += count
+            lines.append('pate_call_seconds_bucket{%s,le="%g"} %d' % (labels, bound, cumulative))
+        lines.append('pate_call_seconds_bucket{%s,le="+Inf"} %d' % (labels, s.calls))
+        lines.append('pate_call_seconds_sum{%s} %.6f' % (labels, s.total))
+        lines.append('pate_call_seconds_count{%s} %d' % (labels, s.calls))
+        maxima.append('pate_call_seconds_max{%s} %.6f' % (labels, s.max))
+    lines.extend(maxima)
+    temporary = path + '.tmp'
+    f = open(temporary, 'w')
+    try:
+        f.write('\n'.join(lines).encode('utf-8') + '\n')
+    finally:
+        f.close()
+    os.rename(temporary, path)
+
+
+_exportTimer = None
+
+def startExport(path, interval):
+    ''' Export the statistics to path every interval seconds '''
+    global _exportTimer
+    stopExport()
+    def write():
+        try:
+            export(path)
+        except (IOError, OSError):
+            traceback.print_exc()
+    _exportTimer = QtCore.QTimer()
+    _exportTimer.connect(_exportTimer, QtCore.SIGNAL('timeout()'), write)
+    _exportTimer.start(int(interval * 1000))
+
+def stopExport():
+    global _exportTimer
+    if _exportTimer is not None:
+        _exportTimer.stop()
+        _exportTimer = None
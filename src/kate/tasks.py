@@ -0,0 +1,227 @@
+''' Cooperative tasks: long-running work split into small steps that run on
+Kate's main thread in between events, so that the editor stays responsive
+while the work is free to use documents and widgets.
+
+A task is a generator that yields whenever it is safe to pause. What it
+yields reports its progress: a number between 0 and 1, a message, a
+(number, message) pair or None for no news. To produce a result, raise
+StopIteration(result). For example
+
+    def countLines():
+        documents = kate.documentManager.documents()
+        total = 0
+        for i, document in enumerate(documents):
+            total += document.lines()
+            yield float(i + 1) / len(documents)
+        raise StopIteration(total)
+
+    kate.tasks.spawn(countLines(), name='Counting lines').then(showTotal)
+
+The scheduler runs steps of the waiting tasks, most urgent first and taking
+turns within a priority, until its budget for a slice of time is used up,
+and then lets Kate handle events before it carries on. Idle tasks only run
+once there has been no keyboard or mouse input for a while. '''
+
+import collections
+import sys
+import time
+
+from PyQt4 import QtCore
+
+from kate import gui
+from kate import threads
+
+
+''' Task priorities. Tasks of a higher priority always go first '''
+HIGH, NORMAL, LOW = 0, 1, 2
+
+_inputEvents = frozenset([
+    QtCore.QEvent.KeyPress, QtCore.QEvent.KeyRelease,
+    QtCore.QEvent.MouseButtonPress, QtCore.QEvent.MouseButtonRelease,
+    QtCore.QEvent.MouseButtonDblClick, QtCore.QEvent.Wheel,
+])
+
+
+class Task(threads.Job):
+    ''' A generator being run by the scheduler. Do not create your own; use
+    spawn(). Like a kate.threads.Job, use then() to get at the result. '''
+    def __init__(self, scheduler, generator, priority, idle, name):
+        threads.Job.__init__(self, None, (), {})
+        self.scheduler = scheduler
+        self.generator = generator
+        self.priority = priority
+        self.idle = idle
+        self.name = name
+        self.started = time.time()
+        # the last reported progress (between 0 and 1, or None) and message
+        self.progress = None
+        self.message = None
+        self.popup = None
+        self.running = False
+
+    def cancel(self):
+        ''' Stop the task. The generator is closed, so its finally clauses
+        run; callbacks are not called '''
+        if self.done or self.cancelled:
+            return
+        self.cancelled = True
+        if not self.running:
+            # a task cancelling itself is closed once its step is over
+            self.generator.close()
+        self._finished()
+
+    def _report(self, value):
+        if value is None:
+            return
+        if isinstance(value, basestring):
+            self.message = value
+        elif isinstance(value, tuple):
+            self.progress, self.message = value
+        else:
+            self.progress = value
+        if self.popup is not None:
+            self.popup.setProgress(self.progress or 0, self.message)
+
+    def _finished(self):
+        self.done = True
+        if self.popup is not None:
+            self.popup.finish()
+            self.popup = None
+        self._deliver()
+
+
+class _InputFilter(QtCore.QObject):
+    # notes the time of the last keyboard or mouse input
+    def __init__(self):
+        QtCore.QObject.__init__(self)
+        self.lastInput = time.time()
+
+    def eventFilter(self, obj, event):
+        if event.type() in _inputEvents:
+            self.lastInput = time.time()
+        return False
+
+
+class Scheduler(object):
+    ''' Runs tasks in slices of at most budget seconds. Idle tasks wait for
+    idleDelay seconds without input; tasks with a name show their progress
+    in a popup once they have been running for progressDelay seconds. '''
+    def __init__(self, budget=0.01, idleDelay=0.5, progressDelay=1.0):
+        self.budget = budget
+        self.idleDelay = idleDelay
+        self.progressDelay = progressDelay
+        # priority => tasks taking turns
+        self.queues = dict((priority, collections.deque()) for priority in (HIGH, NORMAL, LOW))
+        self.idleTasks = collections.deque()
+        # the task taking its step, which is in no queue meanwhile
+        self.current = None
+        self.timer = QtCore.QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.connect(self.timer, QtCore.SIGNAL('timeout()'), self.run)
+        # only installed while idle tasks are waiting: it sees every event
+        self.inputFilter = None
+
+    def spawn(self, generator, priority=NORMAL, idle=False, name=None):
+        ''' Run a generator as a task and return the Task. Give it a name to
+        have its progress shown if it takes a while '''
+        task = Task(self, generator, priority, idle, name)
+        if idle:
+            self.idleTasks.append(task)
+        else:
+            self.queues[priority].append(task)
+        self._schedule()
+        return task
+
+    def cancelAll(self):
+        ''' Cancel every task that has not finished yet, including the one
+        calling this, if any '''
+        if self.current is not None:
+            # closed once its step is over rather than queued again
+            self.current.cancel()
+        for queue in self.queues.values() + [self.idleTasks]:
+            while queue:
+                queue.popleft().cancel()
+        self._schedule()
+
+    def run(self):
+        deadline = time.time() + self.budget
+        while time.time() < deadline:
+            task = self._next()
+            if task is None:
+                break
+            self._step(task)
+        self._schedule()
+
+    def _isIdle(self):
+        return self.inputFilter is not None and time.time() - self.inputFilter.lastInput >= self.idleDelay
+
+    def _next(self):
+        for priority in (HIGH, NORMAL, LOW):
+            queue = self.queues[priority]
+            while queue:
+                task = queue.popleft()
+                if not task.cancelled:
+                    return task
+        while self.idleTasks and self._isIdle():
+            task = self.idleTasks.popleft()
+            if not task.cancelled:
+                return task
+        return None
+
+    def _step(self, task):
+        task.running = True
+        self.current = task
+        try:
+            value = task.generator.next()
+        except StopIteration, e:
+            task.result = e.args[0] if e.args else None
+            task._finished()
+            return
+        except:
+            task.error = sys.exc_info()
+            task._finished()
+            return
+        finally:
+            task.running = False
+            self.current = None
+        if task.cancelled:
+            task.generator.close()
+            return
+        task._report(value)
+        if task.name is not None and task.popup is None and time.time() - task.started >= self.progressDelay:
+            task.popup = gui.progressPopup(task.name, icon='view-process-system')
+            task.popup.setProgress(task.progress or 0, task.message)
+        if task.idle:
+            self.idleTasks.append(task)
+        else:
+            self.queues[task.priority].append(task)
+
+    def _schedule(self):
+        if any(self.queues.values()):
+            self._setInputFilter(bool(self.idleTasks))
+            self.timer.start(0)
+        elif self.idleTasks:
+            self._setInputFilter(True)
+            wait = self.idleDelay - (time.time() - self.inputFilter.lastInput)
+            self.timer.start(max(0, int(wait * 1000)))
+        else:
+            self._setInputFilter(False)
+            self.timer.stop()
+
+    def _setInputFilter(self, installed):
+        application = QtCore.QCoreApplication.instance()
+        if installed and self.inputFilter is None:
+            self.inputFilter = _InputFilter()
+            application.installEventFilter(self.inputFilter)
+        elif not installed and self.inputFilter is not None:
+            application.removeEventFilter(self.inputFilter)
+            self.inputFilter = None
+
+
+''' The scheduler shared by all plugins '''
+scheduler = Scheduler()
+
+def spawn(generator, priority=NORMAL, idle=False, name=None):
+    ''' Run a generator as a task on the shared scheduler, see
+    Scheduler.spawn() '''
+    return scheduler.spawn(generator, priority, idle, name)
@@ -0,0 +1,143 @@
+''' Running work on background threads. Plugins hand a function to a thread
+pool and get its result back on Kate's main thread, delivered through a
+queued Qt signal, so that result callbacks are free to touch the user
+interface. Only work that spends its time outside of the Python interpreter
+(I/O, C extensions that release the GIL, subprocesses) actually runs in
+parallel with the editor. '''
+
+import sys
+import threading
+import traceback
+import Queue
+
+from PyQt4 import QtCore
+
+
+class Job(object):
+    ''' A function call that is waiting for, running on or finished on a
+    worker thread. Do not create your own; use submit() '''
+    def __init__(self, func, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.callbacks = []
+        self.errbacks = []
+        self.done = False
+        self.cancelled = False
+        self.result = None
+        # sys.exc_info() of the failure, if the call raised
+        self.error = None
+
+    def then(self, callback, errback=None):
+        ''' Call callback(result) on the main thread once the job has
+        finished. If the job raised an exception, errback(type, value,
+        traceback) is called instead; without an errback the traceback is
+        printed to standard error. Returns the job so calls can be chained. '''
+        if callback is not None:
+            self.callbacks.append(callback)
+        if errback is not None:
+            self.errbacks.append(errback)
+        if self.done:
+            # already delivered; we are on the main thread, so just do it
+            self._deliver()
+        return self
+
+    def cancel(self):
+        ''' Stop the job from running if it has not started yet. A job that
+        is already running finishes, but its callbacks are not called '''
+        self.cancelled = True
+
+    def _deliver(self):
+        callbacks, self.callbacks = self.callbacks, []
+        errbacks, self.errbacks = self.errbacks, []
+        if self.cancelled:
+            return
+        if self.error is None:
+            for callback in callbacks:
+                try:
+                    callback(self.result)
+                except:
+                    traceback.print_exc()
+        elif errbacks:
+            for errback in errbacks:
+                try:
+                    errback(*self.error)
+                except:
+                    traceback.print_exc()
+        else:
+            traceback.print_exception(*self.error)
+
+
+class _Notifier(QtCore.QObject):
+    # lives on the main thread. Worker threads emit through it, and the
+    # queued connection makes Qt run the slot in the main thread's event loop
+    def __init__(self):
+        QtCore.QObject.__init__(self)
+        self.connect(self, QtCore.SIGNAL('jobFinished(PyQt_PyObject)'), self.jobFinished, QtCore.Qt.QueuedConnection)
+
+    def jobFinished(self, job):
+        job.done = True
+        job._deliver()
+
+
+class ThreadPool(object):
+    ''' A fixed number of daemon worker threads, started on demand, that
+    run submitted jobs in order. Create it on the main thread. '''
+    def __init__(self, size=4):
+        self.size = size
+        self.queue = Queue.Queue()
+        self.threads = []
+        # jobs currently on a worker thread
+        self.running = set()
+        self.notifier = _Notifier()
+
+    def submit(self, func, *args, **kwargs):
+        ''' Run func(*args, **kwargs) on a worker thread. Returns a Job;
+        use its then() method to get at the result. '''
+        job = Job(func, args, kwargs)
+        if len(self.threads) < self.size:
+            thread = threading.Thread(target=self._work, name='kate.threads worker %d' % len(self.threads))
+            thread.setDaemon(True)
+            self.threads.append(thread)
+            thread.start()
+        self.queue.put(job)
+        return job
+
+    def cancelPending(self):
+        ''' Cancel every job that has not finished yet '''
+        while True:
+            try:
+                job = self.queue.get_nowait()
+            except Queue.Empty:
+                break
+            job.cancel()
+        for job in list(self.running):
+            job.cancel()
+
+    def _work(self):
+        while True:
+            job = self.queue.get()
+            if job.cancelled:
+                continue
+            self.running.add(job)
+            try:
+                job.result = job.func(*job.args, **job.kwargs)
+            except:
+                job.error = sys.exc_info()
+            self.running.discard(job)
+            # the job may be kept around by the plugin; do not keep the call's
+            # arguments alive with it
+            job.func = job.args = job.kwargs = None
+            self.notifier.emit(QtCore.SIGNAL('jobFinished(PyQt_PyObject)'), job)
+
+
+''' The thread pool shared by all plugins '''
+pool = ThreadPool()
+
+def submit(func, *args, **kwargs):
+    ''' Run func(*args, **kwargs) on the shared thread pool and return its
+    Job, e.g.
+
+        kate.threads.submit(urllib.urlopen, url).then(showPage)
+    '''
+    return pool.submit(func, *args, **kwargs)
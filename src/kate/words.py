@@ -0,0 +1,204 @@
+''' An index of the words in all open documents, for completion and for
+finding where a word is used without scanning every document. Documents
+are indexed by an idle kate.tasks task; after that, only the lines touched
+by an edit are looked at again.
+
+The index maps each word to the documents it occurs in and keeps the words
+in order, so that looking up the words starting with a prefix is a binary
+search. Words are runs of letters, digits and underscores that start with a
+letter or an underscore and are at least two characters long. '''
+
+import bisect
+import re
+
+import kate
+from kate import documents
+from kate import tasks
+
+
+_wordPattern = re.compile(r'[^\W\d]\w+', re.UNICODE)
+# shared by all lines without words
+_noWords = ()
+
+def _lineWords(line):
+    words = _wordPattern.findall(line)
+    return tuple(set(words)) if words else _noWords
+
+
+class WordIndex(object):
+    ''' The words of all open documents. Use kate.wordIndex() rather than
+    creating your own. '''
+    # lines to index between pauses
+    step = 500
+
+    def __init__(self):
+        # word => {document address: number of lines it is on}
+        self.postings = {}
+        # all words in postings, sorted
+        self.words = []
+        # document address => document
+        self.documents = {}
+        # document address => the words of each line, for indexed documents
+        self.lines = {}
+        # document address => document, waiting to be indexed
+        self.pending = {}
+        self.task = None
+
+    def start(self):
+        kate._textInserted(self._inserted)
+        kate._textRemoved(self._removed)
+        kate.documentCreated(self._add)
+        kate.documentWillBeDeleted(self._forget)
+        # the text replaced wholesale: index the document again
+        kate._documentReloaded(self._add)
+        kate._documentUrlChanged(self._add)
+        for document in kate.documentManager.documents():
+            self._add(document)
+
+    def isListening(self):
+        # Pate drops all listeners when it is unloaded
+        return self._inserted in kate._textInserted.functions
+
+    def isReady(self):
+        ''' Whether every open document has been indexed '''
+        return not self.pending
+
+    def complete(self, prefix, limit=None):
+        ''' The words that start with prefix, in order; at most limit of
+        them if given '''
+        prefix = unicode(prefix)
+        words = self.words
+        start = bisect.bisect_left(words, prefix)
+        # every word starting with prefix sorts before prefix + U+FFFF
+        end = bisect.bisect_left(words, prefix + u'\uffff', start)
+        if limit is not None:
+            end = min(end, start + limit)
+        return words[start:end]
+
+    def documentsContaining(self, word):
+        ''' The documents word occurs in '''
+        return [self.documents[key] for key in self.postings.get(unicode(word), ())]
+
+    def linesContaining(self, document, word):
+        ''' The numbers of the lines of document that word occurs on '''
+        word = unicode(word)
+        lines = self.lines.get(documents._key(document), ())
+        return [number for number, words in enumerate(lines) if word in words]
+
+    def _replaceLines(self, key, first, last, new):
+        # replace the words of lines first up to last with those in new
+        lines = self.lines[key]
+        delta = {}
+        for words in lines[first:last]:
+            for word in words:
+                delta[word] = delta.get(word, 0) - 1
+        for words in new:
+            for word in words:
+                delta[word] = delta.get(word, 0) + 1
+        added = []
+        removed = []
+        for word, change in delta.iteritems():
+            if not change:
+                continue
+            postings = self.postings.get(word)
+            if postings is None:
+                postings = self.postings[word] = {}
+                added.append(word)
+            count = postings.get(key, 0) + change
+            if count > 0:
+                postings[key] = count
+                continue
+            postings.pop(key, None)
+            if not postings:
+                del self.postings[word]
+                removed.append(word)
+        lines[first:last] = new
+        # keep the words sorted. Many at a time, as when a document is
+        # indexed, are merged in rather than inserted one by one
+        if len(added) < 32:
+            for word in added:
+                bisect.insort(self.words, word)
+        else:
+            added.sort()
+            # sorting two sorted runs merges them
+            self.words = sorted(self.words + added)
+        if len(removed) < 32:
+            for word in removed:
+                del self.words[bisect.bisect_left(self.words, word)]
+        else:
+            removed = set(removed)
+            self.words = [word for word in self.words if word not in removed]
+
+    def _add(self, document):
+        key = documents._key(document)
+        self.documents[key] = document
+        if key in self.lines:
+            # start over
+            self._replaceLines(key, 0, len(self.lines[key]), [])
+            del self.lines[key]
+        self.pending[key] = document
+        if self.task is None or self.task.done:
+            self.task = tasks.spawn(self._build(), tasks.LOW, idle=True)
+
+    def _forget(self, document):
+        key = documents._key(document)
+        if key in self.lines:
+            self._replaceLines(key, 0, len(self.lines[key]), [])
+            del self.lines[key]
+        self.pending.pop(key, None)
+        self.documents.pop(key, None)
+
+    def _build(self):
+        while self.pending:
+            key, document = self.pending.popitem()
+            snapshot = kate.snapshot(document)
+            lines = []
+            number = 0
+            while number < snapshot.lines():
+                lines.append(_lineWords(snapshot.line(number)))
+                number += 1
+                if number % self.step == 0:
+                    yield
+                    if key not in self.documents or key in self.pending:
+                        # closed, or queued again
+                        break
+                    if snapshot.revision is not None and documents.revision(document) != snapshot.revision:
+                        # changed while being indexed: start over
+                        snapshot = kate.snapshot(document)
+                        lines = []
+                        number = 0
+            else:
+                self.lines[key] = []
+                self._replaceLines(key, 0, 0, lines)
+            yield
+
+    def _update(self, document, first, last, newLast):
+        # lines first up to last became lines first up to newLast
+        key = documents._key(document)
+        if key not in self.lines:
+            return
+        new = [_lineWords(unicode(document.line(number))) for number in xrange(first, newLast)]
+        self._replaceLines(key, first, last, new)
+        if len(self.lines[key]) != document.lines():
+            # missed a change (e.g a reload): index the document again
+            self._add(document)
+
+    def _inserted(self, document, range):
+        startLine, startColumn, endLine, endColumn = range
+        self._update(document, startLine, startLine + 1, endLine + 1)
+
+    def _removed(self, document, range):
+        startLine, startColumn, endLine, endColumn = range
+        self._update(document, startLine, endLine + 1, startLine + 1)
+
+
+_index = None
+
+def index():
+    ''' The shared WordIndex, which is started the first time it is asked
+    for '''
+    global _index
+    if _index is None or not _index.isListening():
+        _index = WordIndex()
+        _index.start()
+    return _index
@@ -0,0 +1,83 @@
+''' Builds the Pate bundle: a zip archive holding the kate package, the
+bundled plugins and their expansion files, each with its byte code, so that
+Kate imports all of them from a single archive instead of from source
+directories. The source is stored next to the byte code so that zipimport
+can fall back to it if the byte code was made by a different Python.
+
+Next to the archive, a small KConfig file (<archive>.info) lists the plugins
+inside it for the engine, which cannot look into the archive itself.
+
+Usage: makebundle.py <source directory> <archive> [<installed archive path>]
+
+The installed archive path, if given, is used for file names in tracebacks. '''
+
+import imp
+import marshal
+import os
+import struct
+import sys
+import time
+import zipfile
+
+
+def dosTime(mtime):
+    ''' The modification time as stored in a zip archive (local time, even
+    seconds) and the timestamp zipimport will compare byte code against '''
+    t = time.localtime(mtime)
+    dateTime = t[:5] + (t[5] - t[5] % 2,)
+    return dateTime, int(time.mktime(dateTime + (0, 0, -1)))
+
+def addModule(archive, sourcePath, archiveName, installedArchive):
+    ''' Add sourcePath as archiveName + '.py' along with its byte code '''
+    f = open(sourcePath, 'rU')
+    try:
+        source = f.read()
+    finally:
+        f.close()
+    dateTime, timestamp = dosTime(os.path.getmtime(sourcePath))
+    fileName = os.path.join(installedArchive, archiveName + '.py')
+    code = compile(source + '\n', fileName, 'exec')
+    archive.writestr(zipfile.ZipInfo(archiveName + '.py', dateTime), source)
+    byteCode = imp.get_magic() + struct.pack('<I', timestamp) + marshal.dumps(code)
+    archive.writestr(zipfile.ZipInfo(archiveName + '.pyc', dateTime), byteCode)
+
+def main(sourceDirectory, archivePath, installedArchive=None):
+    installedArchive = installedArchive or archivePath
+    plugins = []
+    archive = zipfile.ZipFile(archivePath, 'w', zipfile.ZIP_DEFLATED)
+    try:
+        # the kate package
+        packageDirectory = os.path.join(sourceDirectory, 'kate')
+        for name in sorted(os.listdir(packageDirectory)):
+            if name.endswith('.py'):
+                addModule(archive, os.path.join(packageDirectory, name), 'kate/' + name[:-3], installedArchive)
+        # plugins, and the modules that live alongside package plugins, at
+        # the top level just as they are importable from the plugin
+        # directories. Expansion files go into expansions/
+        pluginDirectory = os.path.join(sourceDirectory, 'plugins')
+        for name in sorted(os.listdir(pluginDirectory)):
+            path = os.path.join(pluginDirectory, name)
+            if name.endswith('.py'):
+                plugins.append(name[:-3])
+                addModule(archive, path, name[:-3], installedArchive)
+            elif os.path.isfile(os.path.join(path, name + '.py')):
+                plugins.append(name)
+                for fileName in sorted(os.listdir(path)):
+                    if fileName.endswith('.py'):
+                        addModule(archive, os.path.join(path, fileName), fileName[:-3], installedArchive)
+                    elif fileName.endswith('.expand'):
+                        addModule(archive, os.path.join(path, fileName), 'expansions/' + fileName[:-7], installedArchive)
+    finally:
+        archive.close()
+    info = open(archivePath + '.info', 'w')
+    try:
+        info.write('[Bundle]\nPlugins=%s\n' % ','.join(plugins))
+    finally:
+        info.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (3, 4):
+        sys.stderr.write(__doc__)
+        sys.exit(1)
+    main(*sys.argv[1:])
@@ -1,6 +1,7 @@
 
 #include "plugin.h"
 #include "engine.h"
+#include "dispatcher.h"
 #include "utilities.h"
 
 #include <kate/application.h>
@@ -39,12 +40,16 @@ Pate::Plugin::Plugin(QObject *parent, const QStringList &) : Kate::Plugin((Kate:
 }
 
 Pate::Plugin::~Plugin() {
+    // Kate is shutting down: write out configuration changes that are
+    // still waiting for the save timer
+    Pate::Engine::self()->flushConfiguration();
 //     Pate::Engine::self()->del();
 }
 
 
 Kate::PluginView *Pate::Plugin::createView(Kate::MainWindow *window) {
     Pate::Engine::self()->loadPlugins();
+    Pate::Engine::self()->dispatcher()->attach(window);
     return new Pate::PluginView(window);
 }
 
@@ -0,0 +1,192 @@
+
+#include <QDir>
+#include <QFileInfo>
+#include <QFile>
+#include <QDateTime>
+#include <QStringList>
+
+#include <kconfig.h>
+#include <kconfiggroup.h>
+#include <kstandarddirs.h>
+#include <kdebug.h>
+
+#include "pluginindex.h"
+
+// bump whenever the layout of the index file changes
+#define PATE_INDEX_VERSION 2
+
+
+static bool locationLessThan(const Pate::PluginLocation &a, const Pate::PluginLocation &b) {
+    return a.name < b.name;
+}
+
+// whether a file can be imported as a module, and under which name
+static bool isModuleFile(const QFileInfo &info, QString *name) {
+    QString suffix = info.suffix();
+    if(suffix != "py" && suffix != "pyc" && suffix != "pyo" && suffix != "so")
+        return false;
+    *name = info.completeBaseName();
+    // foomodule.so is importable as foo
+    if(suffix == "so" && name->endsWith("module"))
+        name->chop(6);
+    return !name->contains('.');
+}
+
+static bool isPackageDirectory(const QString &path) {
+    return QFile::exists(path + "/__init__.py") || QFile::exists(path + "/__init__.pyc");
+}
+
+// the names that would be importable if directory were on sys.path
+static QStringList importableNames(const QString &directory) {
+    QStringList names;
+    foreach(QFileInfo info, QDir(directory).entryInfoList(QDir::NoDotAndDotDot | QDir::Dirs | QDir::Files)) {
+        QString name;
+        if(info.isDir()) {
+            if(isPackageDirectory(info.absoluteFilePath()))
+                names.append(info.fileName());
+        }
+        else if(isModuleFile(info, &name)) {
+            names.append(name);
+        }
+    }
+    names.removeDuplicates();
+    return names;
+}
+
+Pate::PluginIndex::PluginIndex() {
+    m_index = new KConfig(KStandardDirs::locateLocal("cache", "pate/plugins.index"), KConfig::SimpleConfig);
+    KConfigGroup general = m_index->group("Index");
+    if(general.readEntry("Version", 0) != PATE_INDEX_VERSION) {
+        kDebug() << "Discarding plugin index";
+        foreach(QString group, m_index->groupList())
+            m_index->deleteGroup(group);
+        m_index->group("Index").writeEntry("Version", PATE_INDEX_VERSION);
+    }
+}
+
+Pate::PluginIndex::~PluginIndex() {
+    delete m_index;
+}
+
+uint Pate::PluginIndex::stableModificationTime(const QString &path) {
+    uint modified = QFileInfo(path).lastModified().toTime_t();
+    // modification times only have a resolution of a second. Something that
+    // changes later in the second we looked at it would go unnoticed, so
+    // make sure anything that recent is scanned again next time
+    if(modified >= QDateTime::currentDateTime().toTime_t())
+        return 0;
+    return modified;
+}
+
+bool Pate::PluginIndex::probePackage(const QString &directory, const QString &name, PluginLocation *location) {
+    QFileInfo info(directory + "/" + name + "/" + name + ".py");
+    if(!info.exists())
+        return false;
+    location->name = name;
+    location->path = info.absoluteFilePath();
+    location->kind = "package";
+    location->modified = info.lastModified().toTime_t();
+    return true;
+}
+
+QList<Pate::PluginLocation> Pate::PluginIndex::plugins(const QDir &directory) {
+    QString directoryPath = directory.absolutePath();
+    m_seen.append(directoryPath);
+    KConfigGroup group = m_index->group(directoryPath);
+    KConfigGroup pluginGroup = group.group("Plugins");
+    KConfigGroup subdirectoryGroup = group.group("Directories");
+    // "." => names importable from the directory itself, <subdirectory> =>
+    // names importable from a plugin package directory
+    KConfigGroup moduleGroup = group.group("Modules");
+    uint modified = QFileInfo(directoryPath).lastModified().toTime_t();
+    if(modified == 0 || group.readEntry("Modified", 0u) != modified) {
+        // files were added or removed: list the directory from scratch
+        kDebug() << "Indexing" << directoryPath;
+        pluginGroup.deleteGroup();
+        subdirectoryGroup.deleteGroup();
+        moduleGroup.deleteGroup();
+        QStringList names;
+        foreach(QFileInfo info, directory.entryInfoList(QDir::NoDotAndDotDot | QDir::Dirs | QDir::Files)) {
+            QString name = info.fileName();
+            PluginLocation location;
+            if(info.isDir()) {
+                subdirectoryGroup.writeEntry(name, stableModificationTime(info.absoluteFilePath()));
+                if(isPackageDirectory(info.absoluteFilePath()))
+                    names.append(name);
+                if(!probePackage(directoryPath, name, &location))
+                    continue;
+                moduleGroup.writeEntry(name, importableNames(info.absoluteFilePath()));
+            }
+            else if(isModuleFile(info, &name)) {
+                names.append(name);
+                if(info.suffix() != "py")
+                    continue;
+                location.name = name;
+                location.path = info.absoluteFilePath();
+                location.kind = "module";
+                location.modified = info.lastModified().toTime_t();
+            }
+            else {
+                continue;
+            }
+            pluginGroup.writeEntry(location.name, QStringList() << location.path << location.kind << QString::number(location.modified));
+        }
+        names.removeDuplicates();
+        moduleGroup.writeEntry(".", names);
+        group.writeEntry("Modified", stableModificationTime(directoryPath));
+    }
+    else {
+        // the directory listing is unchanged, but a subdirectory may have
+        // gained or lost its plugin or its __init__.py
+        QStringList names = moduleGroup.readEntry(".", QStringList());
+        foreach(QString name, subdirectoryGroup.keyList()) {
+            QString path = directoryPath + "/" + name;
+            if(subdirectoryGroup.readEntry(name, 0u) == QFileInfo(path).lastModified().toTime_t())
+                continue;
+            kDebug() << "Indexing" << path;
+            PluginLocation location;
+            if(probePackage(directoryPath, name, &location)) {
+                pluginGroup.writeEntry(location.name, QStringList() << location.path << location.kind << QString::number(location.modified));
+                moduleGroup.writeEntry(name, importableNames(path));
+            }
+            else {
+                pluginGroup.deleteEntry(name);
+                moduleGroup.deleteEntry(name);
+            }
+            names.removeAll(name);
+            if(isPackageDirectory(path))
+                names.append(name);
+            subdirectoryGroup.writeEntry(name, stableModificationTime(path));
+        }
+        moduleGroup.writeEntry(".", names);
+    }
+    QList<PluginLocation> locations;
+    m_modules[directoryPath] = moduleGroup.readEntry(".", QStringList());
+    foreach(QString name, pluginGroup.keyList()) {
+        QStringList entry = pluginGroup.readEntry(name, QStringList());
+        if(entry.size() != 3)
+            continue;
+        PluginLocation location;
+        location.name = name;
+        location.path = entry[0];
+        location.kind = entry[1];
+        location.modified = entry[2].toUInt();
+        locations.append(location);
+        if(location.kind == "package")
+            m_modules[QFileInfo(location.path).path()] = moduleGroup.readEntry(name, QStringList());
+    }
+    qSort(locations.begin(), locations.end(), locationLessThan);
+    return locations;
+}
+
+QStringList Pate::PluginIndex::modules(const QString &directory) const {
+    return m_modules.value(directory);
+}
+
+void Pate::PluginIndex::sync() {
+    foreach(QString group, m_index->groupList()) {
+        if(group != "Index" && !m_seen.contains(group))
+            m_index->deleteGroup(group);
+    }
+    m_index->sync();
+}
@@ -0,0 +1,65 @@
+#ifndef PATE_PLUGININDEX_H
+#define PATE_PLUGININDEX_H
+
+#include <QString>
+#include <QStringList>
+#include <QList>
+#include <QHash>
+
+class QDir;
+class KConfig;
+
+
+namespace Pate {
+
+/// A plugin found in one of the Pate directories
+struct PluginLocation {
+    /// The name the plugin is imported as
+    QString name;
+    /// The .py file that is imported
+    QString path;
+    /// "module" for a plain .py file, "package" for a <dir>/<dir>.py plugin,
+    /// "bundle" for a plugin from the precompiled bundle
+    QString kind;
+    /// Modification time of path when it was indexed
+    uint modified;
+};
+
+/**
+ * The PluginIndex remembers which plugins (and which other importable
+ * modules) live in which Pate directory across sessions so that the directories do not have to be listed and
+ * probed every time Kate starts. Each directory is validated by its
+ * modification time and that of its subdirectories; only the parts that
+ * changed are scanned again.
+ */
+class PluginIndex {
+public:
+    PluginIndex();
+    ~PluginIndex();
+
+    /// The plugins in directory, sorted by name
+    QList<PluginLocation> plugins(const QDir &directory);
+
+    /// The names of the modules and packages that can be imported from a
+    /// directory: one that was passed to plugins() or the directory of a
+    /// package plugin it returned
+    QStringList modules(const QString &directory) const;
+
+    /// Forget directories that were not asked about since the index was
+    /// opened and write the index to disk
+    void sync();
+
+private:
+    // look for <directory>/<name>/<name>.py
+    static bool probePackage(const QString &directory, const QString &name, PluginLocation *location);
+    // a modification time that is safe to compare against next session
+    static uint stableModificationTime(const QString &path);
+
+    KConfig *m_index;
+    QStringList m_seen;
+    QHash<QString, QStringList> m_modules;
+};
+
+} // namespace Pate
+
+#endif
@@ -6,10 +6,25 @@ import os
 import sys
 import re
 import imp
+import math
 import time
+import bisect
+import difflib
+import struct
+import hashlib
+import marshal
+import zipimport
 import traceback
 
-from PyKDE4.kdecore import KConfig
+import sip
+
+import kate.documents
+import kate.tasks
+
+import snippets
+
+from PyQt4 import QtGui
+from PyKDE4.kdecore import KConfig, KStandardDirs
 
 
 class ParseError(Exception):
@@ -77,18 +92,77 @@ def wordAndArgumentAtCursorRanges(document, cursor):
     return word_range, argument_range
 
 
-def matchingParenthesisPosition(document, position, opening='('):
+bracketPattern = re.compile(u'[()"\']')
+
+def lineBrackets(line):
+    ''' The parentheses on a line that are not inside a string, as (column,
+    character). Strings do not continue past the end of a line '''
+    brackets = []
+    state = None
+    for match in bracketPattern.finditer(line):
+        character = match.group()
+        if state is not None:
+            if character == state:
+                state = None
+        elif character in ('"', "'"):
+            state = character
+        else:
+            brackets.append((match.start(), character))
+    return brackets
+
+# the parentheses of each line of each document, kept up to date as lines
+# are edited
+bracketLines = kate.documents.LineCache(lineBrackets)
+
+# the most lines to look through the index for a partner; beyond that the
+# text is scanned
+bracketSearchLines = 1000
+
+def indexedPartner(document, position, opening='('):
+    ''' The (line, column) of the parenthesis that pairs with the one at
+    position, from the bracket index, or None if the index does not know
+    the one at position or no partner is found nearby. Only the lines
+    between the two are looked at. '''
+    lines = bracketLines.values(document)
+    number, column = position.line(), position.column()
+    if number >= len(lines) or (column, opening) not in lines[number]:
+        return None
+    if opening == '(':
+        step, last = 1, min(len(lines), number + bracketSearchLines)
+        # the parentheses on the line after the one at position
+        brackets = [b for b in lines[number] if b[0] > column]
+    else:
+        step, last = -1, max(-1, number - bracketSearchLines)
+        brackets = [b for b in reversed(lines[number]) if b[0] < column]
+    level = 1
+    while True:
+        for bracketColumn, character in brackets:
+            level += 1 if character == opening else -1
+            if not level:
+                return number, bracketColumn
+        number += step
+        if number == last:
+            return None
+        brackets = lines[number] if step == 1 else reversed(lines[number])
+
+def scanForParenthesis(document, position, opening='('):
+    # walk the text from the parenthesis at position. Used for those the
+    # index does not know of, such as one after a stray apostrophe
     closing = ')' if opening == '(' else '('
     delta = 1 if opening == '(' else -1
-    # take a copy, Cursors are mutable
-    position = position.__class__(position)
+    # one copy of the text rather than a round trip per character
+    snapshot = kate.snapshot(document)
+    text = snapshot.text
+    offset = snapshot.offset(position)
     
     level = 0
     state = None
-    while 1:
-        character = unichr(document.character(position).unicode())
-        # print 'character:', repr(character)
-        if state in ('"', "'"):
+    while 0 <= offset < len(text):
+        character = text[offset]
+        if character == '\n':
+            if state in ('"', "'"):
+                raise ParseError('end of line while searching for %s' % state)
+        elif state in ('"', "'"):
             if character == state:
                 state = None
         else:
@@ -98,34 +172,187 @@ def matchingParenthesisPosition(document, position, opening='('):
                 level -= 1
                 if level == 0:
                     if closing == ')':
-                        position.setColumn(position.column() + delta)
-                    break
+                        offset += delta
+                    return position.__class__(*snapshot.position(offset))
             elif character in ('"', "'"):
                 state = character
-        
-        position.setColumn(position.column() + delta)
-        # must we move down a line?
-        if document.character(position).isNull():
-            position.setPosition(position.line() + delta, 0)
-            if delta == -1:
-                # move to the far right
-                position.setColumn(document.lineLength(position.line()) - 1)
-            # failure again => EOF
-            if document.character(position).isNull():
-                raise ParseError('end of file reached')
-            else:
-                if state in ('"', "'"):
-                    raise ParseError('end of line while searching for %s' % state)
-    return position
+        offset += delta
+    raise ParseError('end of file reached')
+
+def matchingParenthesisPosition(document, position, opening='('):
+    ''' The position just after the parenthesis that closes the one at
+    position or, if opening is ')', the position of the one that opens
+    it '''
+    partner = indexedPartner(document, position, opening)
+    if partner is None:
+        # the index tracks strings from the start of each line, so a quote
+        # in a comment or in prose hides the parentheses after it; and the
+        # partner may be further away than is worth walking the index for
+        return scanForParenthesis(document, position, opening)
+    line, column = partner
+    if opening == '(':
+        column += 1
+    return position.__class__(line, column)
 
-# map of 'all' => {'name': func1, ....}
-# map of 'mime/type' => {'name': func1, 'name2': func2}
+# map of 'all' => ({'name': func1, ....}, files)
+# map of 'mime/type' => ({'name': func1, 'name2': func2}, files)
+# where files are the (path, modification time, size) of the expansion files
+# the functions were loaded from. Entries are only used while the files are
+# unchanged
 expansionCache = {}
+# map of 'mime/type' => Expansions
+expansionTableCache = {}
 
 
-def loadFileExpansions(path):
+class ExpansionLayer(dict):
+    ''' The expansions of one mime type (or 'all'): name => function, with
+    the names kept sorted for looking them up by prefix '''
+    def __init__(self, expansions=()):
+        dict.__init__(self, expansions)
+        self.names = sorted(self)
+
+    def complete(self, prefix):
+        start = bisect.bisect_left(self.names, prefix)
+        end = bisect.bisect_left(self.names, prefix + u'\uffff', start)
+        return self.names[start:end]
+
+
+class Expansions(object):
+    ''' The expansions available in documents of one mime type: layers of
+    expansions, most specific first, looked through in turn. The global
+    layer is shared by every mime type rather than copied into each. '''
+    def __init__(self, *layers):
+        self.layers = layers
+        self._names = None
+        # length => names of that length
+        self._byLength = None
+
+    def get(self, name, default=None):
+        for layer in self.layers:
+            if name in layer:
+                return layer[name]
+        return default
+
+    def __getitem__(self, name):
+        for layer in self.layers:
+            if name in layer:
+                return layer[name]
+        raise KeyError(name)
+
+    def __contains__(self, name):
+        return any(name in layer for layer in self.layers)
+
+    def names(self):
+        ''' All expansion names, sorted '''
+        if self._names is None:
+            if len(self.layers) == 1:
+                self._names = self.layers[0].names
+            else:
+                self._names = sorted(set().union(*[layer.names for layer in self.layers]))
+        return self._names
+
+    def complete(self, prefix, limit=None):
+        ''' The names starting with prefix, sorted; at most limit of them if
+        given '''
+        if len(self.layers) == 1:
+            names = self.layers[0].complete(prefix)
+        else:
+            names = sorted(set().union(*[layer.complete(prefix) for layer in self.layers]))
+        return names[:limit] if limit is not None else names
+
+    def suggestions(self, word, limit=5, cutoff=0.6):
+        ''' The names most like word, best first. Names starting with the
+        same character as word are preferred '''
+        if self._byLength is None:
+            self._byLength = {}
+            for name in self.names():
+                self._byLength.setdefault(len(name), []).append(name)
+        # difflib's ratio is at most 2 * shorter / (sum of the lengths), so
+        # names much shorter or longer than word cannot reach cutoff
+        shortest = int(math.ceil(len(word) * cutoff / (2 - cutoff) - 1e-9))
+        longest = int(len(word) * (2 - cutoff) / cutoff + 1e-9)
+        candidates = [name for length in xrange(shortest, longest + 1) for name in self._byLength.get(length, ())]
+        alike = [name for name in candidates if name[:1] == word[:1]]
+        return (difflib.get_close_matches(word, alike, limit, cutoff)
+            or difflib.get_close_matches(word, candidates, limit, cutoff))
+
+
+def expansionFiles(mimeFileName):
+    files = []
+    for directory in kate.applicationDirectories('expand'):
+        path = os.path.join(directory, mimeFileName)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        files.append((path, stat.st_mtime, stat.st_size))
+    return tuple(files)
+
+def compileExpansionFile(path, mtime, size):
+    ''' The code of an expansion file. The byte code is cached in Kate's cache
+    directory and used for as long as the file is unchanged '''
+    cacheName = '%s-%s.pyc' % (os.path.basename(path), hashlib.md5(path.encode('utf-8')).hexdigest()[:8])
+    cachePath = unicode(KStandardDirs.locateLocal('cache', 'pate/expansions/' + cacheName))
+    header = imp.get_magic() + struct.pack('<II', int(mtime) & 0xffffffff, size & 0xffffffff)
+    try:
+        f = open(cachePath, 'rb')
+        try:
+            data = f.read()
+        finally:
+            f.close()
+        if data[:len(header)] == header:
+            return marshal.loads(data[len(header):])
+    except (IOError, EOFError, ValueError, TypeError):
+        pass
+    f = open(path, 'rU')
+    try:
+        source = f.read()
+    finally:
+        f.close()
+    code = compile(source + '\n', path, 'exec')
+    try:
+        temporaryPath = cachePath + '.new'
+        f = open(temporaryPath, 'wb')
+        try:
+            f.write(header + marshal.dumps(code))
+        finally:
+            f.close()
+        os.rename(temporaryPath, cachePath)
+    except (IOError, OSError):
+        traceback.print_exc()
+    return code
+
+def loadFileExpansions(path, mtime=None, size=None):
+    if mtime is None:
+        stat = os.stat(path)
+        mtime, size = stat.st_mtime, stat.st_size
     name = os.path.basename(path).split('.')[0]
-    module = imp.load_source(name, path)
+    module = imp.new_module(name)
+    module.__file__ = path
+    exec compileExpansionFile(path, mtime, size) in module.__dict__
+    return moduleExpansions(module)
+
+def loadBundledExpansions(mimeFileName):
+    ''' Expansions compiled into the bundle (see kate.bundle()) for the
+    given expansion file name, or None if the bundle has none '''
+    if not kate.bundle():
+        return None
+    try:
+        importer = zipimport.zipimporter(os.path.join(kate.bundle(), 'expansions'))
+        name = mimeFileName[:-len('.expand')]
+        if importer.find_module(name) is None:
+            return None
+        code = importer.get_code(name)
+    except zipimport.ZipImportError:
+        return None
+    # run like an expansion file, not imported: the names (e.g 'all') would
+    # clash with real modules in sys.modules
+    module = imp.new_module(name)
+    module.__file__ = code.co_filename
+    exec code in module.__dict__
+    return moduleExpansions(module)
+
+def moduleExpansions(module):
     expansions = {}
     # expansions are everything that don't begin with '__' and are callable
     for name in dir(module):
@@ -138,18 +365,54 @@ def loadFileExpansions(path):
             expansions[o.__name__] = o
     return expansions
 
+def loadMimeExpansions(mime):
+    ''' The expansions for the given mime type alone '''
+    # explicit is better than implicit
+    mimeFileName = mime.replace('/', '_') + '.expand'
+    files = expansionFiles(mimeFileName)
+    cached = expansionCache.get(mime)
+    if cached is not None and cached[1] == files:
+        return cached[0]
+    expansions = {}
+    for path, mtime, size in files:
+        expansions.update(loadFileExpansions(path, mtime, size))
+    if not files:
+        # expansion files in the plugin directories take precedence
+        # over the precompiled ones shipped in the bundle
+        expansions = loadBundledExpansions(mimeFileName) or {}
+    expansions = ExpansionLayer(expansions)
+    expansionCache[mime] = expansions, files
+    return expansions
+
 def loadExpansions(mime):
-    if mime not in expansionCache:
-        expansions = {}
-        # explicit is better than implicit
-        mimeFileName = mime.replace('/', '_') + '.expand'
-        for directory in kate.applicationDirectories('expand'):
-            if os.path.exists(os.path.join(directory, mimeFileName)):
-                expansions.update(loadFileExpansions(os.path.join(directory, mimeFileName)))
-        # load global expansions if necessary``
-        expansionCache[mime] = loadExpansions('all') if mime != 'all' else {}
-        expansionCache[mime].update(expansions)
-    return expansionCache[mime]
+    ''' The expansions for the given mime type, including the global ones.
+    Expansion files that changed since they were last loaded are loaded
+    again '''
+    layers = (loadMimeExpansions('all'),)
+    if mime != 'all':
+        layers = (loadMimeExpansions(mime),) + layers
+    table = expansionTableCache.get(mime)
+    if table is None or any(a is not b for a, b in zip(table.layers, layers)):
+        table = expansionTableCache[mime] = Expansions(*layers)
+    return table
+
+# the task loading the expansions of the open documents, once started
+prewarmTask = None
+
+def prewarmExpansions():
+    ''' Load the expansions for the open documents, a mime type at a time
+    while Kate is idle, so that the first expansion in each does not have
+    to. Done once, on first use: an init listener would have the plugin
+    imported at start-up even when it is loaded lazily '''
+    global prewarmTask
+    if prewarmTask is not None:
+        return
+    def prewarm():
+        mimeTypes = set(str(document.mimeType()) for document in kate.documentManager.documents())
+        for mime in mimeTypes:
+            yield
+            loadExpansions(mime)
+    prewarmTask = kate.tasks.spawn(prewarm(), kate.tasks.LOW, idle=True)
 
 
 def indentationCharacters(document):
@@ -191,6 +454,38 @@ def indentationCharacters(document):
             return ' ' * indentationCharacters.configurationIndentWidth
 
 
+def chooseName(view, title, names):
+    ''' Let the user pick one of names from a menu at the cursor '''
+    menu = QtGui.QMenu(view)
+    menu.addAction(title).setEnabled(False)
+    menu.addSeparator()
+    actions = {}
+    for name in names:
+        actions[menu.addAction(name)] = name
+    chosen = menu.exec_(view.mapToGlobal(view.cursorPositionCoordinates()))
+    return actions.get(chosen)
+
+def suggestExpansions(view, word_range, word, expansions):
+    ''' Offer the expansions starting with word or, if there are none, the
+    ones with similar names. The chosen one replaces word and is
+    expanded '''
+    names = expansions.complete(word, 20) if word else []
+    title = 'Expansions starting with "%s"' % word
+    if not names:
+        names = expansions.suggestions(word) if word else []
+        title = 'Expansion "%s" not found. Did you mean' % word
+    if not names:
+        kate.gui.popup('Expansion "%s" not found :(' % word, timeout=3, icon='dialog-warning', minTextWidth=200)
+        return
+    name = chooseName(view, title, names)
+    if name is None:
+        return
+    document = view.document()
+    document.replaceText(word_range, name)
+    view.setCursorPosition(kate.KTextEditor.Cursor(word_range.start().line(), word_range.start().column() + len(name)))
+    expandAtCursor()
+
+
 @kate.action('Expand', shortcut='Ctrl+E', menu='Edit')
 def expandAtCursor():
     document = kate.activeDocument()
@@ -203,10 +498,11 @@ def expandAtCursor():
     word = unicode(document.text(word_range))
     mime = str(document.mimeType())
     expansions = loadExpansions(mime)
+    prewarmExpansions()
     try:
         func = expansions[word]
     except KeyError:
-        kate.gui.popup('Expansion "%s" not found :(' % word, timeout=3, icon='dialog-warning', minTextWidth=200)
+        suggestExpansions(view, word_range, word, expansions)
         return
     argument = ()
     if argument_range is not None:
@@ -245,48 +541,92 @@ def expandAtCursor():
         kate.gui.popup('<p style="white-space:pre">%s</p>' % s, icon='dialog-error', timeout=5, maxTextWidth=None, minTextWidth=300)
         return
     
+    hasStops = isinstance(replacement, snippets.Template)
     try:
         replacement = unicode(replacement)
     except UnicodeEncodeError:
         replacement = repr(replacement)
     #KateDocumentConfig::cfReplaceTabsDyn
     indentCharacters = indentationCharacters(document)
-    # convert newlines followed by tab characters to whatever spacing
-    # the user... uses.
-    for i in xrange(100):
-        if '\n' + (indentCharacters * i) + '\t' in replacement:
-            replacement = replacement.replace('\n' + (indentCharacters * i) + '\t', '\n' + (indentCharacters * (i + 1)))
     insertPosition = word_range.start()
     line = unicode(document.line(insertPosition.line()))
     # autoindent: add the line's leading whitespace for each newline
     # in the expansion
-    whitespace = ''
-    for character in line:
-        if character in ' \t':
-            whitespace += character
-        else:
-            break
-    replacement = replacement.replace('\n', '\n' + whitespace)
-    # cursor position set?
-    cursorAdvancement = None
-    if '\1' in replacement:
-        cursorAdvancement = replacement.index('\1')
-        # strip around that byte
-        replacement = replacement[:cursorAdvancement] + replacement[cursorAdvancement + 1:]
+    whitespace = re.match(u'[ \t]*', line).group()
+    # tab characters after newlines are converted to whatever spacing the
+    # user... uses.
+    text, stops = snippets.render(snippets.compile(replacement, hasStops), indentCharacters, whitespace)
     # make the removal and insertion an atomic operation
     document.startEditing()
     if argument_range is not None:
         document.removeText(argument_range)
     document.removeText(word_range)
-    document.insertText(insertPosition, replacement)
+    document.insertText(insertPosition, text)
     # end before moving the cursor to avoid a crash
     document.endEditing()
     
-    if cursorAdvancement is not None:
-        # print 'advancing', cursorAdvancement
-        smart = document.smartInterface().newSmartCursor(insertPosition)
-        smart.advance(cursorAdvancement)
-        view.setCursorPosition(smart)
+    start = insertPosition.line(), insertPosition.column()
+    startFields(view, [(snippets.position(start, text, offset), snippets.position(start, text, offset + length)) for number, offset, length in stops])
+
+
+# (view, start, end) of the tab stops of the last expansion still to be
+# visited, as smart cursors that follow the edits made in between
+pendingFields = []
+
+def releaseField(view, start, end):
+    # smart cursors are ours to delete. A closed document has deleted them
+    # already, as has a reloaded one (see forgetFields)
+    if kate.objectIsAlive(view):
+        for cursor in (start, end):
+            if not sip.isdeleted(cursor):
+                sip.delete(cursor)
+
+def endFields():
+    ''' Stop visiting the fields of the last expansion '''
+    fields = pendingFields[:]
+    del pendingFields[:]
+    for field in fields:
+        releaseField(*field)
+
+def forgetFields(document):
+    # the document dropped its smart cursors along with its text
+    if not pendingFields or not kate.objectIsAlive(pendingFields[0][0]):
+        return
+    if sip.unwrapinstance(pendingFields[0][0].document()) == sip.unwrapinstance(document):
+        del pendingFields[:]
+
+def selectField(view, start, end):
+    view.setCursorPosition(end)
+    if start != end:
+        view.setSelection(kate.KTextEditor.Range(start, end))
+
+def startFields(view, fields):
+    ''' Go to the first of fields, ((line, column), (line, column)) ranges,
+    and keep the others for Next Expansion Field '''
+    endFields()
+    if not fields:
+        return
+    if forgetFields not in kate._documentReloaded.functions:
+        # not when the plugin is imported: lazy loading could not wait for
+        # these events
+        kate._documentReloaded(forgetFields)
+        kate._documentUrlChanged(forgetFields)
+    smart = view.document().smartInterface()
+    for start, end in fields[1:]:
+        pendingFields.append((view, smart.newSmartCursor(kate.KTextEditor.Cursor(*start)), smart.newSmartCursor(kate.KTextEditor.Cursor(*end))))
+    start, end = fields[0]
+    selectField(view, kate.KTextEditor.Cursor(*start), kate.KTextEditor.Cursor(*end))
+
+@kate.action('Next Expansion Field', shortcut='Ctrl+Alt+E', menu='Edit')
+def nextField():
+    if pendingFields and not kate.objectIsAlive(pendingFields[0][0]):
+        endFields()
+    if not pendingFields or pendingFields[0][0] is not kate.activeView():
+        kate.gui.popup('No expansion fields left', timeout=2, icon='dialog-information', minTextWidth=200)
+        return
+    view, start, end = pendingFields.pop(0)
+    selectField(view, start, end)
+    releaseField(view, start, end)
 
 
 # kate: space-indent on;
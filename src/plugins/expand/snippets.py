@@ -0,0 +1,123 @@
+''' Compiled templates for the text expansions insert. In what an expansion
+returns, the tabs at the start of a line are levels of indentation, which
+become whatever the document indents with, and the first '\1' marks where
+the cursor goes. Lines after the first also get the indentation of the line
+the expansion is made on.
+
+Expansions decorated with @snippets.template can use tab stops as well:
+${1}, ${2:placeholder} and so on are visited in order, with the placeholder
+selected, and ${0} is visited last. '$$' is a dollar sign. For example
+
+    import snippets
+
+    @snippets.template
+    def fore(s):
+        return 'for ${1:item} in %s:\n\t${0}' % s
+
+A template is parsed once into a list of instructions, which are cached;
+rendering is a single pass over them. '''
+
+import collections
+import functools
+import re
+
+
+TEXT, LINE, STOP = range(3)
+
+# a line break with the tabs after it, and the cursor marker
+_cursorPattern = re.compile(u'\n(\t*)|\x01')
+# and the tab stops
+_stopPattern = re.compile(u'\n(\t*)|\x01|\\$\\$|\\$\\{(\\d+)(?::([^}]*))?\\}')
+
+# (text, with stops) => instructions, least recently used first
+_cache = collections.OrderedDict()
+# cache at most this many templates
+cacheSize = 256
+
+
+class Template(unicode):
+    ''' The text of an expansion that uses tab stops '''
+
+
+def template(func):
+    ''' Decorator for expansions that return templates with tab stops '''
+    @functools.wraps(func)
+    def expansion(*args):
+        return Template(func(*args))
+    return expansion
+
+
+def _compile(text, stops):
+    # instructions are (TEXT, text, None), (LINE, levels of indentation,
+    # None) and (STOP, number, placeholder)
+    instructions = []
+    append = instructions.append
+    position = 0
+    cursor = False
+    for match in (_stopPattern if stops else _cursorPattern).finditer(text):
+        start = match.start()
+        if start > position:
+            append((TEXT, text[position:start], None))
+        position = match.end()
+        token = match.group()
+        if token[0] == u'\n':
+            append((LINE, len(token) - 1, None))
+        elif token == u'\x01':
+            # only the first one ever counted
+            if not cursor:
+                append((STOP, 0, u''))
+                cursor = True
+        elif token == u'$$':
+            append((TEXT, u'$', None))
+        else:
+            append((STOP, int(match.group(2)), match.group(3) or u''))
+    if position < len(text):
+        append((TEXT, text[position:], None))
+    return instructions
+
+def compile(text, stops=False):
+    ''' The instructions for text, which has tab stops if stops is true and
+    only a cursor marker otherwise '''
+    key = text, stops
+    instructions = _cache.pop(key, None)
+    if instructions is None:
+        instructions = _compile(text, stops)
+        if len(_cache) >= cacheSize:
+            _cache.popitem(last=False)
+    # most recently used again
+    _cache[key] = instructions
+    return instructions
+
+def render(instructions, indentation, whitespace=u''):
+    ''' The text of a compiled template and its tab stops as (number, offset,
+    length) in the order they are to be visited. indentation is what one
+    level of indentation becomes and whitespace starts every line but the
+    first. '''
+    parts = []
+    stops = []
+    offset = 0
+    # levels of indentation => line break
+    lineBreaks = {}
+    for kind, value, placeholder in instructions:
+        if kind == TEXT:
+            part = value
+        elif kind == LINE:
+            part = lineBreaks.get(value)
+            if part is None:
+                part = lineBreaks[value] = u'\n' + whitespace + indentation * value
+        else:
+            part = placeholder
+            stops.append((value, offset, len(part)))
+        parts.append(part)
+        offset += len(part)
+    # ${0} comes last
+    stops.sort(key=lambda stop: (stop[0] == 0, stop[0]))
+    return u''.join(parts), stops
+
+def position(start, text, offset):
+    ''' The (line, column) of offset into text inserted at start, a (line,
+    column) tuple '''
+    lines = text.count(u'\n', 0, offset)
+    if not lines:
+        return start[0], start[1] + offset
+    return start[0] + lines, offset - text.rfind(u'\n', 0, offset) - 1
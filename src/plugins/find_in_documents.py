@@ -0,0 +1,39 @@
+''' Find or replace a regular expression in all open documents at once. The
+matches are listed in a tool view as they are found; see kate.search. '''
+
+import re
+
+from PyQt4 import QtGui
+
+import kate
+import kate.gui
+import kate.search
+
+
+def askFor(title, label):
+    text, success = QtGui.QInputDialog.getText(kate.mainWindow(), title, label)
+    return unicode(text) if success else None
+
+def start(function, *args):
+    try:
+        search = function(*args)
+    except re.error, e:
+        kate.gui.popup('Bad regular expression: %s' % e, 3, icon='dialog-error', minTextWidth=200)
+        return
+    kate.search.showResults(search)
+
+
+@kate.action('Find in Open Documents...', icon='edit-find', menu='Edit')
+def findInDocuments():
+    pattern = askFor('Find in Open Documents', 'Regular expression:')
+    if pattern:
+        start(kate.search.search, pattern)
+
+@kate.action('Replace in Open Documents...', icon='edit-find-replace', menu='Edit')
+def replaceInDocuments():
+    pattern = askFor('Replace in Open Documents', 'Regular expression:')
+    if not pattern:
+        return
+    replacement = askFor('Replace in Open Documents', 'Replace with:')
+    if replacement is not None:
+        start(kate.search.replace, pattern, replacement)
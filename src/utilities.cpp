@@ -14,7 +14,22 @@
 #include "utilities.h"
 
 
-namespace Pate { namespace Py {
+namespace Pate {
+
+Stopwatch::Stopwatch() {
+    m_wall.start();
+    m_cpu = std::clock();
+}
+
+double Stopwatch::wall() const {
+    return m_wall.elapsed() / 1000.0;
+}
+
+double Stopwatch::cpu() const {
+    return double(std::clock() - m_cpu) / CLOCKS_PER_SEC;
+}
+
+namespace Py {
 
 PyObject *unicode(const QString &string) {
     PyObject *s = PyString_FromString(PQ(string));
@@ -37,11 +52,9 @@ bool call(PyObject *function, PyObject *arguments) {
 }
 
 bool call(PyObject *function) {
-    // Overload: call a Python callable with no arguments
-    PyObject *arguments = PyTuple_New(0);
-    bool result = call(function, arguments);
-    Py_DECREF(arguments);
-    return result;
+    // Overload: call a Python callable with no arguments. Python supplies
+    // its shared empty tuple when given none
+    return call(function, 0);
 }
 
 void appendStringToList(PyObject *list, const QString &value) {
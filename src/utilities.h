@@ -6,10 +6,19 @@
 
 #include "Python.h"
 
+#include <ctime>
+
+#include <QTime>
+
 class QString;
 class KConfigBase;
 
 
+// Release the global interpreter lock whenever Pate is not calling into
+// Python. Code that calls into Python from C++ must then hold the lock by
+// wrapping the calls in PyGILState_Ensure/PyGILState_Release
+#define THREADED 1
+
 // terminal colours
 #define TERMINAL_RED "\033[31m"
 #define TERMINAL_CLEAR "\033[0m"
@@ -17,7 +26,22 @@ class KConfigBase;
 // save us some ruddy time when printing out QStrings with UTF-8
 #define PQ(x) x.toUtf8().constData()
 
-namespace Pate { namespace Py {
+namespace Pate {
+
+/// Measures the wall clock and CPU time that passed since it was created
+class Stopwatch {
+public:
+    Stopwatch();
+    /// Wall clock time in seconds
+    double wall() const;
+    /// CPU time used by the process in seconds
+    double cpu() const;
+private:
+    QTime m_wall;
+    std::clock_t m_cpu;
+};
+
+namespace Py {
 
 /// Convert a QString to a Python unicode object
 PyObject *unicode(const QString &string);